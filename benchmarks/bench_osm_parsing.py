@@ -0,0 +1,86 @@
+"""Compare linear-scan and indexed resolution of Overpass responses.
+
+Run from the repository root:
+    python -m benchmarks.bench_osm_parsing [number_of_buildings] [overpass.json]
+
+Pass a recorded Overpass JSON response to replay it, otherwise a
+synthetic downtown response is generated.
+"""
+import json
+import sys
+import time
+
+from tests.synthetic import synthetic_overpass_response
+from utils.utils_osm import parseBuildingFootprints
+from utils.utils_pyproj import createCRS
+
+
+def resolve_linear(features: list[dict]) -> list[list[tuple]]:
+    """Previous implementation: scan all nodes for every node of every way."""
+    ways = []
+    ways_part = []
+    relations = []
+    nodes = []
+    for feature in features:
+        if feature["type"] == "way":
+            if "building" in feature.get("tags", {}):
+                ways.append(feature["nodes"])
+            else:
+                ways_part.append({"id": feature["id"], "nodes": feature["nodes"]})
+        elif feature["type"] == "relation":
+            relations.append(
+                [m["ref"] for m in feature["members"] if m["role"] == "outer"]
+            )
+        elif feature["type"] == "node" and "tags" not in feature:
+            nodes.append(feature)
+
+    for refs in relations:
+        full_node_list = []
+        for ref in refs:
+            for k, part in enumerate(ways_part):
+                if part["id"] == ref:
+                    full_node_list += part["nodes"]
+                    ways_part.pop(k)
+                    break
+        ways.append(full_node_list)
+
+    all_coords = []
+    for ids in ways:
+        coords = []
+        for node_id in ids[:-1]:
+            for node in nodes:
+                if node["id"] == node_id:
+                    coords.append((node["lat"], node["lon"]))
+                    break
+        all_coords.append(coords)
+    return all_coords
+
+
+def main(number_of_buildings: int = 5000, path: str | None = None):
+    """Time parsing a synthetic or a saved Overpass response."""
+    if path is None:
+        data = synthetic_overpass_response(51.5, -0.1, number_of_buildings)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+    features = data["elements"]
+    first_node = next(f for f in features if f["type"] == "node")
+    crs_to_use = createCRS(first_node["lat"], first_node["lon"])
+    print(f"{len(features)} elements")
+
+    start = time.perf_counter()
+    footprints, _ = parseBuildingFootprints(features, crs_to_use)
+    indexed = time.perf_counter() - start
+    print(
+        f"   indexed, with reprojection: {indexed:8.3f} s "
+        f"({len(footprints)} buildings)"
+    )
+
+    start = time.perf_counter()
+    resolve_linear(features)
+    linear = time.perf_counter() - start
+    print(f"linear scan, no reprojection: {linear:8.3f} s")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) if arg.isdigit() else arg for arg in sys.argv[1:]])
@@ -0,0 +1,63 @@
+"""Compare per-point and vectorized reprojection throughput.
+
+Run from the repository root:
+    python -m benchmarks.bench_reprojection [number_of_points]
+"""
+import sys
+import time
+
+import numpy as np
+from pyproj import Transformer
+
+from utils.utils_pyproj import createCRS, reprojectArrayToCrs, reprojectToCrs
+
+
+def reproject_uncached(lat: float, lon: float, crs_from, crs_to):
+    """Previous implementation: build a new Transformer for every point."""
+    transformer = Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    pt = transformer.transform(lon, lat)
+    return pt[0], pt[1]
+
+
+def points_per_second(func, count: int) -> float:
+    """Time func() once, as count points per second."""
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def main(number_of_points: int = 20000):
+    """Print the throughput of the uncached, cached and vectorized paths."""
+    rng = np.random.default_rng(0)
+    lats = 51.5 + rng.random(number_of_points) * 0.1
+    lons = -0.1 + rng.random(number_of_points) * 0.1
+    crs_to_use = createCRS(lats[0], lons[0])
+
+    # the uncached path is slow, so measure it on a sample
+    sample = min(number_of_points, 500)
+    results = {
+        "uncached, per point": points_per_second(
+            lambda: [
+                reproject_uncached(lat, lon, "EPSG:4326", crs_to_use)
+                for lat, lon in zip(lats[:sample], lons[:sample])
+            ],
+            sample,
+        ),
+        "cached, per point": points_per_second(
+            lambda: [
+                reprojectToCrs(lat, lon, "EPSG:4326", crs_to_use)
+                for lat, lon in zip(lats, lons)
+            ],
+            number_of_points,
+        ),
+        "cached, array": points_per_second(
+            lambda: reprojectArrayToCrs(lats, lons, "EPSG:4326", crs_to_use),
+            number_of_points,
+        ),
+    }
+    for name, value in results.items():
+        print(f"{name:>22}: {value:>14,.0f} points/s")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
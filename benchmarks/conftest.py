@@ -0,0 +1,104 @@
+"""Fixtures replaying the public services for the benchmarks."""
+import os
+import tracemalloc
+
+import pytest
+
+import utils.utils_cache as utils_cache
+import utils.utils_http as utils_http
+import utils.utils_tiles as utils_tiles
+from benchmarks.replay import FIXTURES_DIR, replay_session
+
+ROUTE_LENGTHS_KM = (1, 10, 100)
+# fewer timed rounds for longer routes, keeping the suite within minutes
+ROUNDS = {1: 5, 10: 3}
+
+
+def pytest_addoption(parser):
+    """Add the route lengths and fixtures folder options."""
+    parser.addoption(
+        "--route-lengths",
+        default=",".join(str(km) for km in ROUTE_LENGTHS_KM),
+        help="comma separated route lengths to benchmark, in km",
+    )
+    parser.addoption(
+        "--fixtures-dir",
+        default=os.environ.get("BENCHMARK_FIXTURES_DIR", FIXTURES_DIR),
+        help="folder of the recorded responses to replay",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    """Run the benchmarks taking route_km once per route length."""
+    if "route_km" in metafunc.fixturenames:
+        option = metafunc.config.getoption("route_lengths")
+        lengths = [int(km) for km in option.split(",") if km.strip()]
+        metafunc.parametrize(
+            "route_km", lengths, ids=[f"{km}km" for km in lengths], scope="session"
+        )
+
+
+def close_caches():
+    """Close the SQLite caches opened in this run."""
+    for cache in utils_cache._shared_caches.values():
+        if isinstance(cache, utils_cache.SQLiteCache):
+            cache.close()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def replay(request, tmp_path_factory):
+    """Answer all requests from the fixtures, with caches in a temporary folder."""
+    monkeypatch = pytest.MonkeyPatch()
+    session = replay_session(request.config.getoption("fixtures_dir"))
+    monkeypatch.setattr(utils_http, "_session", session)
+    cache_dir = str(tmp_path_factory.mktemp("cache"))
+    for module in (utils_cache, utils_tiles):
+        monkeypatch.setattr(module, "CACHE_DIR", cache_dir)
+    monkeypatch.setattr(utils_cache, "_shared_caches", {})
+    monkeypatch.setattr(utils_tiles, "_tile_store", None)
+    yield session
+    close_caches()
+    monkeypatch.undo()
+
+
+@pytest.fixture()
+def cold_caches(tmp_path_factory):
+    """Get a function emptying the elevation, tessellation, token and tile caches."""
+
+    def reset():
+        close_caches()
+        cache_dir = str(tmp_path_factory.mktemp("cache"))
+        utils_cache.CACHE_DIR = utils_tiles.CACHE_DIR = cache_dir
+        utils_cache._shared_caches.clear()
+        utils_tiles._tile_store = None
+        utils_tiles.decoded_tiles.clear()
+
+    return reset
+
+
+@pytest.fixture()
+def measure(benchmark, route_km, cold_caches):
+    """Get a function timing func(*args, **kwargs) and recording its peak memory.
+
+    With cold=True every round starts from empty caches. Peak memory is
+    traced in one more run, so tracing does not slow the timed rounds.
+    """
+
+    def run(group: str, func, *args, cold: bool = True, **kwargs):
+        benchmark.group = group
+        setup = cold_caches if cold else None
+        result = benchmark.pedantic(
+            func, args, kwargs, setup=setup, rounds=ROUNDS.get(route_km, 1)
+        )
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+            benchmark.extra_info["peak_memory_bytes"] = peak
+        finally:
+            tracemalloc.stop()
+        return result
+
+    return run
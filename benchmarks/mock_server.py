@@ -0,0 +1,215 @@
+"""Local stand-in for Strava, open-elevation, Overpass and the OSM tile server.
+
+Serves the responses of benchmarks/replay.py (stored fixtures, else
+synthetic terrain, buildings and tiles) with injected network conditions.
+Run from the repository root:
+    python -m benchmarks.mock_server --port 8080 --latency 0.08 --error-rate 0.02
+
+and point the function at it, with its own cache folder so synthetic
+data never mixes with real data:
+    STRAVA_AUTOMATE_STRAVA_URL=http://127.0.0.1:8080
+    STRAVA_AUTOMATE_ELEVATION_URL=http://127.0.0.1:8080/api/v1/lookup
+    STRAVA_AUTOMATE_OVERPASS_URL=http://127.0.0.1:8080/api/interpreter
+    STRAVA_AUTOMATE_TILE_URL=http://127.0.0.1:8080/{z}/{x}/{y}.png
+    STRAVA_AUTOMATE_CACHE_DIR=/tmp/strava_automate_mock
+"""
+import argparse
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.replay import FIXTURES_DIR, FixtureStore
+
+
+@dataclass
+class NetworkConditions:
+    """Network behaviour of the mock server; delays are in seconds."""
+
+    # delay before answering, normally distributed
+    latency: float = 0
+    jitter: float = 0
+    # 0 for unlimited
+    bytes_per_second: float = 0
+    # share of requests answered with 503, as by an overloaded server
+    error_rate: float = 0
+    # requests in progress beyond this get 429, like Overpass slots; 0 for unlimited
+    max_concurrent: int = 0
+    retry_after: int = 1
+    seed: int | None = None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Request handler answering from the fixtures of its MockServer."""
+
+    # keep connections open, as the public services do
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """Answer a GET request."""
+        self._answer()
+
+    def do_POST(self):
+        """Answer a POST request."""
+        self._answer()
+
+    def _answer(self):
+        server: MockServer = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not server.enter():
+            server.count("rejected")
+            self._send(429, b"{}", {"Retry-After": str(server.conditions.retry_after)})
+            return
+        try:
+            server.delay()
+            if server.fail():
+                server.count("errors")
+                self._send(503, b"{}")
+                return
+            url = f"http://{self.headers.get('Host', 'localhost')}{self.path}"
+            content = server.fixtures.respond(self.command, url, body)
+            if content is None:
+                self._send(404, b"{}")
+                return
+            server.count("requests")
+            server.count("bytes", len(content))
+            self._send(200, content, throttle=True)
+        finally:
+            server.leave()
+
+    def _send(self, status: int, content: bytes, headers=None, throttle=False):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        rate = self.server.conditions.bytes_per_second
+        if not throttle or rate <= 0:
+            self.wfile.write(content)
+            return
+        # send in slices of a tenth of a second
+        step = max(1, int(rate / 10))
+        for start in range(0, len(content), step):
+            self.wfile.write(content[start : start + step])
+            time.sleep(len(content[start : start + step]) / rate)
+
+    def log_message(self, format, *args):
+        """Keep the benchmark output quiet."""
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering like the public services.
+
+    Requests are delayed, failed or rejected under the given conditions.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        conditions: NetworkConditions | None = None,
+        fixtures_dir: str = FIXTURES_DIR,
+    ) -> None:
+        """Listen on address, answering from fixtures_dir under conditions."""
+        super().__init__(address, MockHandler)
+        self.conditions = conditions or NetworkConditions()
+        self.fixtures = FixtureStore(fixtures_dir)
+        self.stats = {"requests": 0, "bytes": 0, "errors": 0, "rejected": 0}
+        self._random = random.Random(self.conditions.seed)
+        self._lock = threading.Lock()
+        self._in_progress = 0
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self) -> dict[str, str]:
+        """Get the environment variables pointing the function at this server."""
+        return {
+            "STRAVA_AUTOMATE_STRAVA_URL": self.url,
+            "STRAVA_AUTOMATE_ELEVATION_URL": self.url + "/api/v1/lookup",
+            "STRAVA_AUTOMATE_OVERPASS_URL": self.url + "/api/interpreter",
+            "STRAVA_AUTOMATE_TILE_URL": self.url + "/{z}/{x}/{y}.png",
+        }
+
+    def enter(self) -> bool:
+        """Start a request, False if max_concurrent are already in progress."""
+        with self._lock:
+            limit = self.conditions.max_concurrent
+            if limit > 0 and self._in_progress >= limit:
+                return False
+            self._in_progress += 1
+            return True
+
+    def leave(self) -> None:
+        """Finish a request started with enter()."""
+        with self._lock:
+            self._in_progress -= 1
+
+    def delay(self) -> None:
+        """Wait for the latency plus jitter of one request."""
+        with self._lock:
+            delay = self._random.gauss(self.conditions.latency, self.conditions.jitter)
+        time.sleep(max(0, delay))
+
+    def fail(self) -> bool:
+        """Decide whether this request fails, at the error rate."""
+        with self._lock:
+            return self._random.random() < self.conditions.error_rate
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add value to the stat called name."""
+        with self._lock:
+            self.stats[name] += value
+
+
+def start_mock_server(
+    conditions: NetworkConditions | None = None,
+    fixtures_dir: str = FIXTURES_DIR,
+    port: int = 0,
+) -> MockServer:
+    """Start a mock server on a background thread; stop it with shutdown()."""
+    server = MockServer(("127.0.0.1", port), conditions, fixtures_dir)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """Serve until interrupted, under the conditions given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0, help="seconds")
+    parser.add_argument("--bytes-per-second", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--max-concurrent", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--fixtures-dir", default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    conditions = NetworkConditions(
+        latency=args.latency,
+        jitter=args.jitter,
+        bytes_per_second=args.bytes_per_second,
+        error_rate=args.error_rate,
+        max_concurrent=args.max_concurrent,
+        seed=args.seed,
+    )
+    server = MockServer(("127.0.0.1", args.port), conditions, args.fixtures_dir)
+    for name, value in server.environment().items():
+        print(f"{name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.stats)
+
+
+if __name__ == "__main__":
+    main()
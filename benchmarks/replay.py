@@ -0,0 +1,215 @@
+"""Replay Strava, open-elevation, Overpass and tile responses from local fixtures.
+
+Responses are stored in the fixtures folder as <service>/<request hash>.body,
+the hash covering the method, path, query and body of the request but
+not the host, so responses recorded from the public services are also
+served by the mock server, at any address. A request
+without a stored response gets a deterministic synthetic one instead:
+activity N is a winding route of N meters, elevations come from
+synthetic hills and buildings from a fixed lattice. Synthetic streams,
+Overpass responses and tiles are stored on first use, so later runs
+replay them from disk.
+
+benchmarks/mock_server.py serves the same responses over HTTP.
+
+With record=True, missing responses are fetched from the live services
+and stored, e.g. to replay a real activity:
+    session = replay_session("benchmarks/fixtures", record=True)
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from tests.synthetic import (
+    synthetic_elevation,
+    synthetic_overpass_area,
+    synthetic_strava_streams,
+    synthetic_tile_png,
+)
+from utils.utils_http import POOL_SIZE, USER_AGENT
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+SYNTHETIC_ACTIVITIES = (1_000, 10_000, 100_000)
+
+STREAMS_PATH = re.compile(r"/api/v3/activities/(\d+)/streams")
+TILE_PATH = re.compile(r"/(\d+)/(\d+)/(\d+)\.png")
+POLY_FILTER = re.compile(r'\(poly:"([^"]+)"\)')
+BBOX_FILTER = re.compile(r"\((-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)\)")
+
+
+class FixtureStore:
+    """Stored responses in a folder, falling back to synthetic ones."""
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR) -> None:
+        """Store responses under fixtures_dir."""
+        self.fixtures_dir = fixtures_dir
+
+    def path(self, method: str, url: str, body: bytes) -> str:
+        """Get the file of the request, in the folder of its service."""
+        parts = urlsplit(url)
+        target = parts.path + ("?" + parts.query if parts.query else "")
+        digest = hashlib.sha1(
+            method.encode() + b" " + target.encode() + b"\n" + body
+        ).hexdigest()
+        return os.path.join(self.fixtures_dir, service_name(url), f"{digest}.body")
+
+    def load(self, method: str, url: str, body: bytes) -> bytes | None:
+        """Get the stored response, None if there is none."""
+        path = self.path(method, url, body)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def save(self, method: str, url: str, body: bytes, content: bytes) -> None:
+        """Store the response of the request."""
+        path = self.path(method, url, body)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            f.write(content)
+        os.replace(path + ".part", path)
+
+    def respond(self, method: str, url: str, body: bytes) -> bytes | None:
+        """Get the stored response, or a synthetic one; None for unknown requests."""
+        content = self.load(method, url, body)
+        if content is not None:
+            return content
+        content, store = synthetic_response(method, url, body)
+        if store:
+            self.save(method, url, body, content)
+        return content
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Transport adapter answering requests from stored or synthetic responses."""
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR, record: bool = False):
+        """Answer from fixtures_dir, and with record, store real responses there."""
+        super().__init__(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.fixtures = FixtureStore(fixtures_dir)
+        self.record = record
+
+    def send(self, request, **kwargs):
+        """Answer the request from the fixtures, or the network when recording."""
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode()
+        stored = self.fixtures.load(request.method, request.url, body)
+        if self.record and stored is None:
+            response = super().send(request, **kwargs)
+            # tokens are never stored
+            if response.status_code == 200 and not request.url.endswith("/oauth/token"):
+                self.fixtures.save(request.method, request.url, body, response.content)
+            return response
+
+        content = self.fixtures.respond(request.method, request.url, body)
+        if content is None:
+            return self._response(request, 404, b"{}")
+        return self._response(request, 200, content)
+
+    def _response(self, request, status: int, body: bytes) -> requests.Response:
+        raw = urllib3.HTTPResponse(
+            body=io.BytesIO(body),
+            headers={"Content-Length": str(len(body))},
+            status=status,
+            preload_content=False,
+        )
+        return self.build_response(request, raw)
+
+
+def synthetic_response(method: str, url: str, body: bytes) -> tuple[bytes | None, bool]:
+    """Get a synthetic response body, and whether it is worth storing.
+
+    Requests are told apart by path, so one server can stand in for all
+    services; the body is None for unknown paths.
+    """
+    url = urlsplit(url)
+    query = parse_qs(url.query)
+    streams_match = STREAMS_PATH.fullmatch(url.path)
+    tile_match = TILE_PATH.fullmatch(url.path)
+    if url.path == "/oauth/token":
+        return json.dumps(replay_token()).encode(), False
+    if streams_match:
+        keys = query.get("keys", ["latlng"])[0].split(",")
+        streams = synthetic_strava_streams(int(streams_match.group(1)))
+        # like Strava, distance comes with any requested stream
+        streams = [s for s in streams if s["type"] in keys + ["distance"]]
+        return json.dumps(streams).encode(), True
+    if url.path == "/api/v3/athlete/activities":
+        page = int(query.get("page", ["1"])[0])
+        activities = [{"id": i} for i in SYNTHETIC_ACTIVITIES] if page == 1 else []
+        return json.dumps(activities).encode(), False
+    if url.path == "/api/v1/lookup":
+        locations = json.loads(body)["locations"]
+        lats = [location["latitude"] for location in locations]
+        lons = [location["longitude"] for location in locations]
+        results = [
+            {"latitude": lat, "longitude": lon, "elevation": elevation}
+            for lat, lon, elevation in zip(
+                lats, lons, synthetic_elevation(lats, lons).tolist()
+            )
+        ]
+        return json.dumps({"results": results}).encode(), False
+    if url.path == "/api/interpreter":
+        overpass_query = parse_qs(body.decode())["data"][0]
+        response = synthetic_overpass_area(overpass_rings(overpass_query))
+        return json.dumps(response).encode(), True
+    if tile_match:
+        return synthetic_tile_png(*map(int, tile_match.groups())), True
+    return None, False
+
+
+def service_name(url: str) -> str:
+    """Get the service answering a URL from its path, whatever the host."""
+    path = urlsplit(url).path
+    if path == "/oauth/token" or path.startswith("/api/v3/"):
+        return "strava"
+    if path == "/api/v1/lookup":
+        return "elevation"
+    if path == "/api/interpreter":
+        return "overpass"
+    if TILE_PATH.fullmatch(path):
+        return "tiles"
+    return urlsplit(url).hostname or "unknown"
+
+
+def replay_token() -> dict:
+    """Get an OAuth token that stays valid for the whole run."""
+    return {
+        "token_type": "Bearer",
+        "access_token": "replay",
+        "refresh_token": "replay",
+        "expires_at": int(time.time()) + 6 * 3600,
+    }
+
+
+def overpass_rings(query: str) -> list[list[tuple[float, float]]]:
+    """Get the (lat, lon) outlines of the area filters of an Overpass query."""
+    rings = []
+    for coords in dict.fromkeys(POLY_FILTER.findall(query)):
+        values = [float(value) for value in coords.split()]
+        rings.append(list(zip(values[::2], values[1::2])))
+    for south, west, north, east in dict.fromkeys(BBOX_FILTER.findall(query)):
+        south, west, north, east = map(float, (south, west, north, east))
+        rings.append([(south, west), (north, west), (north, east), (south, east)])
+    return rings
+
+
+def replay_session(
+    fixtures_dir: str = FIXTURES_DIR, record: bool = False
+) -> requests.Session:
+    """Get a session like the shared one, answering from the replay adapter."""
+    session = requests.Session()
+    adapter = ReplayAdapter(fixtures_dir, record)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    return session
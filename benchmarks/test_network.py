@@ -0,0 +1,72 @@
+"""Throughput of the HTTP stages against the mock server, by concurrency.
+
+The mock server adds latency, jitter and errors to every request, so
+these show how many concurrent requests pay off, e.g. to tune
+ELEVATION_CONCURRENCY and TILE_CONCURRENCY. Run from the repository root:
+    python -m pytest benchmarks/test_network.py
+"""
+import numpy as np
+import pytest
+
+import utils.utils_http as utils_http
+from benchmarks.mock_server import NetworkConditions, start_mock_server
+from utils.utils_elevation import fetch_elevation_from_points
+from utils.utils_tiles import TILE_ZOOM, TileStore
+
+# a distant public API, overloaded now and then
+CONDITIONS = NetworkConditions(latency=0.08, jitter=0.02, error_rate=0.02, seed=0)
+WORKERS = [1, 2, 4, 8, 16]
+ROUNDS = 3
+
+
+@pytest.fixture(scope="module")
+def mock_server(request):
+    """A mock server under CONDITIONS, for the whole module."""
+    server = start_mock_server(CONDITIONS, request.config.getoption("fixtures_dir"))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def live_session(monkeypatch, mock_server):
+    """Send requests over real connections, to the mock server."""
+    monkeypatch.setattr(utils_http, "_session", None)
+    monkeypatch.setattr(
+        "utils.utils_elevation.ELEVATION_URL", mock_server.url + "/api/v1/lookup"
+    )
+    return mock_server
+
+
+@pytest.mark.parametrize("workers", WORKERS)
+def test_elevation_concurrency(benchmark, live_session, workers):
+    """20000 points in 40 requests."""
+    rng = np.random.default_rng(0)
+    points = np.column_stack(
+        [51.5 + rng.random(20000) * 0.1, -0.1 + rng.random(20000) * 0.1]
+    ).tolist()
+    benchmark.group = "elevation requests"
+    benchmark.pedantic(
+        fetch_elevation_from_points, (points, 500, workers), rounds=ROUNDS
+    )
+    benchmark.extra_info["server"] = dict(live_session.stats)
+
+
+@pytest.mark.parametrize("workers", WORKERS)
+def test_tile_concurrency(benchmark, live_session, workers, tmp_path_factory):
+    """64 tiles into an empty tile store."""
+    tiles = [(TILE_ZOOM, 130000 + x, 86000 + y) for x in range(8) for y in range(8)]
+
+    def empty_store():
+        store = TileStore(
+            str(tmp_path_factory.mktemp("tiles")),
+            url=live_session.url + "/{z}/{x}/{y}.png",
+            max_workers=workers,
+        )
+        return (store,), {}
+
+    benchmark.group = "tile downloads"
+    benchmark.pedantic(
+        lambda store: store.prefetch(tiles), setup=empty_store, rounds=ROUNDS
+    )
+    benchmark.extra_info["server"] = dict(live_session.stats)
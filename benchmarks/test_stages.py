@@ -0,0 +1,158 @@
+"""Benchmarks of each pipeline stage at several route lengths.
+
+Requests are answered from recorded or synthetic fixtures (see
+benchmarks/replay.py), so only our own code is timed. Run from the
+repository root:
+    python -m pytest benchmarks --route-lengths=1,10,100
+
+Each stage is a group with one row per route length, to compare how it
+scales; peak traced memory is in the extra info, e.g. with
+--benchmark-json=benchmark.json.
+"""
+import math
+
+import numpy as np
+import pytest
+
+from run import get_3d_polyline_from_route, get_strava_points, get_strava_streams
+from tests.synthetic import synthetic_elevation
+from utils.utils_elevation import (
+    TERRAIN_GRID_STEP,
+    TERRAIN_RADIUS,
+    get_elevation_from_points,
+    get_speckle_mesh_from_2d_route,
+    get_terrain_grid_points,
+)
+from utils.utils_mesh import triangulate_polygon
+from utils.utils_osm import (
+    extrudeBuildingsBatch,
+    fetch_overpass_elements,
+    get_colors_of_points_from_tiles,
+    getBuildings,
+    parseBuildingFootprints,
+    plan_overpass_queries,
+)
+from utils.utils_pyproj import createCRS
+from utils.utils_shapely import get_route_corridor, road_buffer, road_ribbon
+
+CLIENT = ("client", "secret")
+CODE = "code"
+
+
+@pytest.fixture(scope="session")
+def streams(route_km):
+    """Replayed latlng and altitude streams of a synthetic route of route_km."""
+    return get_strava_streams(*CLIENT, route_km * 1000, CODE, ("latlng", "altitude"))
+
+
+@pytest.fixture(scope="session")
+def route(streams):
+    """The [lat, lon] points of the route."""
+    return streams["latlng"]
+
+
+@pytest.fixture(scope="session")
+def crs(route):
+    """The metric CRS of the route."""
+    return createCRS(route[0][0], route[0][1])
+
+
+@pytest.fixture(scope="session")
+def polyline(route, streams, route_km):
+    """The 3d route, with the Strava altitude."""
+    return get_3d_polyline_from_route(
+        route, *CLIENT, route_km * 1000, CODE, streams["altitude"]
+    )
+
+
+@pytest.fixture(scope="session")
+def buildings(route, crs):
+    """Ragged footprint arrays along the route, standing on the synthetic terrain."""
+    corridor = get_route_corridor(route, TERRAIN_RADIUS, crs)
+    features = fetch_overpass_elements(plan_overpass_queries(corridor, crs))
+    footprints, _ = parseBuildingFootprints(features, crs)
+    rings = [[f["coords"], *f["holes"]] for f in footprints]
+    offsets = np.cumsum([0] + [sum(map(len, building)) for building in rings])
+    rings = [ring for building in rings for ring in building]
+    coords = [[c["x"], c["y"]] for ring in rings for c in ring]
+    bases = synthetic_elevation(*np.array([f["center"] for f in footprints]).T)
+    heights = [f["height"] for f in footprints]
+    ring_offsets = np.cumsum([0] + [len(ring) for ring in rings])
+    return offsets, coords, bases, heights, ring_offsets
+
+
+def test_get_strava_points(measure, route_km):
+    """Streaming the route points of the activity."""
+    measure("strava", get_strava_points, *CLIENT, route_km * 1000, CODE)
+
+
+def test_get_elevation_from_points(measure, route):
+    """Elevation lookup of every route point."""
+    measure("elevation", get_elevation_from_points, route)
+
+
+def test_get_buildings(measure, route, route_km):
+    """Buildings of a square with the same area as the route corridor."""
+    lat, lon = route[len(route) // 2]
+    radius = math.sqrt(route_km * 1000 * 2 * TERRAIN_RADIUS) / 2
+    measure("buildings", getBuildings, lat, lon, radius)
+
+
+def test_get_colors_of_points_from_tiles(measure, route, crs):
+    """Map colors of the terrain grid points."""
+    grid_points, _ = get_terrain_grid_points(
+        [route], crs, TERRAIN_RADIUS, TERRAIN_GRID_STEP
+    )
+    # colors are looked up as [lon, lat]
+    measure("colors", get_colors_of_points_from_tiles, grid_points[:, ::-1])
+
+
+def test_get_speckle_mesh_from_2d_route(measure, route):
+    """The whole terrain, from grid to meshes."""
+    measure("terrain", get_speckle_mesh_from_2d_route, route)
+
+
+def test_road_buffer(measure, polyline):
+    """The road as buffered slices."""
+    measure("road", road_buffer, polyline, 1, cold=False)
+
+
+def test_road_ribbon(measure, polyline):
+    """The road as one continuous ribbon."""
+    measure("road", road_ribbon, polyline, 1, cold=False)
+
+
+def test_extrude_buildings(measure, buildings):
+    """Extrusion including the triangulation of every roof."""
+    offsets, coords, bases, heights, ring_offsets = buildings
+    measure(
+        "extrude",
+        extrudeBuildingsBatch,
+        offsets,
+        coords,
+        bases,
+        heights,
+        ring_offsets=ring_offsets,
+        cold=False,
+    )
+
+
+def test_extrude_buildings_cached(measure, buildings):
+    """Extrusion with roof triangles from the tessellation cache."""
+    offsets, coords, bases, heights, ring_offsets = buildings
+    triangles = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        starts = ring_offsets[(ring_offsets > start) & (ring_offsets < end)]
+        outline, *holes = np.split(np.asarray(coords[start:end]), starts - start)
+        triangles.append(triangulate_polygon(outline, holes))
+    measure(
+        "extrude",
+        extrudeBuildingsBatch,
+        offsets,
+        coords,
+        bases,
+        heights,
+        ring_offsets=ring_offsets,
+        triangles=triangles,
+        cold=False,
+    )
@@ -3,6 +3,11 @@
 use the automation_context module to wrap your function in an Autamate context helper
 """
 
+import os
+import tempfile
+from datetime import UTC, datetime
+from typing import Literal
+
 from pydantic import Field
 from speckle_automate import (
     AutomateBase,
@@ -10,9 +15,12 @@ from speckle_automate import (
     execute_automate_function,
 )
 
-from run import generate_all_objects
+from run import generate_all_objects, generate_all_objects_batch
+from utils.utils_metrics import metrics, profile_to
 
 RESULT_BRANCH = "strava_automate"
+RUN_REPORT_FILE = "run_report.json"
+PROFILE_FILES = {"cprofile": "profile.prof", "pyinstrument": "profile.html"}
 
 
 class FunctionInputs(AutomateBase):
@@ -39,6 +47,138 @@ class FunctionInputs(AutomateBase):
         title="Code from the URL",
         description=("Some description"),
     )
+    activity_ids: str = Field(
+        default="",
+        title="Activity IDs",
+        description=(
+            "Comma separated activity IDs to create together, sharing the terrain and "
+            "buildings; replaces the Activity ID"
+        ),
+    )
+    activities_after: str = Field(
+        default="",
+        title="Activities after",
+        description=(
+            "Create all activities started after this date (YYYY-MM-DD), sharing the "
+            "terrain and buildings; replaces the Activity ID"
+        ),
+    )
+    activities_before: str = Field(
+        default="",
+        title="Activities before",
+        description=("Used with Activities after: last date (YYYY-MM-DD), excluded"),
+    )
+    route_tolerance: float = Field(
+        default=1,
+        ge=0,
+        title="Route simplification tolerance",
+        description=(
+            "Largest distance in meters of a dropped GPS point from the simplified "
+            "route, 0 to keep all points"
+        ),
+    )
+    route_spacing: float = Field(
+        default=0,
+        ge=0,
+        title="Route point spacing",
+        description=(
+            "Smallest distance in meters between kept GPS points, 0 to keep all points"
+        ),
+    )
+    use_strava_altitude: bool = Field(
+        default=True,
+        title="Use Strava altitude",
+        description=(
+            "Build the route from the altitude recorded by Strava, aligned to the "
+            "terrain, instead of looking up every point in the elevation service"
+        ),
+    )
+    workers: int = Field(
+        default=4,
+        ge=1,
+        le=32,
+        title="Workers",
+        description=(
+            "How many stages (road, terrain, buildings) run at the same time"
+        ),
+    )
+    profile: Literal["none", "cprofile", "pyinstrument"] = Field(
+        default="none",
+        title="Profile",
+        description=(
+            "Attach a cProfile stats file or a pyinstrument page of the run, next to "
+            "the run report; stages then run one at a time"
+        ),
+    )
+    terrain_radius: float = Field(
+        default=100,
+        gt=0,
+        title="Terrain radius",
+        description=(
+            "Width of the terrain and buildings on each side of the route, in meters"
+        ),
+    )
+    terrain_grid_step: int = Field(
+        default=40,
+        gt=0,
+        title="Terrain grid spacing",
+        description=(
+            "Distance between terrain grid points, in 0.00001 degrees (about 1 m)"
+        ),
+    )
+    terrain_subdivisions: int = Field(
+        default=1,
+        ge=0,
+        le=3,
+        title="Terrain subdivisions",
+        description=(
+            "How many times each terrain triangle is split into 6 for the map colors: "
+            "0 - none, 1 - 6 triangles, 2 - 36 triangles"
+        ),
+    )
+    terrain_detail_radius: float = Field(
+        default=0,
+        ge=0,
+        title="Terrain detail radius",
+        description=(
+            "Distance from the route, in meters, within which the terrain uses the "
+            "grid spacing; further away the coarse grid spacing is used. 0 to disable"
+        ),
+    )
+    terrain_coarse_grid_step: int = Field(
+        default=120,
+        gt=0,
+        title="Terrain coarse grid spacing",
+        description=(
+            "Distance between terrain grid points away from the route, "
+            "in 0.00001 degrees"
+        ),
+    )
+
+
+def parse_date(value: str) -> datetime | None:
+    """Parse a YYYY-MM-DD input as a UTC date, None if empty."""
+    if not value.strip():
+        return None
+    return datetime.strptime(value.strip(), "%Y-%m-%d").replace(tzinfo=UTC)
+
+
+def store_run_report(
+    automate_context: AutomationContext, folder: str, profile: str = "none"
+) -> None:
+    """Attach the run report, and the profile if one was made, to the project."""
+    file_paths = [metrics.write_report(os.path.join(folder, RUN_REPORT_FILE))]
+    if profile in PROFILE_FILES:
+        profile_path = os.path.join(folder, PROFILE_FILES[profile])
+        # missing if the run failed before profiling started
+        if os.path.isfile(profile_path):
+            file_paths.append(profile_path)
+    for file_path in file_paths:
+        try:
+            automate_context.store_file_result(file_path)
+        except Exception as ex:
+            # the report should never fail the run itself
+            print(f"Could not attach {file_path}: {ex}")
 
 
 def automate_function(
@@ -54,6 +194,9 @@ def automate_function(
             It also has conveniece methods attach result data to the Speckle model.
         function_inputs: An instance object matching the defined schema.
     """
+    metrics.reset()
+    report_folder = tempfile.mkdtemp(prefix="strava_automate_")
+    profile = function_inputs.profile
     # the context provides a conveniet way, to receive the triggering version
     try:
         project_id = automate_context.automation_run_data.project_id
@@ -74,12 +217,61 @@ def automate_function(
         client_secret = function_inputs.client_secret
         activity_id = function_inputs.activity_id
         code = function_inputs.code
+        terrain_detail = {
+            "radius": function_inputs.terrain_radius,
+            "step": function_inputs.terrain_grid_step,
+            "subdivisions": function_inputs.terrain_subdivisions,
+        }
+        if function_inputs.terrain_detail_radius > 0:
+            terrain_detail["detail_radius"] = function_inputs.terrain_detail_radius
+            terrain_detail["coarse_step"] = function_inputs.terrain_coarse_grid_step
+
+        route_options = {
+            "route_tolerance": function_inputs.route_tolerance,
+            "route_spacing": function_inputs.route_spacing,
+            "use_strava_altitude": function_inputs.use_strava_altitude,
+            # profilers only follow the calling thread
+            "max_workers": 1 if profile in PROFILE_FILES else function_inputs.workers,
+        }
 
         print(f"All good so far")
-        commitObj = generate_all_objects(client_id, client_secret, activity_id, code)
-        automate_context.create_new_version_in_project(
-            commitObj, br_id, "Context from Automate"
-        )
+        profile_path = os.path.join(report_folder, PROFILE_FILES.get(profile, ""))
+        with profile_to(profile_path, profile):
+            if function_inputs.activity_ids.strip():
+                activity_ids = [
+                    int(i) for i in function_inputs.activity_ids.split(",") if i.strip()
+                ]
+                commitObj = generate_all_objects_batch(
+                    client_id,
+                    client_secret,
+                    code,
+                    activity_ids=activity_ids,
+                    terrain_detail=terrain_detail,
+                    **route_options,
+                )
+            elif function_inputs.activities_after or function_inputs.activities_before:
+                commitObj = generate_all_objects_batch(
+                    client_id,
+                    client_secret,
+                    code,
+                    after=parse_date(function_inputs.activities_after),
+                    before=parse_date(function_inputs.activities_before),
+                    terrain_detail=terrain_detail,
+                    **route_options,
+                )
+            else:
+                commitObj = generate_all_objects(
+                    client_id,
+                    client_secret,
+                    activity_id,
+                    code,
+                    terrain_detail,
+                    **route_options,
+                )
+        with metrics.stage("speckle.send"):
+            automate_context.create_new_version_in_project(
+                commitObj, br_id, "Context from Automate"
+            )
         print(
             f"Created id={automate_context._automation_result.result_versions[len(automate_context._automation_result.result_versions)-1]}"
         )
@@ -88,10 +280,9 @@ def automate_function(
         automate_context.mark_run_success("Strava route context creared")
     except Exception as ex:
         automate_context.mark_run_failed(f"Failed to create 3d context cause: {ex}")
-
-    # if the function generates file results, this is how it can be
-    # attached to the Speckle project / model
-    # automate_context.store_file_result("./report.pdf")
+    finally:
+        # attached on failures too, to see how far the run got
+        store_run_report(automate_context, report_folder, profile)
 
 
 def automate_function_without_inputs(automate_context: AutomationContext) -> None:
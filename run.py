@@ -1,5 +1,7 @@
 import json  # noqa: D100
-import requests
+from datetime import datetime
+
+import numpy as np
 
 from specklepy.objects.geometry import Mesh, Polyline, Point
 
@@ -9,56 +11,68 @@ from specklepy.transports.server import ServerTransport
 from specklepy.api.client import SpeckleClient
 from specklepy.api.credentials import get_local_accounts
 
-import requests
-import urllib3
 from utils.utils_elevation import (
+    TERRAIN_RADIUS,
+    align_altitudes_to_terrain,
     get_buildings_mesh_from_2d_route,
+    get_buildings_mesh_from_2d_routes,
     get_elevation_from_points,
     get_speckle_mesh_from_2d_route,
+    get_speckle_mesh_from_2d_routes,
 )
-from utils.utils_shapely import road_buffer
+from utils.utils_shapely import resample_route, road_ribbon, simplify_route
+from utils.utils_strava import StravaClient
 
-from utils.utils_pyproj import createCRS, reprojectToCrs
+from utils.utils_metrics import metrics
+from utils.utils_pipeline import PIPELINE_WORKERS, run_stages
+from utils.utils_pyproj import createCRS, reprojectArrayToCrs
 
 
-def get_strava_points(client_id: str, client_secret: str, activity_id: int, code: str):
+def get_strava_streams(
+    client_id: str,
+    client_secret: str,
+    activity_id: int,
+    code: str,
+    keys: tuple[str, ...] = ("latlng",),
+) -> dict[str, list]:
+    """Get the requested streams of the activity, by stream type."""
     # response = requests.get(
     #    f"https://www.strava.com/oauth/authorize?client_id={client_id}&redirect_uri=http://localhost&response_type=code&scope=activity:read_all"
     # )
+    client = StravaClient(client_id, client_secret, code)
+    return client.activity_streams(activity_id, keys)
+
+
+def get_strava_points(client_id: str, client_secret: str, activity_id: int, code: str):
+    streams = get_strava_streams(client_id, client_secret, activity_id, code)
+    return streams["latlng"]
+
+
+def simplify_strava_points(
+    all_locations_2d: list, tolerance: float = 0, spacing: float = 0
+) -> list[int]:
+    """Get indices of the route points to keep after simplification.
 
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-    auth_url = "https://www.strava.com/oauth/token"
-    activites_url = f"https://www.strava.com/api/v3/activities/{activity_id}/streams"
-
-    ########################
-    payload = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "code": code,
-        "grant_type": "authorization_code",
-    }
-    print("Requesting Token...\n")
-    # print(payload)
-    res = requests.post(auth_url, data=payload, verify=False)
-    # print(res.json())
-    try:
-        access_token = res.json()["access_token"]
-    except KeyError as ke:
-        raise PermissionError("invalid or expired token", ke)
-    # print("Access Token = {}\n".format(access_token))
-
-    ############################
-
-    header = {"Authorization": "Bearer " + access_token}
-    param = {"keys": ["latlng"]}
-    my_dataset = requests.get(activites_url, headers=header, params=param).json()
-
-    for item in my_dataset:
-        print(item["type"])
-        if item["type"] == "latlng":
-            return item["data"]
-    raise Exception("No data found")
+    Later stages then scale with the route geometry rather than with the
+    recording frequency.
+
+    Args:
+        all_locations_2d: route points as [lat, lon].
+        tolerance: Douglas-Peucker tolerance in meters, 0 to skip.
+        spacing: smallest distance in meters between kept points, 0 to skip.
+    """
+    indices = np.arange(len(all_locations_2d))
+    if len(all_locations_2d) < 3 or (tolerance <= 0 and spacing <= 0):
+        return indices.tolist()
+    crs_to_use = createCRS(all_locations_2d[0][0], all_locations_2d[0][1])
+    lats, lons = np.asarray(all_locations_2d, dtype=float).T
+    xs, ys = reprojectArrayToCrs(lats, lons, "EPSG:4326", crs_to_use)
+    points = np.column_stack([xs, ys])
+    if spacing > 0:
+        indices = indices[resample_route(points, spacing)]
+    if tolerance > 0:
+        indices = indices[simplify_route(points[indices], tolerance)]
+    return indices.tolist()
 
 
 def construct_speckle_mesh(points_3d: list[dict]) -> Mesh:
@@ -74,45 +88,208 @@ def get_3d_polyline_from_route(
     client_secret: str,
     activity_id: int,
     code: str,
+    altitudes: list[float] | None = None,
+    crs_to_use=None,
 ):
-    """Get Speckle Mesh surrounding the route."""
+    """Get Speckle Mesh surrounding the route.
+
+    If recorded altitudes are given, only a few points are sent to the
+    elevation API to align them; otherwise every point is looked up.
+    """
     # all_locations = [(10, 10), (20, 20), (41.161758, -8.583933)]
 
     print(all_locations_2d[:10])
-    points_3d = get_elevation_from_points(all_locations_2d)
-    print(points_3d[:10])
+    if altitudes is not None and len(altitudes) == len(all_locations_2d):
+        elevations = align_altitudes_to_terrain(all_locations_2d, altitudes)
+    else:
+        points_3d = get_elevation_from_points(all_locations_2d)
+        all_locations_2d = [[p["latitude"], p["longitude"]] for p in points_3d]
+        elevations = [p["elevation"] for p in points_3d]
+    print(elevations[:10])
 
-    crs_to_use = createCRS(all_locations_2d[0][0], all_locations_2d[0][1])
+    if crs_to_use is None:
+        crs_to_use = createCRS(all_locations_2d[0][0], all_locations_2d[0][1])
 
     # reproject points to metric CRS
-    speckle_points = []
-    for p in points_3d:
-        x, y = reprojectToCrs(p["latitude"], p["longitude"], "EPSG:4326", crs_to_use)
-        speckle_points.append(Point(x=x, y=y, z=p["elevation"], units="m"))
+    xs, ys = reprojectArrayToCrs(
+        [p[0] for p in all_locations_2d],
+        [p[1] for p in all_locations_2d],
+        "EPSG:4326",
+        crs_to_use,
+    )
+    speckle_points = [
+        Point(x=x, y=y, z=z, units="m")
+        for x, y, z in zip(xs.tolist(), ys.tolist(), elevations)
+    ]
     # print(speckle_points[:10])
     polyline = Polyline.from_points(speckle_points)
     return polyline
 
 
+def prepare_strava_route(
+    streams: dict[str, list], route_tolerance: float = 1, route_spacing: float = 0
+) -> tuple[list, list[float] | None]:
+    """Simplify the route of an activity.
+
+    Returns its [lat, lon] points and the matching recorded altitudes, or
+    None if the activity has none.
+    """
+    all_locations_2d = streams["latlng"]
+    kept = simplify_strava_points(all_locations_2d, route_tolerance, route_spacing)
+    print(f"Kept {len(kept)} of {len(all_locations_2d)} route points")
+    # falls back to the elevation API if the activity has no altitude
+    altitudes = streams.get("altitude")
+    if altitudes is not None and len(altitudes) == len(all_locations_2d):
+        altitudes = [altitudes[i] for i in kept]
+    else:
+        altitudes = None
+    return [all_locations_2d[i] for i in kept], altitudes
+
+
 def generate_all_objects(
-    client_id: str, client_secret: str, activity_id: int, code: str
+    client_id: str,
+    client_secret: str,
+    activity_id: int,
+    code: str,
+    terrain_detail: dict | None = None,
+    route_tolerance: float = 1,
+    route_spacing: float = 0,
+    use_strava_altitude: bool = True,
+    max_workers: int = PIPELINE_WORKERS,
 ):
     # https://www.markhneedham.com/blog/2020/12/15/strava-authorization-error-missing-read-permission/
 
     # 1. Go to https://www.strava.com/settings/api and create a new app
     # 2. https://www.strava.com/oauth/authorize?client_id=paste_your_client_id&redirect_uri=http://localhost&response_type=code&scope=activity:read_all
 
-    all_locations_2d = get_strava_points(client_id, client_secret, activity_id, code)
-    polyline = get_3d_polyline_from_route(
-        all_locations_2d, client_id, client_secret, activity_id, code
+    keys = ("latlng", "altitude") if use_strava_altitude else ("latlng",)
+    streams = get_strava_streams(client_id, client_secret, activity_id, code, keys)
+    all_locations_2d, altitudes = prepare_strava_route(
+        streams, route_tolerance, route_spacing
+    )
+    # keyword arguments of get_speckle_mesh_from_2d_route, e.g. radius and step
+    terrain_detail = terrain_detail or {}
+
+    def road_stage():
+        polyline = get_3d_polyline_from_route(
+            all_locations_2d, client_id, client_secret, activity_id, code, altitudes
+        )
+        road = road_ribbon(polyline, 1)
+        metrics.count_meshes("road", road.displayValue)
+        return road
+
+    def buildings_stage():
+        print("______getting buildings:")
+        buildings_meshes = get_buildings_mesh_from_2d_route(
+            all_locations_2d,
+            terrain_detail.get("radius", TERRAIN_RADIUS),
+        )
+        return Collection(elements=buildings_meshes)
+
+    # the stages only share the 2d route, so they run at the same time
+    results = run_stages(
+        {
+            "road": road_stage,
+            "terrain": lambda: get_speckle_mesh_from_2d_route(
+                all_locations_2d, **terrain_detail
+            ),
+            "buildings": buildings_stage,
+        },
+        max_workers,
+    )
+
+    final_object = Collection(elements=list(results.values()))
+    return final_object
+
+
+def generate_all_objects_batch(
+    client_id: str,
+    client_secret: str,
+    code: str,
+    activity_ids: list[int] | None = None,
+    after: datetime | None = None,
+    before: datetime | None = None,
+    terrain_detail: dict | None = None,
+    route_tolerance: float = 1,
+    route_spacing: float = 0,
+    use_strava_altitude: bool = True,
+    max_workers: int = PIPELINE_WORKERS,
+):
+    """Create the routes of several activities in one shared context.
+
+    Activities are given as a list of ids, or found between the after and
+    before dates. Terrain and buildings are built once for the area
+    covered by all routes, so overlapping routes share that work; each
+    activity gets its own collection with its route.
+    """
+    client = StravaClient(client_id, client_secret, code)
+    if activity_ids is None:
+        activity_ids = client.activity_ids(after, before)
+    keys = ("latlng", "altitude") if use_strava_altitude else ("latlng",)
+    all_streams = client.activities_streams(activity_ids, keys)
+
+    all_routes = {}
+    for activity_id, streams in all_streams.items():
+        if len(streams.get("latlng") or []) == 0:
+            print(f"Skipping activity {activity_id} without GPS data")
+            continue
+        all_routes[activity_id] = prepare_strava_route(
+            streams, route_tolerance, route_spacing
+        )
+    if len(all_routes) == 0:
+        raise Exception("No data found")
+
+    # one metric CRS, so all routes line up with the shared context
+    first_route, _ = next(iter(all_routes.values()))
+    crs_to_use = createCRS(first_route[0][0], first_route[0][1])
+
+    def activities_stage():
+        activities = []
+        for activity_id, (all_locations_2d, altitudes) in all_routes.items():
+            polyline = get_3d_polyline_from_route(
+                all_locations_2d,
+                client_id,
+                client_secret,
+                activity_id,
+                code,
+                altitudes,
+                crs_to_use=crs_to_use,
+            )
+            road = road_ribbon(polyline, 1)
+            metrics.count_meshes("road", road.displayValue)
+            activities.append(
+                Collection(
+                    name=str(activity_id),
+                    collectionType="activity",
+                    elements=[road],
+                )
+            )
+        return Collection(name="activities", elements=activities)
+
+    all_routes_2d = [all_locations_2d for all_locations_2d, _ in all_routes.values()]
+    terrain_detail = terrain_detail or {}
+
+    def buildings_stage():
+        print("______getting buildings:")
+        buildings_meshes = get_buildings_mesh_from_2d_routes(
+            all_routes_2d,
+            terrain_detail.get("radius", TERRAIN_RADIUS),
+            crs_to_use,
+        )
+        return Collection(elements=buildings_meshes)
+
+    results = run_stages(
+        {
+            "activities": activities_stage,
+            "terrain": lambda: get_speckle_mesh_from_2d_routes(
+                all_routes_2d, crs_to_use=crs_to_use, **terrain_detail
+            ),
+            "buildings": buildings_stage,
+        },
+        max_workers,
     )
-    road_mesh = road_buffer(polyline, 1)
-    elevation_mesh = get_speckle_mesh_from_2d_route(all_locations_2d)
-    print("______getting buildings:")
-    buildings_meshes = get_buildings_mesh_from_2d_route(all_locations_2d)
-    buildings = Collection(elements=buildings_meshes)
 
-    final_object = Collection(elements=[road_mesh, elevation_mesh, buildings])
+    final_object = Collection(elements=list(results.values()))
     return final_object
 
 
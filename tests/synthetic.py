@@ -0,0 +1,260 @@
+"""Deterministic synthetic responses standing in for the public services."""
+import math
+import random
+
+
+def synthetic_overpass_response(
+    lat: float, lon: float, number_of_buildings: int, seed: int = 0
+) -> dict:
+    """Get an Overpass-like JSON response with buildings scattered around lat/lon.
+
+    Every tenth building is a multipolygon relation made of two outer ways,
+    the rest are closed ways with a mix of height, levels and layer tags.
+    """
+    rnd = random.Random(seed)
+    # spread the buildings over roughly 100 m2 of ground each
+    extent = math.sqrt(number_of_buildings) * 10 / 111_000
+    elements = []
+    next_node_id = 1
+    next_way_id = 1
+
+    def add_nodes(coords: list) -> list[int]:
+        nonlocal next_node_id
+        ids = []
+        for node_lat, node_lon in coords:
+            elements.append(
+                {"type": "node", "id": next_node_id, "lat": node_lat, "lon": node_lon}
+            )
+            ids.append(next_node_id)
+            next_node_id += 1
+        return ids
+
+    for i in range(number_of_buildings):
+        center_lat = lat + rnd.uniform(-extent, extent)
+        center_lon = lon + rnd.uniform(-extent, extent) / math.cos(math.radians(lat))
+        size = rnd.uniform(3, 15) / 111_000
+        # L-shaped or rectangular outline, counter-clockwise or clockwise
+        outline = [(-1, -1), (1, -1), (1, 0), (0, 0), (0, 1), (-1, 1)]
+        if i % 2 == 0:
+            outline = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
+        if i % 3 == 0:
+            outline.reverse()
+        coords = [(center_lat + y * size, center_lon + x * size) for x, y in outline]
+
+        tags = {"building": "yes"}
+        choice = rnd.random()
+        if choice < 0.3:
+            tags["height"] = str(rnd.randint(3, 60))
+        elif choice < 0.6:
+            tags["building:levels"] = str(rnd.randint(1, 20))
+        elif choice < 0.65:
+            tags["layer"] = "-1"
+
+        if i % 10 == 9:
+            # relation with its outline split into two untagged outer ways
+            node_ids = add_nodes(coords)
+            half = len(node_ids) // 2
+            parts = [node_ids[: half + 1], node_ids[half:] + node_ids[:1]]
+            members = []
+            for part in parts:
+                elements.append({"type": "way", "id": next_way_id, "nodes": part})
+                members.append({"type": "way", "ref": next_way_id, "role": "outer"})
+                next_way_id += 1
+            elements.append(
+                {"type": "relation", "id": i, "members": members, "tags": tags}
+            )
+        else:
+            node_ids = add_nodes(coords)
+            elements.append(
+                {
+                    "type": "way",
+                    "id": next_way_id,
+                    "nodes": node_ids + node_ids[:1],
+                    "tags": tags,
+                }
+            )
+            next_way_id += 1
+
+    rnd.shuffle(elements)
+    return {"version": 0.6, "generator": "synthetic", "elements": elements}
+
+
+def synthetic_tile_png(zoom: int, x: int, y: int, size: int = 256) -> bytes:
+    """Get a deterministic palette PNG map tile, like the OSM tile server serves."""
+    import io
+
+    import png
+
+    rnd = random.Random(f"{zoom}/{x}/{y}")
+    palette = [
+        (rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(0, 255))
+        for _ in range(16)
+    ]
+    # blocky "land use" patches with a road grid across them
+    block = rnd.choice([8, 16, 32])
+    patches = [
+        [rnd.randrange(1, 16) for _ in range(size // block)]
+        for _ in range(size // block)
+    ]
+    rows = []
+    for row in range(size):
+        rows.append(
+            [
+                0
+                if row % 64 < 3 or column % 64 < 3
+                else patches[row // block][column // block]
+                for column in range(size)
+            ]
+        )
+    buffer = io.BytesIO()
+    png.Writer(size, size, palette=palette, bitdepth=4).write(buffer, rows)
+    return buffer.getvalue()
+
+
+def synthetic_elevation(lat, lon):
+    """Get the elevation of rolling hills at lat/lon, in meters; works on arrays too."""
+    import numpy as np
+
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    # a few kilometers between hilltops, with smaller bumps on top
+    return np.round(
+        120
+        + 60 * np.sin(lat * 150) * np.cos(lon * 110)
+        + 8 * np.sin(lat * 1900 + lon * 1300),
+        1,
+    )
+
+
+def synthetic_strava_streams(
+    length: float,
+    lat: float = 51.5,
+    lon: float = -0.1,
+    spacing: float = 5,
+    seed: int = 0,
+) -> list[dict]:
+    """Get a Strava-like streams response for a winding route of length meters.
+
+    The route has a point every spacing meters, like a bike computer
+    recording every second, and recorded altitudes a few meters off the
+    synthetic terrain, like barometric altimeters.
+    """
+    rnd = random.Random(seed)
+    heading = rnd.uniform(0, 2 * math.pi)
+    latlng = []
+    distance = []
+    for i in range(int(length / spacing) + 1):
+        latlng.append([round(lat, 7), round(lon, 7)])
+        distance.append(round(i * spacing, 1))
+        # gentle bends, with a sharp turn now and then
+        heading += rnd.gauss(0, 0.03)
+        if rnd.random() < 0.002:
+            heading += rnd.choice([-1.4, 1.4])
+        lat += spacing * math.cos(heading) / 111_320
+        lon += spacing * math.sin(heading) / (111_320 * math.cos(math.radians(lat)))
+    terrain = synthetic_elevation([p[0] for p in latlng], [p[1] for p in latlng])
+    altitude = [round(z + 7.5 + rnd.uniform(-1, 1), 1) for z in terrain.tolist()]
+
+    def stream(stream_type: str, data: list) -> dict:
+        return {
+            "type": stream_type,
+            "data": data,
+            "series_type": "distance",
+            "original_size": len(data),
+            "resolution": "high",
+        }
+
+    return [
+        stream("latlng", latlng),
+        stream("distance", distance),
+        stream("altitude", altitude),
+    ]
+
+
+def synthetic_overpass_area(
+    rings: list[list[tuple[float, float]]], density: float = 400
+) -> dict:
+    """Get an Overpass-like JSON response with the buildings inside the given area.
+
+    rings are (lat, lon) outlines, like poly: or bbox filters. Buildings
+    sit on a fixed lattice of density buildings per km2 with stable ids,
+    so overlapping areas return the same elements, as Overpass does.
+    Every tenth building is a relation with a square courtyard.
+    """
+    import numpy as np
+    import shapely
+
+    area = shapely.union_all([shapely.Polygon(ring) for ring in rings])
+    if area.is_empty:
+        return {"version": 0.6, "generator": "synthetic", "elements": []}
+    min_lat, min_lon, max_lat, max_lon = area.bounds
+    cell_lat = 1000 / math.sqrt(density) / 111_320
+    cell_lon = cell_lat / math.cos(math.radians((min_lat + max_lat) / 2))
+    # a fixed lon step per latitude band keeps lattices of neighbouring areas equal
+    cell_lon = cell_lat * 2 ** round(math.log2(cell_lon / cell_lat))
+    rows = np.arange(math.floor(min_lat / cell_lat), math.ceil(max_lat / cell_lat))
+    columns = np.arange(math.floor(min_lon / cell_lon), math.ceil(max_lon / cell_lon))
+    rows, columns = np.meshgrid(rows, columns, indexing="ij")
+    rows, columns = rows.ravel(), columns.ravel()
+    inside = shapely.contains_xy(
+        area, (rows + 0.5) * cell_lat, (columns + 0.5) * cell_lon
+    )
+
+    elements = []
+    for row, column in zip(rows[inside].tolist(), columns[inside].tolist()):
+        # stable positive id of the cell
+        cell_id = (row + 2**20) * 2**22 + column + 2**21
+        rnd = random.Random(cell_id)
+        center_lat = (row + rnd.uniform(0.3, 0.7)) * cell_lat
+        center_lon = (column + rnd.uniform(0.3, 0.7)) * cell_lon
+        size = rnd.uniform(0.1, 0.25)
+        outline = [(-1, -1), (1, -1), (1, 0), (0, 0), (0, 1), (-1, 1)]
+        if cell_id % 2 == 0:
+            outline = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
+        if cell_id % 3 == 0:
+            outline.reverse()
+        courtyard = [(-0.7, -0.7), (-0.3, -0.7), (-0.3, -0.3), (-0.7, -0.3)]
+        node_ids = []
+        for k, (x, y) in enumerate(outline + courtyard):
+            node_ids.append(cell_id * 16 + k)
+            elements.append(
+                {
+                    "type": "node",
+                    "id": cell_id * 16 + k,
+                    "lat": round(center_lat + y * size * cell_lat, 7),
+                    "lon": round(center_lon + x * size * cell_lon, 7),
+                }
+            )
+        node_ids, courtyard_ids = node_ids[: len(outline)], node_ids[len(outline) :]
+
+        tags = {"building": "yes"}
+        choice = rnd.random()
+        if choice < 0.3:
+            tags["height"] = str(rnd.randint(3, 60))
+        elif choice < 0.6:
+            tags["building:levels"] = str(rnd.randint(1, 20))
+
+        if cell_id % 10 == 9:
+            # relation with its outline split into two untagged outer ways
+            # and an inner way around the courtyard
+            half = len(node_ids) // 2
+            parts = [node_ids[: half + 1], node_ids[half:] + node_ids[:1]]
+            parts.append(courtyard_ids + courtyard_ids[:1])
+            members = []
+            for k, part in enumerate(parts):
+                role = "inner" if k == 2 else "outer"
+                elements.append({"type": "way", "id": cell_id * 4 + k, "nodes": part})
+                members.append({"type": "way", "ref": cell_id * 4 + k, "role": role})
+            elements.append(
+                {"type": "relation", "id": cell_id, "members": members, "tags": tags}
+            )
+        else:
+            elements.append(
+                {
+                    "type": "way",
+                    "id": cell_id * 4,
+                    "nodes": node_ids + node_ids[:1],
+                    "tags": tags,
+                }
+            )
+    return {"version": 0.6, "generator": "synthetic", "elements": elements}
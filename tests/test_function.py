@@ -152,7 +152,13 @@ def test_function_run(automation_run_data: AutomationRunData, speckle_token: str
         automate_function,
         automation_run_data,
         speckle_token,
-        FunctionInputs(forbidden_speckle_type="Base"),
+        # no Strava token can be exchanged with these, so the run fails
+        FunctionInputs(
+            client_id="0",
+            client_secret="invalid",
+            activity_id=0,
+            code="invalid",
+        ),
     )
 
     assert automate_sdk.run_status == AutomationStatus.FAILED
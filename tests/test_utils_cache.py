@@ -0,0 +1,73 @@
+"""Unit tests for the local elevation and tessellation caches."""
+import numpy as np
+import pytest
+
+import utils.utils_cache as utils_cache
+import utils.utils_elevation as utils_elevation
+from utils.utils_cache import ElevationCache, TessellationCache
+
+
+@pytest.fixture()
+def elevation_cache(tmp_path, monkeypatch) -> ElevationCache:
+    """Use a fresh elevation cache in a temporary folder."""
+    cache = ElevationCache(str(tmp_path / "elevation.sqlite"))
+    monkeypatch.setitem(utils_cache._shared_caches, "elevation", cache)
+    yield cache
+    cache.close()
+
+
+def test_cache_hits_and_misses(elevation_cache: ElevationCache):
+    """Stored elevations are found again for nearby (rounded) locations."""
+    elevation_cache.put_many([[51.5, -0.1], [51.6, -0.2]], [10.0, 20.0])
+
+    assert elevation_cache.get_many(
+        [[51.500001, -0.100001], [51.7, -0.3], [51.6, -0.2]]
+    ) == [10.0, None, 20.0]
+    assert elevation_cache.stats() == {"hits": 2, "misses": 1, "entries": 2}
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """The store never grows beyond max_entries."""
+    cache = ElevationCache(str(tmp_path / "small.sqlite"), max_entries=2)
+    cache.put_many([[1, 1]], [1.0])
+    cache.put_many([[2, 2]], [2.0])
+    cache.get_many([[1, 1]])
+    cache.put_many([[3, 3]], [3.0])
+
+    assert len(cache) == 2
+    assert cache.get_many([[1, 1], [2, 2], [3, 3]]) == [1.0, None, 3.0]
+    cache.close()
+
+
+def test_only_misses_are_requested(elevation_cache: ElevationCache, monkeypatch):
+    """Elevation lookups send only unknown locations to the API."""
+    requested = []
+
+    def fake_fetch(all_locations):
+        requested.extend(all_locations)
+        return [
+            {"latitude": lat, "longitude": lon, "elevation": lat + lon}
+            for lat, lon in all_locations
+        ]
+
+    monkeypatch.setattr(utils_elevation, "fetch_elevation_from_points", fake_fetch)
+    first = utils_elevation.get_elevation_from_points([[1, 2], [3, 4], [1, 2]])
+    second = utils_elevation.get_elevation_from_points([[3, 4], [5, 6]])
+
+    assert requested == [[1, 2], [3, 4], [5, 6]]
+    assert [r["elevation"] for r in first] == [3, 7, 3]
+    assert [r["elevation"] for r in second] == [7, 11]
+
+
+def test_tessellation_is_redone_for_changed_geometry(tmp_path):
+    """Triangles are found by building id only while the geometry hash matches."""
+    cache = TessellationCache(str(tmp_path / "tessellation.sqlite"))
+    square = np.array([[0, 1, 2], [0, 2, 3]])
+    cache.put_many(["way/1", "relation/2"], ["a", "b"], [square, square[:1]])
+
+    found = cache.get_many(["way/1", "relation/2", "way/3"], ["a", "changed", "c"])
+
+    assert (found[0] == square).all()
+    assert found[1:] == [None, None]
+    assert cache.stats() == {"hits": 1, "misses": 2, "entries": 2}
+    cache.close()
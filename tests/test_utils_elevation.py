@@ -0,0 +1,185 @@
+"""Unit tests for the elevation fetcher."""
+import numpy as np
+import pytest
+
+import utils.utils_cache as utils_cache
+import utils.utils_elevation as utils_elevation
+import utils.utils_osm as utils_osm
+from tests.synthetic import synthetic_overpass_response
+from utils.utils_cache import TessellationCache
+from utils.utils_elevation import (
+    ElevationFetchError,
+    align_altitudes_to_terrain,
+    fetch_elevation_from_points,
+    get_buildings_mesh_from_2d_route,
+    get_speckle_mesh_from_2d_route,
+    get_speckle_mesh_from_2d_routes,
+    get_terrain_grid_points,
+)
+from utils.utils_pyproj import createCRS
+
+
+class FakeResponse:
+    """Minimal stand-in for requests.Response."""
+
+    def __init__(self, status_code: int, results: list | None = None):
+        """Answer with status_code and, if given, the elevation results."""
+        self.status_code = status_code
+        self.results = results
+
+    def json(self):
+        """Get the body of the response."""
+        return {"results": self.results}
+
+
+def fake_elevation_server(max_locations: int, failing_latitudes=()):
+    """Build a request_with_backoff replacement answering like open-elevation."""
+    requests_sent = []
+
+    def request(method, url, json=None, **kwargs):
+        locations = json["locations"]
+        requests_sent.append(len(locations))
+        if len(locations) > max_locations:
+            return FakeResponse(413)
+        if any(loc["latitude"] in failing_latitudes for loc in locations):
+            return FakeResponse(500)
+        return FakeResponse(
+            200, [dict(loc, elevation=loc["latitude"]) for loc in locations]
+        )
+
+    return request, requests_sent
+
+
+def test_chunks_are_split_to_fit_server(monkeypatch):
+    """Chunks rejected as too large are split until accepted, keeping order."""
+    request, requests_sent = fake_elevation_server(max_locations=30)
+    monkeypatch.setattr(utils_elevation, "request_with_backoff", request)
+
+    locations = [[i, 0] for i in range(100)]
+    results = fetch_elevation_from_points(locations, max_locations=50)
+
+    assert [r["elevation"] for r in results] == list(range(100))
+    assert max(requests_sent) == 50
+    assert all(n <= 30 for n in requests_sent if n != 50)
+
+
+def test_failed_chunks_are_reported(monkeypatch):
+    """A failed chunk raises instead of silently returning fewer results."""
+    request, _ = fake_elevation_server(max_locations=100, failing_latitudes=(42,))
+    monkeypatch.setattr(utils_elevation, "request_with_backoff", request)
+
+    with pytest.raises(ElevationFetchError) as error:
+        fetch_elevation_from_points([[i, 0] for i in range(100)], max_locations=20)
+    assert error.value.failed_chunks == [(40, 60, "HTTP 500")]
+
+
+@pytest.fixture
+def flat_terrain(monkeypatch):
+    """Answer elevations and map colors locally."""
+    monkeypatch.setattr(
+        utils_elevation,
+        "get_elevation_from_points",
+        lambda locations: [
+            {"latitude": lat, "longitude": lon, "elevation": 0}
+            for lat, lon in locations
+        ],
+    )
+    monkeypatch.setattr(
+        utils_elevation,
+        "get_colors_of_points_from_tiles",
+        lambda locations: np.zeros(len(locations), dtype=np.int64),
+    )
+
+
+def count_faces(terrain) -> int:
+    """Number of faces of all terrain meshes."""
+    return sum(len(mesh.faces) // 4 for mesh in terrain.displayValue)
+
+
+def test_terrain_level_of_detail(flat_terrain):
+    """Each subdivision multiplies faces by 6; a coarse outer grid needs fewer."""
+    route = [[51.5 + i * 1e-4, -0.1 + (i % 20) * 1e-4] for i in range(100)]
+
+    base = count_faces(get_speckle_mesh_from_2d_route(route, subdivisions=0))
+    assert base > 0
+    assert count_faces(get_speckle_mesh_from_2d_route(route)) == 6 * base
+    finest = get_speckle_mesh_from_2d_route(route, subdivisions=2)
+    assert count_faces(finest) == 36 * base
+
+    uniform = count_faces(get_speckle_mesh_from_2d_route(route, radius=200))
+    graded = count_faces(
+        get_speckle_mesh_from_2d_route(
+            route, radius=200, detail_radius=50, coarse_step=120
+        )
+    )
+    assert 0 < graded < uniform / 2
+
+
+def test_recorded_altitudes_are_aligned_with_few_requests(monkeypatch):
+    """Altitudes get the median offset to the terrain, robust to GPS spikes."""
+    requested = []
+
+    def terrain(locations):
+        requested.extend(locations)
+        return [
+            {"latitude": lat, "longitude": lon, "elevation": lat * 10}
+            for lat, lon in locations
+        ]
+
+    monkeypatch.setattr(utils_elevation, "get_elevation_from_points", terrain)
+    locations = [[i, 0] for i in range(1000)]
+    altitudes = [i * 10 - 30.0 for i in range(1000)]
+    # a spike at one of the sampled points
+    altitudes[526] += 400
+
+    aligned = align_altitudes_to_terrain(locations, altitudes, samples=20)
+
+    assert len(requested) == 20
+    assert requested[0] == [0, 0] and requested[-1] == [999, 0]
+    expected = [i * 10.0 for i in range(1000)]
+    expected[526] += 400
+    assert aligned == pytest.approx(expected)
+
+
+def test_overlapping_routes_share_terrain(flat_terrain):
+    """Grid points of overlapping routes are sampled once."""
+    route = [[51.5 + i * 1e-4, -0.1] for i in range(50)]
+    # shares its first half with route
+    other_route = route[:25] + [[51.5 + 24 * 1e-4, -0.1 + i * 1e-4] for i in range(25)]
+    crs_to_use = createCRS(route[0][0], route[0][1])
+
+    single, _ = get_terrain_grid_points([route], crs_to_use)
+    both, both_metric = get_terrain_grid_points([route, other_route], crs_to_use)
+    other, _ = get_terrain_grid_points([other_route], crs_to_use)
+
+    assert len(both) == len(both_metric) == len(np.unique(both, axis=0))
+    assert max(len(single), len(other)) < len(both) < len(single) + len(other)
+    assert count_faces(get_speckle_mesh_from_2d_routes([route, route])) == count_faces(
+        get_speckle_mesh_from_2d_route(route)
+    )
+
+
+def test_buildings_share_one_elevation_lookup(monkeypatch, tmp_path):
+    """All buildings along the route get their base elevation in a single lookup."""
+    route = [[51.5 + i * 1e-5, -0.1 + i * 1e-5] for i in range(100)]
+    elements = synthetic_overpass_response(51.5005, -0.0995, 60)["elements"]
+    monkeypatch.setattr(utils_osm, "fetch_overpass_query", lambda query: elements)
+    cache = TessellationCache(str(tmp_path / "tessellation.sqlite"))
+    monkeypatch.setitem(utils_cache._shared_caches, "tessellation", cache)
+    lookups = []
+
+    def lookup(points):
+        lookups.append(points)
+        return [{"elevation": 10.0} for _ in points]
+
+    monkeypatch.setattr(utils_elevation, "get_elevation_from_points", lookup)
+
+    meshes = get_buildings_mesh_from_2d_route(route)
+
+    footprints, _ = utils_osm.parseBuildingFootprints(
+        elements, createCRS(route[0][0], route[0][1])
+    )
+    assert len(meshes) > 0
+    assert len(footprints) == 60
+    assert lookups == [[f["center"] for f in footprints]]
+    cache.close()
@@ -0,0 +1,84 @@
+"""Unit tests for building indexed Speckle meshes."""
+import numpy as np
+import shapely
+
+from utils.utils_mesh import (
+    meshes_from_buffers,
+    subdivide_triangles,
+    triangulate_polygon,
+)
+
+
+def test_meshes_are_chunked_and_reindexed():
+    """Each chunk stays within max_vertices and keeps the original triangles."""
+    grid_x, grid_y = np.meshgrid(np.arange(20), np.arange(20))
+    vertices = np.column_stack([grid_x.ravel(), grid_y.ravel(), np.zeros(400)])
+    colors = np.arange(400)
+    cells = np.arange(400).reshape(20, 20)[:-1, :-1].ravel()
+    faces = np.concatenate(
+        [
+            np.column_stack([cells, cells + 1, cells + 21]),
+            np.column_stack([cells, cells + 21, cells + 20]),
+        ]
+    )
+
+    meshes = meshes_from_buffers(vertices, faces, colors, max_vertices=300)
+
+    assert len(meshes) == 8
+    triangles = []
+    for mesh in meshes:
+        mesh_vertices = np.asarray(mesh.vertices).reshape(-1, 3)
+        assert len(mesh_vertices) == len(mesh.colors) <= 300
+        mesh_faces = np.asarray(mesh.faces).reshape(-1, 4)
+        assert (mesh_faces[:, 0] == 3).all()
+        triangles.extend(
+            tuple(np.asarray(mesh.colors)[face].tolist()) for face in mesh_faces[:, 1:]
+        )
+    assert sorted(triangles) == sorted(map(tuple, faces.tolist()))
+
+
+def test_subdivided_triangles_share_edge_midpoints():
+    """Two triangles sharing an edge get 5 midpoints, 2 centroids and 12 faces."""
+    vertices = np.array([[0, 0, 0], [2, 0, 0], [0, 2, 2], [2, 2, 2]], dtype=float)
+    triangles = np.array([[0, 1, 2], [1, 3, 2]])
+
+    new_vertices, new_triangles = subdivide_triangles(vertices, triangles)
+
+    assert len(new_vertices) == 4 + 5 + 2
+    assert new_triangles.shape == (12, 3)
+    assert (new_vertices[:4] == vertices).all()
+    assert [1, 1, 1] in new_vertices.tolist()
+    assert np.allclose(new_vertices[-2], vertices[[0, 1, 2]].mean(axis=0))
+    # the sub-triangles cover the original area without degenerate faces
+    corners = new_vertices[new_triangles]
+    areas = np.linalg.norm(
+        np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1
+    )
+    assert (areas > 0).all()
+    assert np.isclose(areas.sum() / 2, 2 * np.sqrt(8))
+
+
+def test_triangulation_covers_polygons_with_holes():
+    """Triangles are counter-clockwise and cover the polygon minus its holes exactly."""
+    rng = np.random.default_rng(0)
+    polygons = [shapely.box(0, 0, 10, 10).difference(shapely.box(2, 2, 4, 8))]
+    # concave outlines with holes, like thick winding lines
+    for _ in range(30):
+        polygon = shapely.LineString(rng.random((8, 2)) * 100).buffer(3, quad_segs=2)
+        if polygon.geom_type == "Polygon":
+            polygons.append(polygon)
+    assert any(len(polygon.interiors) > 1 for polygon in polygons)
+
+    for polygon in polygons:
+        # clockwise outline and counter-clockwise holes, as OSM allows
+        outline = np.asarray(polygon.exterior.coords)[:-1][::-1]
+        holes = [np.asarray(ring.coords)[:-1][::-1] for ring in polygon.interiors]
+        triangles = triangulate_polygon(outline, holes)
+
+        corners = np.concatenate([outline, *holes])[triangles]
+        edges = corners[:, 1:] - corners[:, :1]
+        areas = (edges[:, 0, 0] * edges[:, 1, 1] - edges[:, 0, 1] * edges[:, 1, 0]) / 2
+        assert (areas > 0).all()
+        assert np.isclose(areas.sum(), polygon.area)
+        covered = shapely.union_all(shapely.polygons(corners))
+        assert covered.symmetric_difference(polygon).area < 1e-6
@@ -0,0 +1,95 @@
+"""Unit tests for the run metrics."""
+import json
+import pstats
+import threading
+
+from utils.utils_mesh import meshes_from_buffers
+from utils.utils_metrics import RunMetrics, profile_to
+from utils.utils_pipeline import run_stages
+
+
+def test_stages_and_counters_add_up_across_threads():
+    """Concurrent stages with the same name and counters from threads all add up."""
+    metrics = RunMetrics()
+
+    def work():
+        for _ in range(100):
+            with metrics.stage("elevation.fetch"):
+                metrics.count("http.requests")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    report = metrics.report()
+    assert report["stages"]["elevation.fetch"]["calls"] == 400
+    assert report["counters"]["http.requests"] == 400
+
+
+def test_report_is_json():
+    """The report holds stages, counters, caches and peak memory, and is JSON."""
+    metrics = RunMetrics()
+    with metrics.stage("terrain"):
+        metrics.count("http.bytes", "512")
+
+    report = json.loads(json.dumps(metrics.report()))
+
+    assert set(report) == {
+        "total_seconds",
+        "stages",
+        "counters",
+        "caches",
+        "peak_memory_bytes",
+    }
+    assert report["counters"] == {"http.bytes": 512}
+    assert "decoded_tiles" in report["caches"]
+    assert report["peak_memory_bytes"] > 0
+
+    metrics.reset()
+    assert metrics.report()["stages"] == {}
+
+
+def test_count_meshes():
+    """Meshes, vertices and faces are counted, including legacy face codes."""
+    metrics = RunMetrics()
+    square = [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]]
+    # one triangle per mesh
+    meshes = meshes_from_buffers(square, [[0, 1, 2], [0, 2, 3]], [0] * 4, 3)
+    quad = meshes_from_buffers(square, [[0, 1, 2, 3]], [0] * 4)[0]
+    # 1 is the legacy code of a quad
+    quad.faces = [1, 0, 1, 2, 3]
+    metrics.count_meshes("terrain", meshes + [quad])
+
+    assert metrics.counters["terrain.meshes"] == 3
+    assert metrics.counters["terrain.vertices"] == 10
+    assert metrics.counters["terrain.faces"] == 3
+
+
+def test_pipeline_stages_are_timed(monkeypatch):
+    """Each pipeline stage is timed under its own name."""
+    metrics = RunMetrics()
+    monkeypatch.setattr("utils.utils_pipeline.metrics", metrics)
+
+    run_stages({"road": lambda: 1, "terrain": lambda: 2}, max_workers=2)
+
+    assert set(metrics.report()["stages"]) == {"road", "terrain"}
+
+
+def test_cprofile_dump(tmp_path):
+    """The cProfile mode writes stats readable by pstats."""
+    path = tmp_path / "profile" / "profile.prof"
+    with profile_to(str(path), "cprofile"):
+        sum(range(1000))
+
+    assert pstats.Stats(str(path)).total_calls > 0
+
+
+def test_pyinstrument_page(tmp_path):
+    """The pyinstrument mode writes an HTML page."""
+    path = tmp_path / "profile" / "profile.html"
+    with profile_to(str(path), "pyinstrument"):
+        sum(range(100000))
+
+    assert "<html" in path.read_text(encoding="utf-8").lower()
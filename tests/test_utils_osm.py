@@ -0,0 +1,173 @@
+"""Unit tests for the OSM helpers."""
+import numpy as np
+from shapely.geometry import Polygon
+
+import utils.utils_cache as utils_cache
+import utils.utils_osm as utils_osm
+from tests.synthetic import synthetic_overpass_response
+from utils.utils_cache import TessellationCache
+from utils.utils_pyproj import createCRS
+from utils.utils_shapely import get_route_corridor
+
+
+def test_corridor_is_split_into_few_queries():
+    """A route corridor gets one poly: query per non-empty tile."""
+    route = [[51.5 + i * 1e-4, -0.1 + i * 1e-4] for i in range(300)]
+    crs_to_use = createCRS(route[0][0], route[0][1])
+    corridor = get_route_corridor(route, 100, crs_to_use)
+
+    queries = utils_osm.plan_overpass_queries(corridor, crs_to_use, tile_size=1000)
+
+    # one query per 20-point segment before, ~4 km of route now fits in few tiles
+    assert 0 < len(queries) < 300 / 20
+    assert all('way["building"](poly:"' in query for query in queries)
+
+
+def test_elements_are_deduplicated(monkeypatch):
+    """Elements returned by overlapping queries are kept once."""
+    responses = {
+        "a": [
+            {"type": "way", "id": 1, "nodes": [1, 2], "tags": {"building": "yes"}},
+            {"type": "node", "id": 1, "lat": 0, "lon": 0},
+        ],
+        "b": [
+            {"type": "node", "id": 1, "lat": 0, "lon": 0},
+            {"type": "node", "id": 2, "lat": 1, "lon": 1},
+            {"type": "node", "id": 2, "lat": 1, "lon": 1, "tags": {"building": "yes"}},
+        ],
+    }
+    monkeypatch.setattr(utils_osm, "fetch_overpass_query", responses.get)
+
+    elements = utils_osm.fetch_overpass_elements(["a", "b"])
+
+    assert sorted((e["type"], e["id"], "tags" in e) for e in elements) == [
+        ("node", 1, False),
+        ("node", 2, False),
+        ("node", 2, True),
+        ("way", 1, True),
+    ]
+
+
+def test_footprints_are_resolved_from_indexes():
+    """Ways and relation outer ways are resolved to metric footprints."""
+    response = synthetic_overpass_response(51.5, -0.1, 50)
+    footprints, ids = utils_osm.parseBuildingFootprints(
+        response["elements"], createCRS(51.5, -0.1)
+    )
+
+    assert len(footprints) == 50
+    # 45 tagged ways and 2 outer ways for each of the 5 relations
+    assert len(ids) == 55
+    # relation outlines keep the node shared by their two outer ways twice
+    assert sorted({len(f["coords"]) for f in footprints}) == [4, 6, 7]
+    assert all(f["height"] >= 3 for f in footprints)
+
+
+def face_normals(mesh) -> list:
+    """Newell normal of each face of a mesh, with its face size."""
+    vertices = np.asarray(mesh.vertices).reshape(-1, 3)
+    normals = []
+    i = 0
+    while i < len(mesh.faces):
+        size = mesh.faces[i]
+        points = vertices[mesh.faces[i + 1 : i + 1 + size]]
+        normal = np.cross(points, np.roll(points, -1, axis=0)).sum(axis=0)
+        normals.append((size, normal / np.linalg.norm(normal)))
+        i += size + 1
+    return normals
+
+
+def test_batch_extrusion_faces_point_out():
+    """Clockwise and counter-clockwise footprints both get outward faces."""
+    square = [(0, 0), (2, 0), (2, 2), (0, 2)]
+    coords = square + [(x + 5, y) for x, y in reversed(square)]
+
+    (mesh,) = utils_osm.extrudeBuildingsBatch([0, 4, 8], coords, [10, 20], [3, 6])
+
+    vertices = np.asarray(mesh.vertices).reshape(-1, 3)
+    assert len(vertices) == 2 * 6 * 4
+    assert sorted(set(vertices[:, 2])) == [10, 13, 20, 26]
+    normals = face_normals(mesh)
+    # two triangles for each bottom, then for each top, then walls
+    assert [size for size, _ in normals] == [3] * 8 + [4] * 8
+    assert np.allclose([n for _, n in normals[:4]], [0, 0, -1])
+    assert np.allclose([n for _, n in normals[4:8]], [0, 0, 1])
+    for wall, (_, normal) in enumerate(normals[8:]):
+        # from the center of the footprint towards the wall
+        corners = vertices[mesh.faces[32 + 5 * wall + 1 : 32 + 5 * wall + 5]]
+        center = (6, 1) if wall >= 4 else (1, 1)
+        assert np.dot(normal[:2], corners[:, :2].mean(axis=0) - center) > 0
+
+
+def test_courtyards_are_holes_with_walls(tmp_path, monkeypatch):
+    """Inner ways of a relation are left out of the roof and get walls facing in."""
+    cache = TessellationCache(str(tmp_path / "tessellation.sqlite"))
+    monkeypatch.setitem(utils_cache._shared_caches, "tessellation", cache)
+    monkeypatch.setattr(
+        "utils.utils_elevation.get_elevation_from_points",
+        lambda points: [{"elevation": 0} for _ in points],
+    )
+    corners = {1: (0, 0), 2: (0, 4), 3: (4, 4), 4: (4, 0)}
+    corners.update({5: (1, 1), 6: (1, 2), 7: (2, 2), 8: (2, 1)})
+    features = [
+        {"type": "node", "id": i, "lat": 51.5 + y * 1e-4, "lon": -0.1 + x * 1e-4}
+        for i, (x, y) in corners.items()
+    ]
+    features += [
+        {"type": "way", "id": 10, "nodes": [1, 2, 3, 4, 1]},
+        # courtyard outline split in two ways, one of them reversed
+        {"type": "way", "id": 11, "nodes": [5, 6, 7]},
+        {"type": "way", "id": 12, "nodes": [5, 8, 7]},
+        {
+            "type": "relation",
+            "id": 20,
+            "tags": {"building": "yes", "height": "10"},
+            "members": [
+                {"type": "way", "ref": 10, "role": "outer"},
+                {"type": "way", "ref": 11, "role": "inner"},
+                {"type": "way", "ref": 12, "role": "inner"},
+            ],
+        },
+    ]
+    crs = createCRS(51.5, -0.1)
+    (footprint,), _ = utils_osm.parseBuildingFootprints(features, crs)
+    assert footprint["id"] == "relation/20"
+    assert [len(hole) for hole in footprint["holes"]] == [4]
+
+    (mesh,) = utils_osm.extrudeBuildingFootprints([footprint])
+
+    vertices = np.asarray(mesh.vertices).reshape(-1, 3)
+    normals = face_normals(mesh)
+    roofs = [i for i, (size, n) in enumerate(normals) if size == 3 and n[2] > 0]
+    roof_area = 0
+    face_starts = np.cumsum([0] + [size + 1 for size, _ in normals])
+    for i in roofs:
+        a, b, c = vertices[mesh.faces[face_starts[i] + 1 : face_starts[i] + 4]]
+        roof_area += np.cross(b - a, c - a)[2] / 2
+    outline = [[c["x"], c["y"]] for c in footprint["coords"]]
+    courtyard = [[c["x"], c["y"]] for c in footprint["holes"][0]]
+    assert np.isclose(roof_area, Polygon(outline, [courtyard]).area)
+    # the 4 courtyard walls face its center
+    center = np.mean(courtyard, axis=0)
+    for i in face_starts[-5:-1]:
+        wall = vertices[mesh.faces[i + 1 : i + 5]]
+        normal = np.cross(wall, np.roll(wall, -1, axis=0)).sum(axis=0)
+        assert np.dot(normal[:2], center - wall[:, :2].mean(axis=0)) > 0
+
+    # a second run reuses the tessellation
+    utils_osm.extrudeBuildingFootprints([footprint])
+    assert utils_cache._shared_caches["tessellation"].stats()["hits"] == 1
+
+
+def test_batch_extrusion_keeps_buildings_whole():
+    """Meshes are split between buildings, within the vertex limit."""
+    square = [(0, 0), (2, 0), (2, 2), (0, 2)]
+    triangle = [(0, 0), (2, 0), (0, 2)]
+    offsets = [0, 4, 7, 11]
+
+    meshes = utils_osm.extrudeBuildingsBatch(
+        offsets, square + triangle + square, [0, 0, 0], [3, 3, 3], max_vertices=42
+    )
+
+    # 24 + 18 vertices, then 24
+    assert [len(mesh.vertices) // 3 for mesh in meshes] == [42, 24]
@@ -0,0 +1,43 @@
+"""Unit tests for the pipeline executor."""
+import threading
+import time
+
+import pytest
+
+from utils.utils_pipeline import run_stages
+
+
+def test_stages_run_at_the_same_time_in_order():
+    """Results keep the order of the stages, not the order they finish in."""
+    started = threading.Barrier(3, timeout=5)
+
+    def stage(name, delay):
+        def run():
+            # fails unless all 3 stages are running together
+            started.wait()
+            time.sleep(delay)
+            return name
+
+        return run
+
+    stages = {
+        "road": stage("road", 0.2),
+        "terrain": stage("terrain", 0),
+        "buildings": stage("buildings", 0.1),
+    }
+    results = run_stages(stages, max_workers=3)
+
+    assert list(results) == ["road", "terrain", "buildings"]
+    assert list(results.values()) == ["road", "terrain", "buildings"]
+
+
+def test_failing_stage_raises():
+    """A failing stage raises, whether stages run together or one by one."""
+    def fail():
+        raise ValueError("no buildings")
+
+    with pytest.raises(ValueError, match="no buildings"):
+        run_stages({"road": lambda: 1, "buildings": fail}, max_workers=2)
+    with pytest.raises(ValueError, match="no buildings"):
+        run_stages({"road": lambda: 1, "buildings": fail}, max_workers=1)
+
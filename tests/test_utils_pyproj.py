@@ -0,0 +1,34 @@
+"""Unit tests for the reprojection helpers."""
+import numpy as np
+
+from utils.utils_pyproj import (
+    createCRS,
+    getTransformer,
+    reprojectArrayToCrs,
+    reprojectToCrs,
+)
+
+
+def test_array_reprojection_matches_per_point():
+    """The vectorized path gives the same coordinates as the per-point one."""
+    crs_to_use = createCRS(51.5, -0.1)
+    lats = np.linspace(51.49, 51.51, 25)
+    lons = np.linspace(-0.11, -0.09, 25)
+
+    xs, ys = reprojectArrayToCrs(lats, lons, "EPSG:4326", crs_to_use)
+    expected = [
+        reprojectToCrs(lat, lon, "EPSG:4326", crs_to_use)
+        for lat, lon in zip(lats, lons)
+    ]
+    np.testing.assert_allclose(np.column_stack([xs, ys]), expected)
+
+    # and back again
+    lons_back, lats_back = reprojectArrayToCrs(ys, xs, crs_to_use, "EPSG:4326")
+    np.testing.assert_allclose(lats_back, lats)
+    np.testing.assert_allclose(lons_back, lons)
+
+
+def test_transformer_is_reused():
+    """Equal CRS pairs share one cached transformer."""
+    transformer = getTransformer("EPSG:4326", createCRS(10, 20))
+    assert getTransformer("EPSG:4326", createCRS(10, 20)) is transformer
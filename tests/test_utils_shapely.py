@@ -0,0 +1,153 @@
+"""Unit tests for the geometry helpers."""
+import numpy as np
+import shapely
+from specklepy.objects.geometry import Point, Polyline
+
+from utils.utils_pyproj import createCRS, reprojectArrayToCrs
+from utils.utils_shapely import (
+    get_grid_points_in_corridor,
+    get_route_corridor,
+    resample_route,
+    road_buffer,
+    road_ribbon,
+    simplify_route,
+)
+
+
+def test_grid_points_are_unique_and_inside_corridor():
+    """Grid points lie on the global lattice, within radius of the route, once each."""
+    route = [[51.5 + i * 1e-4, -0.1 + (i % 50) * 1e-4] for i in range(200)]
+    crs_to_use = createCRS(route[0][0], route[0][1])
+
+    grid_points, grid_points_metric = get_grid_points_in_corridor(
+        route, radius=100, step=40, crs_to_use=crs_to_use
+    )
+
+    assert len(grid_points) == len(grid_points_metric) > 0
+    assert len(np.unique(grid_points, axis=0)) == len(grid_points)
+    lattice = grid_points * 100000 / 40
+    np.testing.assert_allclose(lattice, np.round(lattice), atol=1e-6)
+    route_line = get_route_corridor(route, 0.001, crs_to_use)
+    distances = shapely.distance(
+        route_line, shapely.points(grid_points_metric)
+    )
+    assert distances.max() <= 100
+
+
+def test_grid_points_of_simplified_straight_route(monkeypatch):
+    """A long straight route thinned to its end points gets the same grid cheaply."""
+    crs_to_use = createCRS(51.5, -0.1)
+    distance = np.linspace(0, 20000, 2000)
+    lons, lats = reprojectArrayToCrs(distance, distance, crs_to_use, "EPSG:4326")
+    route = np.column_stack([lats, lons]).tolist()
+    contains_xy = shapely.contains_xy
+    candidates = []
+
+    def counting_contains_xy(geometry, x, y):
+        candidates.append(len(x))
+        return contains_xy(geometry, x, y)
+
+    monkeypatch.setattr(shapely, "contains_xy", counting_contains_xy)
+    dense_points, _ = get_grid_points_in_corridor(route, 100, 40, crs_to_use)
+    grid_points, _ = get_grid_points_in_corridor(
+        [route[0], route[-1]], 100, 40, crs_to_use
+    )
+
+    np.testing.assert_array_equal(grid_points, dense_points)
+    # the lattice checked against the corridor stays close to its size
+    assert candidates[-1] < 10 * len(grid_points)
+
+
+def test_road_buffer_takes_z_from_own_slice():
+    """Where the route comes back close to itself, each slice keeps its own heights."""
+    east = [(x, 0, 0) for x in range(0, 101, 10)]
+    back = [(100, 10), (80, 10), (60, 10), (40, 10), (20, 10), (0, 10)]
+    # ends right next to the corner of the first slice's start cap, at (-1, 1)
+    back += [(-5, 8), (-5, 5), (-3, 3), (-1.2, 1.2)]
+    polyline = Polyline.from_points(
+        [Point(x=x, y=y, z=z, units="m") for x, y, z in east]
+        + [Point(x=x, y=y, z=50, units="m") for x, y in back]
+    )
+
+    meshes = road_buffer(polyline, 1, koeff=10).displayValue
+
+    assert len(meshes) == 2
+    assert all(mesh.faces[0] == len(mesh.faces) - 1 for mesh in meshes)
+    first, second = (np.asarray(m.vertices).reshape(-1, 3) for m in meshes)
+    assert sorted(set(first[:, 2])) == [0.5]
+    assert sorted(set(second[:, 2])) == [0.5, 50.5]
+    cap_corner = np.hypot(first[:, 0] + 1, first[:, 1] - 1) < 1e-6
+    assert cap_corner.sum() == 1
+
+
+def triangle_areas(mesh) -> np.ndarray:
+    """Signed xy areas of the triangles, positive when counter-clockwise."""
+    vertices = np.asarray(mesh.vertices).reshape(-1, 3)
+    corners = vertices[np.asarray(mesh.faces).reshape(-1, 4)[:, 1:]]
+    a = corners[:, 1] - corners[:, 0]
+    b = corners[:, 2] - corners[:, 0]
+    return (a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]) / 2
+
+
+def test_road_ribbon_is_one_continuous_mesh():
+    """The ribbon covers the route with miters at turns and square caps."""
+    # an L-shaped route with a repeated point
+    route = [(0, 0, 10), (10, 0, 10), (10, 0, 10), (10, 10, 20)]
+    polyline = Polyline.from_points(
+        [Point(x=x, y=y, z=z, units="m") for x, y, z in route]
+    )
+
+    meshes = road_ribbon(polyline, 1).displayValue
+
+    assert len(meshes) == 1
+    vertices = np.asarray(meshes[0].vertices).reshape(-1, 3)
+    assert len(vertices) == 6
+    assert {tuple(v) for v in vertices[:, :2].tolist()} == {
+        (-1, 1), (-1, -1), (9, 1), (11, -1), (9, 11), (11, 11)
+    }
+    assert sorted(set(vertices[:, 2])) == [10.5, 20.5]
+    areas = triangle_areas(meshes[0])
+    assert (areas > 0).all()
+    # 12 x 2 m and 2 x 10 m arms, not overlapping at the miter
+    assert np.isclose(areas.sum(), 12 * 2 + 2 * 10)
+
+
+def test_road_ribbon_is_chunked():
+    """Long routes are split into meshes of at most max_vertices vertices."""
+    route = [(i, (i % 2) * 0.5, 0) for i in range(1000)]
+    polyline = Polyline.from_points(
+        [Point(x=x, y=y, z=z, units="m") for x, y, z in route]
+    )
+
+    meshes = road_ribbon(polyline, 1, max_vertices=300).displayValue
+
+    assert len(meshes) > 1
+    assert all(len(mesh.vertices) // 3 <= 300 for mesh in meshes)
+    assert sum(len(mesh.faces) // 4 for mesh in meshes) == 2 * 999
+
+
+def test_simplify_route_keeps_corners():
+    """Douglas-Peucker keeps the ends and corners, dropping noise below tolerance."""
+    xs = np.arange(0, 101, 1.0)
+    # an L shape with 0.2 m of noise
+    points = np.concatenate(
+        [
+            np.column_stack([xs, 0.2 * (xs % 2)]),
+            np.column_stack([100 + 0.2 * (xs[1:] % 2), xs[1:]]),
+        ]
+    )
+
+    kept = simplify_route(points, tolerance=1)
+
+    assert kept.tolist() == [0, 100, len(points) - 1]
+    assert len(simplify_route(points, tolerance=0.1)) > 100
+
+
+def test_resample_route_spacing():
+    """Kept points are at least spacing apart along the route, keeping both ends."""
+    points = np.column_stack([np.arange(0, 100.5, 0.5), np.zeros(201)])
+
+    kept = resample_route(points, spacing=10)
+
+    assert kept.tolist() == list(range(0, 201, 20))
+    assert resample_route(points[:2], spacing=10).tolist() == [0, 1]
@@ -0,0 +1,198 @@
+"""Unit tests for the Strava stream ingestion."""
+import json
+import time
+from datetime import UTC, datetime
+
+import pytest
+import requests
+
+import utils.utils_strava as utils_strava
+from utils.utils_cache import TokenCache
+from utils.utils_strava import StravaClient, fetch_activity_streams, iter_json_array
+
+STREAMS = [
+    {"type": "latlng", "data": [[51.5 + i * 1e-5, -0.1] for i in range(2000)]},
+    {"type": "distance", "data": [i * 1.1 for i in range(2000)]},
+    {"type": "altitude", "data": [12.5] * 2000},
+]
+
+
+def split(text: bytes, size: int) -> list[bytes]:
+    """Split text into chunks of size bytes."""
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 4096, 10**7])
+def test_array_items_are_parsed_across_chunks(size):
+    """Items split anywhere, even inside a UTF-8 character, decode as a whole."""
+    items = STREAMS + [12, "é]", [], {"a": 1.5}]
+    text = json.dumps(items, ensure_ascii=False).encode()
+
+    assert list(iter_json_array(split(text, size))) == items
+
+
+def test_truncated_array_is_an_error():
+    """A response cut short raises instead of silently returning fewer items."""
+    with pytest.raises(ValueError):
+        list(iter_json_array(split(json.dumps(STREAMS).encode()[:-5], 100)))
+
+
+class FakeStreamResponse:
+    """Minimal stand-in for a streamed requests.Response."""
+
+    def __init__(self, status_code: int, body: bytes):
+        """Answer with status_code and body."""
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        """Get the decoded body."""
+        return json.loads(self.body)
+
+    def iter_content(self, chunk_size):
+        """Get the body in chunks of chunk_size bytes."""
+        return iter(split(self.body, chunk_size))
+
+    def raise_for_status(self):
+        """Raise requests.HTTPError for error status codes."""
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code}")
+
+
+def test_only_requested_streams_are_kept(monkeypatch):
+    """Streams are requested by a comma separated list of keys."""
+    requests_sent = []
+
+    def request(method, url, params=None, **kwargs):
+        requests_sent.append(params)
+        return FakeStreamResponse(200, json.dumps(STREAMS).encode())
+
+    monkeypatch.setattr(utils_strava, "request_with_backoff", request)
+
+    streams = fetch_activity_streams("token", 1, keys=("latlng", "altitude"))
+
+    assert requests_sent == [{"keys": "latlng,altitude"}]
+    assert streams == {"latlng": STREAMS[0]["data"], "altitude": STREAMS[2]["data"]}
+
+
+def test_expired_token_is_a_permission_error(monkeypatch):
+    """An unauthorized response raises PermissionError, like the token request."""
+    monkeypatch.setattr(
+        utils_strava,
+        "request_with_backoff",
+        lambda *args, **kwargs: FakeStreamResponse(401, b'{"message": "x"}'),
+    )
+
+    with pytest.raises(PermissionError):
+        fetch_activity_streams("token", 1)
+
+
+@pytest.fixture
+def strava_server(monkeypatch):
+    """Answer token and streams requests like Strava, recording them."""
+    requests_sent = []
+
+    def request(method, url, data=None, headers=None, **kwargs):
+        if url == utils_strava.STRAVA_AUTH_URL:
+            requests_sent.append(data["grant_type"])
+            if data.get("code") == "used":
+                return FakeStreamResponse(400, b'{"message": "Bad Request"}')
+            token = {
+                "access_token": f"access-{len(requests_sent)}",
+                "refresh_token": "refresh",
+                "expires_at": int(time.time()) + 3600,
+            }
+            return FakeStreamResponse(200, json.dumps(token).encode())
+        requests_sent.append((url.split("/")[-2], headers["Authorization"]))
+        return FakeStreamResponse(200, json.dumps(STREAMS[:1]).encode())
+
+    monkeypatch.setattr(utils_strava, "request_with_backoff", request)
+    return requests_sent
+
+
+def test_token_is_exchanged_once_and_refreshed(strava_server, tmp_path):
+    """Later runs with the same code reuse the cached token until it expires."""
+    token_cache = TokenCache(str(tmp_path / "tokens.json"))
+
+    client = StravaClient("id", "secret", "code", token_cache=token_cache)
+    assert client.activity_streams(1)["latlng"] == STREAMS[0]["data"]
+    client = StravaClient("id", "secret", "code", token_cache=token_cache)
+    client.activity_streams(2)
+    assert strava_server == [
+        "authorization_code",
+        ("1", "Bearer access-1"),
+        ("2", "Bearer access-1"),
+    ]
+    assert "code" not in (tmp_path / "tokens.json").read_text()
+
+    # expire the cached token
+    token = token_cache.get(client._cache_key)
+    token_cache.put(client._cache_key, dict(token, expires_at=0))
+    client.activity_streams(3)
+    assert strava_server[3:] == ["refresh_token", ("3", "Bearer access-4")]
+
+
+def test_used_code_without_cached_token_is_a_permission_error(strava_server, tmp_path):
+    """A code that was already exchanged elsewhere cannot be used again."""
+    client = StravaClient(
+        "id", "secret", "used", token_cache=TokenCache(str(tmp_path / "t.json"))
+    )
+
+    with pytest.raises(PermissionError):
+        client.access_token()
+
+
+def test_activities_are_fetched_in_one_batch(strava_server, tmp_path):
+    """Several activities share one token and keep their ids."""
+    client = StravaClient(
+        "id", "secret", "code", token_cache=TokenCache(str(tmp_path / "t.json"))
+    )
+
+    all_streams = client.activities_streams([5, 6, 5, 7])
+
+    assert list(all_streams) == [5, 6, 7]
+    assert strava_server.count("authorization_code") == 1
+    assert sorted(r[0] for r in strava_server[1:]) == ["5", "6", "7"]
+
+
+def test_failing_activity_is_left_out(strava_server, monkeypatch, tmp_path):
+    """An activity that cannot be fetched does not stop the others."""
+    client = StravaClient(
+        "id", "secret", "code", token_cache=TokenCache(str(tmp_path / "t.json"))
+    )
+    client.access_token()
+    answer = utils_strava.request_with_backoff
+
+    def request(method, url, **kwargs):
+        if "/activities/6/" in url:
+            return FakeStreamResponse(404, b'{"message": "Record Not Found"}')
+        return answer(method, url, **kwargs)
+
+    monkeypatch.setattr(utils_strava, "request_with_backoff", request)
+
+    all_streams = client.activities_streams([5, 6, 7])
+
+    assert list(all_streams) == [5, 7]
+    assert "latlng" in all_streams[7]
+
+
+def test_activity_ids_are_paged(strava_server, monkeypatch, tmp_path):
+    """All pages of the athlete's activities in the date range are read."""
+    pages = []
+
+    def request(method, url, params=None, **kwargs):
+        pages.append(params)
+        ids = list(range(5))[(params["page"] - 1) * 2 : params["page"] * 2]
+        return FakeStreamResponse(200, json.dumps([{"id": i} for i in ids]).encode())
+
+    client = StravaClient(
+        "id", "secret", "code", token_cache=TokenCache(str(tmp_path / "t.json"))
+    )
+    client.access_token()
+    monkeypatch.setattr(utils_strava, "request_with_backoff", request)
+    monkeypatch.setattr(utils_strava, "STRAVA_PAGE_SIZE", 2)
+
+    after = datetime(2024, 1, 1, tzinfo=UTC)
+    assert client.activity_ids(after=after) == [0, 1, 2, 3, 4]
+    assert [p["page"] for p in pages] == [1, 2, 3]
+    assert pages[0]["after"] == 1704067200 and "before" not in pages[0]
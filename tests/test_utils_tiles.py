@@ -0,0 +1,194 @@
+"""Unit tests for sampling colors from map tiles."""
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from statistics import mean
+
+import numpy as np
+import pytest
+
+import utils.utils_osm as utils_osm
+import utils.utils_tiles as utils_tiles
+from tests.synthetic import synthetic_tile_png
+from utils.utils_tiles import DecodedTileCache, TileFetchError, TileStore, decode_tile
+
+
+def reference_colors(all_locations: list[list], tile_paths: dict) -> list[int]:
+    """Per-point color sampling, as it was done before vectorizing."""
+    decoded = {key: decode_tile(path) for key, path in tile_paths.items()}
+    all_colors = []
+    zoom = 18
+    lat_extent_degrees = 85.0511
+    degrees_in_tile_x = 360 / math.pow(2, zoom)
+    degrees_in_tile_y = 2 * lat_extent_degrees / math.pow(2, zoom)
+    for lon, lat in all_locations:
+        x = int((lon + 180) / degrees_in_tile_x)
+        y_remapped_value = lat_extent_degrees - lat / 180 * lat_extent_degrees
+        y = int(y_remapped_value / degrees_in_tile_y)
+        remainder_x_degrees = (lon + 180) % degrees_in_tile_x
+        remainder_y_degrees = y_remapped_value % degrees_in_tile_y
+        pixels = decoded[(x, y)]
+        w = pixels.shape[1]
+
+        local_colors_list = []
+        offset = 3
+        for r in range(offset * 2 + 1):
+            coeff = r - offset
+            pixel_x_index = int(remainder_x_degrees / degrees_in_tile_x * w)
+            if 0 <= pixel_x_index + coeff < w:
+                pixel_x_index += coeff
+            pixel_y_index = int(remainder_y_degrees / degrees_in_tile_y * w)
+            if 0 <= pixel_y_index + coeff < w:
+                pixel_y_index += coeff
+            local_colors_list.append(pixels[pixel_y_index, pixel_x_index].tolist())
+
+        average = [int(mean([c[i] for c in local_colors_list])) for i in range(3)]
+        factor = 5
+        average = [int(c / factor / 2.5) * factor for c in average]
+        all_colors.append(
+            (255 << 24) + (average[0] << 16) + (average[1] << 8) + average[2]
+        )
+    return all_colors
+
+
+@pytest.fixture()
+def tile_server():
+    """Run a local stand-in for the tile server, serving synthetic tiles."""
+    requested = []
+
+    class TileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            zoom, x, y = self.path.removesuffix(".png").strip("/").split("/")
+            if int(x) < 0:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = synthetic_tile_png(int(zoom), int(x), int(y))
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if int(x) == 999:
+                # connection lost half way
+                self.wfile.write(body[: len(body) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TileHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/{{z}}/{{x}}/{{y}}.png", requested
+    server.shutdown()
+
+
+@pytest.fixture()
+def tile_store(tmp_path, tile_server) -> TileStore:
+    """Store tiles from the local tile server in a temporary folder."""
+    url, _ = tile_server
+    return TileStore(str(tmp_path / "tiles"), url=url, max_workers=4)
+
+
+def test_colors_match_per_point_sampling(tile_store: TileStore):
+    """Vectorized sampling matches per-point sampling, tile edges included."""
+    rng = np.random.default_rng(0)
+    locations = np.column_stack(
+        [-0.1 + rng.random(300) * 0.004, 51.5 + rng.random(300) * 0.004]
+    )
+    # points right at the corners of a tile
+    tile_size = 360 / 2**18
+    corner = (np.floor((-0.1 + 180) / tile_size) * tile_size) - 180
+    locations = np.vstack([locations, [[corner + 1e-9, 51.5], [corner - 1e-9, 51.5]]])
+
+    colors = utils_osm.get_colors_of_points_from_tiles(locations, tile_store)
+
+    tile_paths = {
+        (int(path.parent.name), int(path.stem)): str(path)
+        for path in Path(tile_store.root).glob("18/*/*.png")
+    }
+    assert colors.shape == (len(locations),)
+    assert colors.tolist() == reference_colors(locations.tolist(), tile_paths)
+
+
+def test_tiles_are_prefetched_once(tile_store: TileStore, tile_server):
+    """Each missing tile is downloaded once and then served from the store."""
+    _, requested = tile_server
+    tiles = [(18, x, y) for x in range(100, 104) for y in range(200, 203)]
+
+    tile_store.prefetch(tiles + tiles[:3])
+    tile_store.prefetch(tiles)
+
+    assert sorted(requested) == sorted(f"/{z}/{x}/{y}.png" for z, x, y in tiles)
+    assert tile_store.downloads == len(tiles)
+    assert Path(tile_store.get(18, 100, 200)).is_file()
+
+
+def test_store_evicts_least_recently_used(tmp_path, tile_server):
+    """The store stays under its size cap, dropping the oldest tiles first."""
+    url, _ = tile_server
+    store = TileStore(str(tmp_path / "tiles"), url=url)
+    store.prefetch([(18, 1, 1), (18, 1, 2)])
+    # room for tiles 2 and 3 only
+    store.max_bytes = os.path.getsize(store.path(18, 1, 2)) + len(
+        synthetic_tile_png(18, 1, 3)
+    )
+    os.utime(store.path(18, 1, 1), (1, 1))
+
+    store.prefetch([(18, 1, 3)])
+
+    assert not os.path.isfile(store.path(18, 1, 1))
+    assert os.path.isfile(store.path(18, 1, 2))
+    assert store.size() <= store.max_bytes
+
+
+def test_failed_tiles_are_reported(tile_store: TileStore):
+    """Tiles the server does not have raise instead of failing later when decoding."""
+    with pytest.raises(TileFetchError) as error:
+        tile_store.prefetch([(18, 1, 1), (18, -1, 1)])
+    assert error.value.failed_tiles == [(18, -1, 1)]
+
+
+def test_broken_download_leaves_no_partial_file(tile_store: TileStore):
+    """A tile cut off mid-download is reported, without a leftover .part file."""
+    with pytest.raises(TileFetchError) as error:
+        tile_store.prefetch([(18, 999, 1)])
+
+    assert error.value.failed_tiles == [(18, 999, 1)]
+    assert list(Path(tile_store.root).rglob("*.part")) == []
+
+
+def test_decoded_tiles_are_reused_and_bounded(tmp_path, monkeypatch):
+    """A tile is decoded once while cached, and the oldest tile is evicted first."""
+    paths = []
+    for x in range(3):
+        path = tmp_path / f"{x}.png"
+        path.write_bytes(synthetic_tile_png(18, x, 0))
+        paths.append(str(path))
+    decoded = []
+
+    def counting_decode(file_path):
+        decoded.append(file_path)
+        return decode_tile(file_path)
+
+    monkeypatch.setattr(utils_tiles, "decode_tile", counting_decode)
+    cache = DecodedTileCache(max_tiles=2)
+
+    first = cache.get(paths[0])
+    assert cache.get(paths[0]) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get(paths[1])
+    # tile 0 was used last, so tile 1 is the oldest when tile 2 comes in
+    cache.get(paths[0])
+    cache.get(paths[2])
+    cache.get(paths[0])
+    cache.get(paths[1])
+
+    assert decoded == [paths[0], paths[1], paths[2], paths[1]]
+    assert (cache.hits, cache.misses) == (3, 4)
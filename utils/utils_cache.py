@@ -0,0 +1,279 @@
+"""Persistent caches shared by the pipeline stages, stored in CACHE_DIR."""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+
+CACHE_DIR = os.environ.get(
+    "STRAVA_AUTOMATE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "strava_automate"),
+)
+
+# SQLite limits the number of host parameters in a single statement
+SQL_CHUNK = 500
+
+
+class SQLiteCache:
+    """Persistent SQLite store of rows keyed by `key`.
+
+    Subclasses name the table and its value columns, and encode keys and
+    values. Entries are evicted least-recently-used first once the store
+    grows beyond `max_entries`.
+    """
+
+    table = ""
+    key_type = "INTEGER"
+    # value columns with their types, stored between key and last_used
+    columns: dict[str, str] = {}
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        """Open or create the store at path, keeping at most max_entries."""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        columns = ", ".join(f"{name} {kind}" for name, kind in self.columns.items())
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} (key {self.key_type} "
+            f"PRIMARY KEY, {columns}, last_used INTEGER NOT NULL)"
+        )
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_last_used "
+            f"ON {self.table} (last_used)"
+        )
+        self._connection.commit()
+        self._clock = self._connection.execute(
+            f"SELECT COALESCE(MAX(last_used), 0) FROM {self.table}"
+        ).fetchone()[0]
+
+    def _get_rows(self, keys: list) -> dict:
+        """Get the value columns of the stored keys, marking them as used."""
+        found = {}
+        with self._lock:
+            self._clock += 1
+            for i in range(0, len(keys), SQL_CHUNK):
+                chunk = list(set(keys[i : i + SQL_CHUNK]))
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, {', '.join(self.columns)} FROM {self.table} "
+                    f"WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                found.update((key, values) for key, *values in rows)
+            self._connection.executemany(
+                f"UPDATE {self.table} SET last_used = ? WHERE key = ?",
+                [(self._clock, key) for key in found],
+            )
+            self._connection.commit()
+        return found
+
+    def _put_rows(self, rows) -> None:
+        """Store (key, *values) rows, evicting the least recently used."""
+        names = ", ".join(["key", *self.columns, "last_used"])
+        placeholders = ",".join("?" * (len(self.columns) + 2))
+        with self._lock:
+            self._clock += 1
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} ({names}) "
+                f"VALUES ({placeholders})",
+                [(*row, self._clock) for row in rows],
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _count(self, found: list) -> None:
+        """Add to the hit/miss counters, a hit being a found value not None."""
+        hits = sum(value is not None for value in found)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(found) - hits
+
+    def _evict(self) -> None:
+        count = self._connection.execute(
+            f"SELECT COUNT(*) FROM {self.table}"
+        ).fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self._connection.execute(
+            f"DELETE FROM {self.table} WHERE key IN "
+            f"(SELECT key FROM {self.table} ORDER BY last_used LIMIT ?)",
+            (count - self.max_entries,),
+        )
+
+    def __len__(self) -> int:
+        """Get the number of stored entries."""
+        with self._lock:
+            return self._connection.execute(
+                f"SELECT COUNT(*) FROM {self.table}"
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        """Get hit/miss counters and the current size of the store."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+
+class ElevationCache(SQLiteCache):
+    """Persistent elevation store keyed by lat/lon rounded to `precision` decimals."""
+
+    table = "elevation"
+    columns = {"elevation": "REAL NOT NULL"}
+
+    def __init__(
+        self, path: str, precision: int = 5, max_entries: int = 5_000_000
+    ) -> None:
+        """Open or create the store at path, rounding to precision decimals."""
+        if not 0 <= precision <= 6:
+            raise ValueError("precision should be between 0 and 6 decimals")
+        self.precision = precision
+        super().__init__(path, max_entries)
+
+    def keys(self, all_locations: list[list[float]]) -> list[int]:
+        """Get integer keys for a list of [lat, lon] locations."""
+        scale = 10**self.precision
+        locations = np.asarray(all_locations, dtype=float).reshape(-1, 2)
+        lat_index = np.rint(locations[:, 0] * scale).astype(np.int64) + 90 * scale
+        lon_index = np.rint(locations[:, 1] * scale).astype(np.int64) + 180 * scale
+        return (lat_index * (360 * scale + 1) + lon_index).tolist()
+
+    def get_many(self, all_locations: list[list[float]]) -> list[float | None]:
+        """Get cached elevations for each location, None where unknown."""
+        keys = self.keys(all_locations)
+        found = self._get_rows(keys)
+        elevations = [found[key][0] if key in found else None for key in keys]
+        self._count(elevations)
+        return elevations
+
+    def put_many(
+        self, all_locations: list[list[float]], elevations: list[float]
+    ) -> None:
+        """Store elevations for the given locations."""
+        keys = self.keys(all_locations)
+        self._put_rows((key, float(e)) for key, e in zip(keys, elevations))
+
+
+class TessellationCache(SQLiteCache):
+    """Persistent store of footprint triangles keyed by building id.
+
+    Each entry keeps a hash of the geometry it was computed from, so
+    buildings edited in OSM are tessellated again.
+    """
+
+    table = "tessellation"
+    key_type = "TEXT"
+    columns = {"geometry": "TEXT NOT NULL", "triangles": "BLOB NOT NULL"}
+
+    def __init__(self, path: str, max_entries: int = 1_000_000) -> None:
+        """Open or create the store at path, keeping at most max_entries."""
+        super().__init__(path, max_entries)
+
+    def get_many(
+        self, keys: list[str], geometry_hashes: list[str]
+    ) -> list[np.ndarray | None]:
+        """Get cached (T, 3) triangles of each building, None if unknown or changed."""
+        found = self._get_rows(keys)
+        triangles = []
+        for key, geometry_hash in zip(keys, geometry_hashes):
+            geometry, blob = found.get(key, (None, b""))
+            if geometry == geometry_hash:
+                triangles.append(np.frombuffer(blob, dtype=np.int32).reshape(-1, 3))
+            else:
+                triangles.append(None)
+        self._count(triangles)
+        return triangles
+
+    def put_many(
+        self, keys: list[str], geometry_hashes: list[str], triangles: list
+    ) -> None:
+        """Store the triangles of each building with the hash of its geometry."""
+        self._put_rows(
+            (key, geometry, np.asarray(t, np.int32).tobytes())
+            for key, geometry, t in zip(keys, geometry_hashes, triangles)
+        )
+
+
+class TokenCache:
+    """Persistent JSON store of OAuth tokens, readable by the owner only."""
+
+    def __init__(self, path: str) -> None:
+        """Store the tokens in the JSON file at path."""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key: str) -> dict | None:
+        """Get the token stored under key, None if there is none."""
+        with self._lock:
+            return self._read().get(key)
+
+    def put(self, key: str, token: dict) -> None:
+        """Store the token under key."""
+        with self._lock:
+            tokens = self._read()
+            tokens[key] = token
+            # write to a temporary file first, so the store is never half-written
+            folder = os.path.dirname(self.path) or "."
+            with tempfile.NamedTemporaryFile(
+                "w", dir=folder, suffix=".part", delete=False
+            ) as f:
+                json.dump(tokens, f)
+            os.chmod(f.name, 0o600)
+            os.replace(f.name, self.path)
+
+
+# caches shared by the whole process, by name, created on first use
+_shared_caches: dict[str, object] = {}
+_shared_caches_lock = threading.Lock()
+
+
+def _get_shared_cache(name: str, create):
+    """Get the shared cache called name, creating it with create() once."""
+    with _shared_caches_lock:
+        if name not in _shared_caches:
+            _shared_caches[name] = create()
+        return _shared_caches[name]
+
+
+def get_elevation_cache() -> ElevationCache:
+    """Get the shared elevation cache, stored in CACHE_DIR."""
+    return _get_shared_cache(
+        "elevation",
+        lambda: ElevationCache(os.path.join(CACHE_DIR, "elevation.sqlite")),
+    )
+
+
+def get_tessellation_cache() -> TessellationCache:
+    """Get the shared tessellation cache, stored in CACHE_DIR."""
+    return _get_shared_cache(
+        "tessellation",
+        lambda: TessellationCache(os.path.join(CACHE_DIR, "tessellation.sqlite")),
+    )
+
+
+def get_token_cache() -> TokenCache:
+    """Get the shared token cache, stored in CACHE_DIR."""
+    return _get_shared_cache(
+        "tokens",
+        lambda: TokenCache(os.path.join(CACHE_DIR, "strava_tokens.json")),
+    )
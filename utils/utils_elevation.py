@@ -1,367 +1,374 @@
-import json
-import math
-from statistics import mean  # noqa: D100
+import json  # noqa: D100
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
 import requests
+import shapely
 from shapely.geometry import MultiPoint
 from shapely import delaunay_triangles
 from specklepy.objects import Base
-from specklepy.objects.geometry import Line, Mesh, Point, Polyline
-from utils.utils_osm import get_colors_of_points_from_tiles, getBuildings
-
-from utils.utils_pyproj import createCRS, getBbox, reprojectToCrs
-from utils.utils_shapely import get_subset_from_list
-
-
-def get_elevation_from_points(all_locations: list[list[float, float]]) -> list[dict]:
-    """Get list of elevations for each point in the list."""
-    # print("get_elevation_from_points")
-    base_url = "https://api.open-elevation.com/api/v1/lookup"
-    all_data = []
-    max_locations = 10000
-    number_of_chunks = math.ceil(len(all_locations) / max_locations)
-    # print(len(all_locations))
-    for i in range(number_of_chunks):
-        if i == number_of_chunks - 1:
-            chunk_of_locations = all_locations[i * max_locations : len(all_locations)]
-        else:
-            chunk_of_locations = all_locations[
-                i * max_locations : (i + 1) * max_locations
-            ]
-        locations = [
-            {"latitude": location[0], "longitude": location[1]}
-            for location in chunk_of_locations
-        ]
-        payload = {"locations": locations}
+from specklepy.objects.geometry import Line, Point, Polyline
+from utils.utils_cache import get_elevation_cache
+from utils.utils_mesh import meshes_from_buffers, subdivide_triangles
+from utils.utils_http import request_with_backoff
+from utils.utils_metrics import metrics
+from utils.utils_osm import (
+    extrudeBuildingFootprints,
+    fetch_overpass_elements,
+    get_colors_of_points_from_tiles,
+    parseBuildingFootprints,
+    plan_overpass_queries,
+)
+
+from utils.utils_pyproj import createCRS, reprojectArrayToCrs
+from utils.utils_shapely import get_grid_points_in_corridor, get_routes_corridor
+
+ELEVATION_URL = os.environ.get(
+    "STRAVA_AUTOMATE_ELEVATION_URL", "https://api.open-elevation.com/api/v1/lookup"
+)
+ELEVATION_MAX_LOCATIONS = 10000
+ELEVATION_MAX_PAYLOAD_BYTES = 1024 * 1024
+ELEVATION_CONCURRENCY = 4
+# route points compared with the elevation API to align recorded altitudes
+ALTITUDE_ALIGNMENT_SAMPLES = 50
+
+# default terrain level of detail
+TERRAIN_RADIUS = 100
+TERRAIN_GRID_STEP = 40
+TERRAIN_SUBDIVISIONS = 1
+METERS_PER_DEGREE = 111_320
+
+
+class ElevationFetchError(Exception):
+    """Raised when elevations could not be fetched for some of the locations."""
+
+    def __init__(self, failed_chunks: list[tuple[int, int, str]]):
+        """Keep the (start, end, reason) of every chunk that failed."""
+        self.failed_chunks = failed_chunks
+        details = ", ".join(
+            f"[{start}:{end}] {reason}" for start, end, reason in failed_chunks
+        )
+        super().__init__(
+            f"Failed to get elevations for {len(failed_chunks)} chunk(s): {details}"
+        )
 
-        for _ in range(5):
-            response = requests.post(base_url, data=json.dumps(payload))
-            if response.status_code == 200:
-                data = response.json()
-                all_data.extend(data["results"])
-                break
 
-    return all_data
+def get_elevation_from_points(
+    all_locations: list[list[float, float]], use_cache: bool = True
+) -> list[dict]:
+    """Get list of elevations for each point in the list.
+
+    Elevations already stored in the local cache are not requested again.
+    """
+    if not use_cache:
+        return fetch_elevation_from_points(all_locations)
+
+    cache = get_elevation_cache()
+    keys = cache.keys(all_locations)
+    known_elevations = {
+        key: elevation
+        for key, elevation in zip(keys, cache.get_many(all_locations))
+        if elevation is not None
+    }
+
+    # request each missing location only once
+    missing_locations = {}
+    for key, location in zip(keys, all_locations):
+        if key not in known_elevations:
+            missing_locations.setdefault(key, location)
+    fetched_data = fetch_elevation_from_points(list(missing_locations.values()))
+    if len(fetched_data) > 0:
+        fetched_locations = [[r["latitude"], r["longitude"]] for r in fetched_data]
+        fetched_elevations = [r["elevation"] for r in fetched_data]
+        cache.put_many(fetched_locations, fetched_elevations)
+        known_elevations.update(
+            zip(cache.keys(fetched_locations), fetched_elevations)
+        )
 
+    return [
+        {
+            "latitude": location[0],
+            "longitude": location[1],
+            "elevation": known_elevations[key],
+        }
+        for key, location in zip(keys, all_locations)
+        if key in known_elevations
+    ]
 
-def get_buildings_mesh_from_2d_route(all_locations_2d: list) -> Base:
-    """Create Speckle 3d mesh from 2d route data."""
-    crs_to_use = createCRS(all_locations_2d[0][0], all_locations_2d[0][1])
-    all_bld_meshes: list[list] = []
-    all_ids = []
-    radius = 100
-    round_koef = 100000
-    step_no_units = 50
-    koeff = 20
-    # split all route into zones to query elevation
-    for i, _ in enumerate(all_locations_2d):
-        set_of_point_float_lists = get_subset_from_list(all_locations_2d, i, koeff)
-
-        if set_of_point_float_lists is None:
-            break
-        middle_point = set_of_point_float_lists[
-            math.floor(len(set_of_point_float_lists) / 2)
-        ]
-        bldg_meshes, new_ids = getBuildings(
-            middle_point[0], middle_point[1], radius, crs_to_use, all_ids
-        )
-        all_ids.extend(new_ids)
-        all_bld_meshes.extend(bldg_meshes)
-    return all_bld_meshes
 
+def align_altitudes_to_terrain(
+    all_locations: list[list[float, float]],
+    altitudes: list[float],
+    samples: int = ALTITUDE_ALIGNMENT_SAMPLES,
+) -> list[float]:
+    """Shift recorded altitudes (e.g. from GPS) to the datum of the elevation API.
+
+    The offset is the median difference at up to `samples` points spread
+    evenly along the route, so only those points are requested.
+    """
+    altitudes = np.asarray(altitudes, dtype=float)
+    if samples <= 0 or len(altitudes) == 0:
+        return altitudes.tolist()
+    sample_indices = np.unique(
+        np.linspace(0, len(altitudes) - 1, min(samples, len(altitudes))).round()
+    ).astype(int)
+    terrain = get_elevation_from_points([all_locations[i] for i in sample_indices])
+    offset = np.median([p["elevation"] for p in terrain] - altitudes[sample_indices])
+    return (altitudes + offset).tolist()
+
+
+def fetch_elevation_from_points(
+    all_locations: list[list[float, float]],
+    max_locations: int = ELEVATION_MAX_LOCATIONS,
+    max_workers: int = ELEVATION_CONCURRENCY,
+) -> list[dict]:
+    """Request elevations for each point in the list from the open-elevation API.
+
+    Chunks are sent concurrently over the shared session. A chunk rejected
+    as too large is split in half and sent again. Raises ElevationFetchError
+    if any chunk still fails, instead of returning fewer results.
+    """
+    if len(all_locations) == 0:
+        return []
+    metrics.count("elevation.fetched_points", len(all_locations))
+    chunk_size = get_elevation_chunk_size(all_locations, max_locations)
+    chunks = [
+        (start, min(start + chunk_size, len(all_locations)))
+        for start in range(0, len(all_locations), chunk_size)
+    ]
 
-def get_speckle_mesh_from_2d_route(all_locations_2d: list) -> Base:
-    """Create Speckle 3d mesh from 2d route data."""
-    crs_to_use = createCRS(all_locations_2d[0][0], all_locations_2d[0][1])
-    grid_points: list[list] = []
-    radius = 100
-    round_koef = 100000
-    step_no_units = 40
-    koeff = 20
-    # split all route into zones to query elevation
-    for i, _ in enumerate(all_locations_2d):
-        set_of_point_float_lists = get_subset_from_list(all_locations_2d, i, koeff)
-
-        if set_of_point_float_lists is None:
-            break
-        middle_point = set_of_point_float_lists[
-            math.floor(len(set_of_point_float_lists) / 2)
-        ]
-        y0, x0, y1, x1 = getBbox(middle_point[0], middle_point[1], radius)
-        # print(y0, x0, y1, x1)
-
-        for k in range(
-            math.floor(x0 * round_koef), math.ceil(x1 * round_koef), step_no_units
-        ):
-            for n in range(
-                math.floor(y0 * round_koef), math.ceil(y1 * round_koef), step_no_units
-            ):
-                terrain_point_2d = [n / round_koef, k / round_koef]
-                if terrain_point_2d not in grid_points:
-                    grid_points.append(terrain_point_2d)
-    grid_points_3d = get_elevation_from_points(grid_points)
-    print("GRID POINTS")
-    print(grid_points_3d[:10])
-
-    reprojected_points = []
-    # reproject basic points
-    for p in grid_points_3d:
-        # reproject points to metric CRS
-        x, y = reprojectToCrs(p["latitude"], p["longitude"], "EPSG:4326", crs_to_use)
-        reprojected_points.append((x, y, p["elevation"]))
-
-    triangles = delaunay_triangles(MultiPoint(reprojected_points)).geoms
-    print("TRIANGLES")
-    print(triangles[:5])
-    meshes = []
-    for tr in triangles:
-        linearring = tr.exterior
-        coords = linearring.coords
-
-        triangle_points: list[list] = []
-        # colors = []
-        valid_triangle = True
-        for k, c in enumerate(coords):
-            if k != 0:
-                distance = math.sqrt(
-                    math.pow(coords[k][0] - coords[k - 1][0], 2)
-                    + math.pow(coords[k][1] - coords[k - 1][1], 2)
-                )
-                if distance > radius * 2:
-                    valid_triangle = False
-            triangle_points.append([c[0], c[1], c[2]])
-
-        if valid_triangle is False:
-            continue
-
-        triangle_detailed_pts = get_detailed_triangle_pts(
-            triangle_points, repeated_division=True
-        )
-        triangle_detailed_pts_degrees = [
-            reprojectToCrs(pt[1], pt[0], crs_to_use, "EPSG:4326")
-            for pt in triangle_detailed_pts
-        ]
-        triangle_detailed_colors = get_colors_of_points_from_tiles(
-            triangle_detailed_pts_degrees
-        )
+    chunk_results: list[list[dict]] = [[] for _ in chunks]
+    failed_chunks = []
+    with metrics.stage("elevation.fetch"), ThreadPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        futures = {
+            executor.submit(fetch_elevation_chunk, all_locations, start, end): i
+            for i, (start, end) in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            data, failed = future.result()
+            chunk_results[futures[future]] = data
+            failed_chunks.extend(failed)
+
+    if len(failed_chunks) > 0:
+        raise ElevationFetchError(sorted(failed_chunks))
+    return [r for data in chunk_results for r in data]
+
+
+def get_elevation_chunk_size(
+    all_locations: list[list[float, float]], max_locations: int
+) -> int:
+    """Get the number of locations per request fitting ELEVATION_MAX_PAYLOAD_BYTES."""
+    sample = [
+        {"latitude": location[0], "longitude": location[1]}
+        for location in all_locations[:100]
+    ]
+    bytes_per_location = len(json.dumps(sample)) / len(sample) * 1.1
+    return max(
+        1, min(max_locations, int(ELEVATION_MAX_PAYLOAD_BYTES / bytes_per_location))
+    )
 
-        new_meshes = get_6_meshes_inside_triangle(
-            crs_to_use,
-            triangle_points,
-            triangle_detailed_pts,
-            triangle_detailed_colors,
-        )
-        meshes.extend(new_meshes)
-    return Base(units="m", displayValue=meshes)
 
+def fetch_elevation_chunk(
+    all_locations: list[list[float, float]], start: int, end: int
+) -> tuple[list[dict], list[tuple[int, int, str]]]:
+    """Request elevations for all_locations[start:end].
 
-def get_detailed_triangle_pts(triangle_points: list[list], repeated_division=False):
-    all_pts = []
-    central_pt = [
-        mean([p[0] for p in triangle_points]),
-        mean([p[1] for p in triangle_points]),
-        mean([p[2] for p in triangle_points]),
+    Returns the results and a list of (start, end, reason) for failed parts.
+    """
+    locations = [
+        {"latitude": float(location[0]), "longitude": float(location[1])}
+        for location in all_locations[start:end]
     ]
-    all_pts.extend(triangle_points)
-    all_pts.append(central_pt)
-    for k, p in enumerate(triangle_points):
-        if k == len(triangle_points) - 1:
-            pt_next = triangle_points[0]
-        else:
-            pt_next = triangle_points[k + 1]
-        pt_mid = [
-            min(p[0], pt_next[0]) + abs(p[0] - pt_next[0]) / 2,
-            min(p[1], pt_next[1]) + abs(p[1] - pt_next[1]) / 2,
-            min(p[2], pt_next[2]) + abs(p[2] - pt_next[2]) / 2,
+    try:
+        response = request_with_backoff(
+            "POST",
+            ELEVATION_URL,
+            json={"locations": locations},
+        )
+    except requests.RequestException as ex:
+        return [], [(start, end, str(ex))]
+
+    if response.status_code == 413 and end - start > 1:
+        # payload too large for the server: split in half
+        middle = (start + end) // 2
+        first_data, first_failed = fetch_elevation_chunk(all_locations, start, middle)
+        second_data, second_failed = fetch_elevation_chunk(all_locations, middle, end)
+        return first_data + second_data, first_failed + second_failed
+    if response.status_code != 200:
+        return [], [(start, end, f"HTTP {response.status_code}")]
+
+    results = response.json()["results"]
+    if len(results) != end - start:
+        return [], [
+            (start, end, f"got {len(results)} results for {end - start} locations")
         ]
-        all_pts.append(pt_mid)
+    return results, []
 
-        # repeat sub-division with triangles
-        if repeated_division is True:
-            extra_pts = get_detailed_triangle_pts(
-                [p, central_pt, pt_mid], repeated_division=False
-            )
-            for extra in extra_pts:
-                if extra not in all_pts:
-                    all_pts.append(extra)
-            # second triangle
-            extra_pts = get_detailed_triangle_pts(
-                [central_pt, pt_next, pt_mid], repeated_division=False
-            )
-            for extra in extra_pts:
-                if extra not in all_pts:
-                    all_pts.append(extra)
-    return all_pts
-
-
-def get_mesh_from_triangle(crs_to_use, triangle_points: list[list]) -> list[Mesh]:
-    meshes = []
-    vertices = []
-    pt1 = triangle_points[0]
-    pt2 = triangle_points[1]
-    pt3 = triangle_points[2]
-    vertices.extend(pt1)
-    vertices.extend(pt2)
-    vertices.extend(pt3)
-
-    colors = get_colors_of_points_from_tiles(
-        [
-            reprojectToCrs(pt1[1], pt1[0], crs_to_use, "EPSG:4326"),
-            reprojectToCrs(pt2[1], pt2[0], crs_to_use, "EPSG:4326"),
-            reprojectToCrs(pt3[1], pt3[0], crs_to_use, "EPSG:4326"),
-        ]
-    )
-    face_list = list(range(len(colors)))
-    mesh = Mesh.create(
-        vertices=vertices, colors=colors, faces=[len(colors)] + face_list
-    )
-    mesh.units = "m"
-    meshes.append(mesh)
 
+def get_buildings_mesh_from_2d_route(
+    all_locations_2d: list, radius: float = TERRAIN_RADIUS
+) -> Base:
+    """Create Speckle 3d mesh from 2d route data."""
+    return get_buildings_mesh_from_2d_routes([all_locations_2d], radius)
+
+
+def get_buildings_mesh_from_2d_routes(
+    all_routes_2d: list[list],
+    radius: float = TERRAIN_RADIUS,
+    crs_to_use=None,
+) -> Base:
+    """Create Speckle 3d mesh of the buildings along several routes.
+
+    Buildings in the area shared by the routes are fetched and built once,
+    merged into a few meshes.
+    """
+    if crs_to_use is None:
+        crs_to_use = createCRS(all_routes_2d[0][0][0], all_routes_2d[0][0][1])
+    # query the whole corridor in a few non-overlapping tiles
+    with metrics.stage("buildings.overpass"):
+        corridor = get_routes_corridor(all_routes_2d, radius, crs_to_use)
+        queries = plan_overpass_queries(corridor, crs_to_use)
+        features = fetch_overpass_elements(queries)
+    metrics.count("buildings.overpass_queries", len(queries))
+    with metrics.stage("buildings.parse"):
+        footprints, _ = parseBuildingFootprints(features, crs_to_use)
+    # one batched elevation lookup for all buildings along the routes
+    with metrics.stage("buildings.extrude"):
+        meshes = extrudeBuildingFootprints(footprints)
+    metrics.count_meshes("buildings", meshes)
     return meshes
 
 
-def get_6_meshes_inside_triangle(
+def get_terrain_grid_points(
+    all_routes_2d: list[list],
     crs_to_use,
-    triangle_points: list[list],
-    triangle_detailed_pts,
-    triangle_detailed_colors,
-) -> list[Mesh]:
-    meshes = []
-    # split into smaller triangles
-    central_pt = [
-        mean([p[0] for p in triangle_points]),
-        mean([p[1] for p in triangle_points]),
-        mean([p[2] for p in triangle_points]),
+    radius: float = TERRAIN_RADIUS,
+    step: int = TERRAIN_GRID_STEP,
+    detail_radius: float | None = None,
+    coarse_step: int | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Get the unique terrain grid points around all routes.
+
+    See get_speckle_mesh_from_2d_route for the arguments. Returns (N, 2)
+    arrays of [lat, lon] and of metric [x, y] coordinates.
+    """
+    graded = detail_radius is not None and bool(coarse_step) and detail_radius < radius
+    grids = [
+        get_grid_points_in_corridor(
+            route, detail_radius if graded else radius, step, crs_to_use
+        )
+        for route in all_routes_2d
     ]
-    for k, p in enumerate(triangle_points):
-        # each edge to 2 triangles
-        # mesh 1
-        vertices = []
-        if k == len(triangle_points) - 1:
-            pt_next = triangle_points[0]
-        else:
-            pt_next = triangle_points[k + 1]
-        pt_mid = [
-            min(p[0], pt_next[0]) + abs(p[0] - pt_next[0]) / 2,
-            min(p[1], pt_next[1]) + abs(p[1] - pt_next[1]) / 2,
-            min(p[2], pt_next[2]) + abs(p[2] - pt_next[2]) / 2,
-        ]
-        pt1 = p
-        pt2 = central_pt
-        pt3 = pt_mid
-        vertices.extend(pt1)
-        vertices.extend(pt2)
-        vertices.extend(pt3)
-
-        colors = []
-        color1 = color2 = color3 = 0
-        for k, pt in enumerate(triangle_detailed_pts):
-            if pt == pt1:
-                color1 = triangle_detailed_colors[k]
-            if pt == pt2:
-                color2 = triangle_detailed_colors[k]
-            if pt == pt3:
-                color3 = triangle_detailed_colors[k]
-        colors.extend([color1, color2, color3])
-
-        # colors = get_colors_of_points_from_tiles(
-        #    [
-        #        reprojectToCrs(pt1[1], pt1[0], crs_to_use, "EPSG:4326"),
-        #        reprojectToCrs(pt2[1], pt2[0], crs_to_use, "EPSG:4326"),
-        #        reprojectToCrs(pt3[1], pt3[0], crs_to_use, "EPSG:4326"),
-        #    ]
-        # )
-        face_list = list(range(len(colors)))
-        mesh = Mesh.create(
-            vertices=vertices, colors=colors, faces=[len(colors)] + face_list
+    if graded:
+        # the coarse grid only where no route has the fine one
+        fine_corridor = get_routes_corridor(all_routes_2d, detail_radius, crs_to_use)
+        for route in all_routes_2d:
+            points, points_metric = get_grid_points_in_corridor(
+                route, radius, coarse_step, crs_to_use
+            )
+            outside = ~shapely.contains_xy(
+                fine_corridor, points_metric[:, 0], points_metric[:, 1]
+            )
+            grids.append((points[outside], points_metric[outside]))
+
+    grid_points = np.concatenate([points for points, _ in grids])
+    grid_points_metric = np.concatenate([metric for _, metric in grids])
+    # lattice points are computed the same way for every route, so equal
+    # points of overlapping routes are exactly equal
+    _, unique = np.unique(grid_points, axis=0, return_index=True)
+    return grid_points[unique], grid_points_metric[unique]
+
+
+def get_speckle_mesh_from_2d_route(
+    all_locations_2d: list,
+    radius: float = TERRAIN_RADIUS,
+    step: int = TERRAIN_GRID_STEP,
+    subdivisions: int = TERRAIN_SUBDIVISIONS,
+    detail_radius: float | None = None,
+    coarse_step: int | None = None,
+) -> Base:
+    """Create Speckle 3d mesh from 2d route data.
+
+    Args:
+        all_locations_2d: route points as [lat, lon].
+        radius: width of the terrain on each side of the route, in meters.
+        step: grid spacing, in 0.00001 degrees (about 1 m).
+        subdivisions: how many times each grid triangle is split into 6,
+            e.g. 1 for 6 and 2 for 36 triangles.
+        detail_radius: if set together with coarse_step, the grid uses
+            step only within this distance (meters) of the route and
+            coarse_step further away.
+        coarse_step: grid spacing away from the route, in 0.00001 degrees.
+    """
+    return get_speckle_mesh_from_2d_routes(
+        [all_locations_2d], radius, step, subdivisions, detail_radius, coarse_step
+    )
+
+
+def get_speckle_mesh_from_2d_routes(
+    all_routes_2d: list[list],
+    radius: float = TERRAIN_RADIUS,
+    step: int = TERRAIN_GRID_STEP,
+    subdivisions: int = TERRAIN_SUBDIVISIONS,
+    detail_radius: float | None = None,
+    coarse_step: int | None = None,
+    crs_to_use=None,
+) -> Base:
+    """Create one Speckle 3d terrain mesh around several routes.
+
+    The area shared by the routes is sampled and built once. See
+    get_speckle_mesh_from_2d_route for the other arguments.
+    """
+    if subdivisions < 0:
+        raise ValueError("subdivisions should not be negative")
+    if crs_to_use is None:
+        crs_to_use = createCRS(all_routes_2d[0][0][0], all_routes_2d[0][0][1])
+    # lattice of terrain points around the routes, as [lat, lon] and metric [x, y]
+    with metrics.stage("terrain.grid"):
+        grid_points, grid_points_metric = get_terrain_grid_points(
+            all_routes_2d, crs_to_use, radius, step, detail_radius, coarse_step
         )
-        mesh.units = "m"
-        meshes.append(mesh)
-
-        # mesh 2
-        vertices = []
-        pt1 = pt_next
-        pt2 = pt_mid
-        pt3 = central_pt
-        vertices.extend(pt1)
-        vertices.extend(pt2)
-        vertices.extend(pt3)
-
-        colors = []
-        color1 = color2 = color3 = 0
-        for k, pt in enumerate(triangle_detailed_pts):
-            if pt == pt1:
-                color1 = triangle_detailed_colors[k]
-            if pt == pt2:
-                color2 = triangle_detailed_colors[k]
-            if pt == pt3:
-                color3 = triangle_detailed_colors[k]
-        colors.extend([color1, color2, color3])
-
-        # colors = get_colors_of_points_from_tiles(
-        #    [
-        #        reprojectToCrs(pt1[1], pt1[0], crs_to_use, "EPSG:4326"),
-        #        reprojectToCrs(pt2[1], pt2[0], crs_to_use, "EPSG:4326"),
-        #        reprojectToCrs(pt3[1], pt3[0], crs_to_use, "EPSG:4326"),
-        #    ]
-        # )
-        face_list = list(range(len(colors)))
-        mesh = Mesh.create(
-            vertices=vertices, colors=colors, faces=[len(colors)] + face_list
+    graded = detail_radius is not None and bool(coarse_step) and detail_radius < radius
+    max_step = max(step, coarse_step) if graded else step
+    metrics.count("terrain.grid_points", len(grid_points))
+    with metrics.stage("terrain.elevation"):
+        grid_points_3d = get_elevation_from_points(grid_points.tolist())
+
+    reprojected_points = np.column_stack(
+        [grid_points_metric, [p["elevation"] for p in grid_points_3d]]
+    )
+
+    with metrics.stage("terrain.delaunay"):
+        triangles = delaunay_triangles(MultiPoint(reprojected_points))
+        # triangle corners as indices into a shared vertex array
+        corners = shapely.get_coordinates(triangles, include_z=True)
+        corners = corners.reshape(-1, 4, 3)[:, :3]
+        vertices, triangle_indices = np.unique(
+            corners.reshape(-1, 3), axis=0, return_inverse=True
         )
-        mesh.units = "m"
-        meshes.append(mesh)
+        triangle_indices = triangle_indices.reshape(-1, 3)
 
-    return meshes
+        # skip triangles bridging gaps in the grid, allowing a few grid cells
+        max_edge = max(radius * 2, 3 * max_step / 100000 * METERS_PER_DEGREE)
+        edge_vectors = corners - np.roll(corners, -1, axis=1)
+        edge_lengths = np.hypot(edge_vectors[:, :, 0], edge_vectors[:, :, 1])
+        triangle_indices = triangle_indices[(edge_lengths <= max_edge).all(axis=1)]
 
+        for _ in range(subdivisions):
+            vertices, triangle_indices = subdivide_triangles(vertices, triangle_indices)
 
-def get_36_meshes_inside_triangle(
-    crs_to_use,
-    triangle_points: list[list],
-    triangle_detailed_pts,
-    triangle_detailed_colors,
-) -> list[Mesh]:
-    meshes = []
-    # split into smaller triangles
-    central_pt = [
-        mean([p[0] for p in triangle_points]),
-        mean([p[1] for p in triangle_points]),
-        mean([p[2] for p in triangle_points]),
-    ]
-    for k, p in enumerate(triangle_points):
-        # each edge to 2 triangles
-        # meshes 1
-        if k == len(triangle_points) - 1:
-            pt_next = triangle_points[0]
-        else:
-            pt_next = triangle_points[k + 1]
-        pt_mid = [
-            min(p[0], pt_next[0]) + abs(p[0] - pt_next[0]) / 2,
-            min(p[1], pt_next[1]) + abs(p[1] - pt_next[1]) / 2,
-            min(p[2], pt_next[2]) + abs(p[2] - pt_next[2]) / 2,
-        ]
-        pt1 = p
-        pt2 = central_pt
-        pt3 = pt_mid
-        new_meshes = get_6_meshes_inside_triangle(
-            crs_to_use,
-            [pt1 + pt2 + pt3],
-            triangle_detailed_pts,
-            triangle_detailed_colors,
-        )
-        meshes.extend(new_meshes)
-
-        # meshes 2
-        pt1 = pt_next
-        pt2 = pt_mid
-        pt3 = central_pt
-        new_meshes = get_6_meshes_inside_triangle(
-            crs_to_use,
-            [pt1 + pt2 + pt3],
-            triangle_detailed_pts,
-            triangle_detailed_colors,
+    # sample the map color once per vertex
+    with metrics.stage("terrain.colors"):
+        lons, lats = reprojectArrayToCrs(
+            vertices[:, 1], vertices[:, 0], crs_to_use, "EPSG:4326"
         )
-        meshes.extend(new_meshes)
+        colors = get_colors_of_points_from_tiles(np.column_stack([lons, lats]))
 
-    return meshes
+    # one shared vertex buffer for the whole terrain
+    with metrics.stage("terrain.meshes"):
+        meshes = meshes_from_buffers(vertices, triangle_indices, colors)
+    metrics.count_meshes("terrain", meshes)
+    return Base(units="m", displayValue=meshes)
@@ -0,0 +1,77 @@
+"""Shared HTTP session with retries and backoff for the public services."""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.utils_metrics import metrics
+
+USER_AGENT = "strava_automate"
+POOL_SIZE = 32
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Get the shared HTTP session, reusing pooled connections between calls."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"User-Agent": USER_AGENT})
+            _session = session
+    return _session
+
+
+def request_with_backoff(
+    method: str,
+    url: str,
+    retries: int = 5,
+    backoff: float = 0.5,
+    max_backoff: float = 30,
+    session: requests.Session | None = None,
+    **kwargs,
+) -> requests.Response:
+    """Send a request, retrying with exponential backoff.
+
+    Connection errors and RETRY_STATUS_CODES are retried; any other
+    response is returned to the caller. The last error is raised once
+    all attempts are used.
+    """
+    if session is None:
+        session = get_session()
+    kwargs.setdefault("timeout", 60)
+    host = urlsplit(url).hostname
+    for attempt in range(retries):
+        delay = min(backoff * 2**attempt, max_backoff)
+        if attempt > 0:
+            metrics.count("http.retries")
+        metrics.count(f"http.{host}.requests")
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            metrics.count("http.connection_errors")
+            if attempt == retries - 1:
+                raise
+        else:
+            # streamed bodies are only counted when the server sends their size
+            metrics.count(
+                f"http.{host}.bytes",
+                response.headers.get("Content-Length", 0),
+            )
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+            if attempt == retries - 1:
+                response.raise_for_status()
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = min(float(retry_after), max_backoff)
+        time.sleep(delay)
+    raise ValueError("retries should be at least 1")
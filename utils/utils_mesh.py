@@ -0,0 +1,274 @@
+"""Indexed Speckle meshes built from shared vertex and face buffers."""
+import numpy as np
+from specklepy.objects.geometry import Mesh
+
+# keep each mesh small enough for the viewer to load progressively
+MAX_MESH_VERTICES = 100_000
+
+
+def meshes_from_buffers(
+    vertices, faces, colors, max_vertices: int = MAX_MESH_VERTICES
+) -> list[Mesh]:
+    """Create indexed Speckle meshes from shared buffers.
+
+    Args:
+        vertices: (V, 3) array of vertex coordinates.
+        faces: (F, n) array of vertex indices, e.g. (F, 3) for triangles.
+        colors: (V,) array of ARGB colors, one per vertex.
+        max_vertices: faces are split into chunks using at most this many
+            vertices each, every chunk becoming one Mesh.
+    """
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+    colors = np.asarray(colors, dtype=np.int64)
+    faces = np.asarray(faces, dtype=np.int64)
+    if len(faces) == 0:
+        return []
+    faces = faces.reshape(len(faces), -1)
+    face_size = faces.shape[1]
+    faces_per_mesh = max(1, max_vertices // face_size)
+
+    meshes = []
+    for start in range(0, len(faces), faces_per_mesh):
+        chunk = faces[start : start + faces_per_mesh]
+        # keep only the vertices used by this chunk
+        used, chunk_faces = np.unique(chunk, return_inverse=True)
+        chunk_faces = chunk_faces.reshape(chunk.shape)
+        speckle_faces = np.column_stack(
+            [np.full(len(chunk_faces), face_size), chunk_faces]
+        )
+        mesh = Mesh.create(
+            vertices=vertices[used].ravel().tolist(),
+            faces=speckle_faces.ravel().tolist(),
+            colors=colors[used].tolist(),
+        )
+        mesh.units = "m"
+        meshes.append(mesh)
+    return meshes
+
+
+def subdivide_triangles(
+    vertices: np.ndarray, triangles: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Split each triangle into 6, through its centroid and edge midpoints.
+
+    Midpoints of edges shared by neighbouring triangles are created once.
+
+    Args:
+        vertices: (V, 3) array of vertex coordinates.
+        triangles: (T, 3) array of vertex indices.
+
+    Returns:
+        (V + E + T, 3) vertices, starting with the original ones, and
+        (6T, 3) triangles.
+    """
+    vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    # edges (p, next) of each triangle, and the midpoint shared by equal edges
+    edges = np.stack([triangles, np.roll(triangles, -1, axis=1)], axis=2)
+    unique_edges, edge_index = np.unique(
+        np.sort(edges.reshape(-1, 2), axis=1), axis=0, return_inverse=True
+    )
+    start, end = vertices[unique_edges[:, 0]], vertices[unique_edges[:, 1]]
+    midpoints = np.minimum(start, end) + np.abs(start - end) / 2
+    centroids = vertices[triangles].mean(axis=1)
+
+    midpoint_index = len(vertices) + edge_index.reshape(-1, 3)
+    centroid_index = len(vertices) + len(unique_edges) + np.arange(len(triangles))
+    centroid_index = np.repeat(centroid_index[:, None], 3, axis=1)
+    next_index = np.roll(triangles, -1, axis=1)
+    # each edge to 2 triangles: (p, centroid, mid) and (next, mid, centroid)
+    new_triangles = np.stack(
+        [
+            np.stack([triangles, centroid_index, midpoint_index], axis=2),
+            np.stack([next_index, midpoint_index, centroid_index], axis=2),
+        ],
+        axis=2,
+    )
+    return (
+        np.concatenate([vertices, midpoints, centroids]),
+        new_triangles.reshape(-1, 3),
+    )
+
+
+def triangulate_polygon(outer, holes=()) -> np.ndarray:
+    """Triangulate a polygon with holes by ear clipping.
+
+    Each hole is first bridged to the outer ring, making a single ring
+    that touches itself at the bridges. Repeated points are skipped.
+
+    Args:
+        outer: (n, 2) points of the outer ring, in any orientation.
+        holes: (m, 2) points of each hole.
+
+    Returns:
+        (T, 3) counter-clockwise triangles, as indices into the outer
+        points followed by the points of each hole.
+    """
+    rings = [np.asarray(ring, dtype=float).reshape(-1, 2) for ring in [outer, *holes]]
+    points = np.concatenate(rings)
+    starts = np.cumsum([0] + [len(ring) for ring in rings])
+
+    def oriented(k: int, counter_clockwise: bool) -> list[int]:
+        ring = points[starts[k] : starts[k + 1]]
+        # also drops a closing point repeating the first one
+        kept = (ring != ring[np.arange(len(ring)) - 1]).any(axis=1)
+        indices = (starts[k] + np.flatnonzero(kept)).tolist()
+        if (signed_area(points[indices]) > 0) != counter_clockwise:
+            indices.reverse()
+        return indices
+
+    ring = oriented(0, True)
+    if len(ring) < 3:
+        return np.empty((0, 3), dtype=np.int64)
+    holes = [hole for k in range(1, len(rings)) if len(hole := oriented(k, False)) >= 3]
+    # bridge the rightmost holes first, so later bridges cannot cross them
+    holes.sort(key=lambda hole: -points[hole, 0].max())
+    for hole in holes:
+        ring = bridge_hole(points, ring, hole)
+    return ear_clip(points, ring)
+
+
+def cross_2d(u, v):
+    """Get the z component of the cross product of 2D vectors."""
+    u, v = np.asarray(u), np.asarray(v)
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def signed_area(points: np.ndarray) -> float:
+    """Get the signed area of a ring, positive if counter-clockwise."""
+    if len(points) < 3:
+        return 0.0
+    x, y = points[:, 0], points[:, 1]
+    return float(
+        np.dot(x[:-1], y[1:]) + x[-1] * y[0] - np.dot(x[1:], y[:-1]) - x[0] * y[-1]
+    ) / 2
+
+
+def bridge_hole(points: np.ndarray, ring: list[int], hole: list[int]) -> list[int]:
+    """Join a clockwise hole to a counter-clockwise ring, through a visible vertex."""
+    m = int(np.argmax(points[hole, 0]))
+    mx, my = points[hole[m]]
+    # closest edge crossed by a ray from the hole to the right
+    ring_points = points[ring]
+    next_points = np.roll(ring_points, -1, axis=0)
+    dy = next_points[:, 1] - ring_points[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (my - ring_points[:, 1]) / dy
+        x = ring_points[:, 0] + t * (next_points[:, 0] - ring_points[:, 0])
+    crossing = (dy != 0) & (t >= 0) & (t <= 1) & (x >= mx)
+    if not crossing.any():
+        # not inside the ring, leave it out
+        return ring
+    edge = int(np.argmin(np.where(crossing, x, np.inf)))
+    ix = x[edge]
+    # the end of the edge further right sees the hole, unless another
+    # vertex lies in the triangle between them
+    p = edge if ring_points[edge, 0] > next_points[edge, 0] else (edge + 1) % len(ring)
+    for end in (edge, (edge + 1) % len(ring)):
+        if ring_points[end, 0] == ix and ring_points[end, 1] == my:
+            p = end
+    px, py = ring_points[p]
+    if ix != px or my != py:
+        triangle = np.array([[mx, my], [ix, my], [px, py]])
+        inside = points_in_triangle(ring_points, triangle)
+        inside[p] = False
+        if inside.any():
+            candidates = np.flatnonzero(inside)
+            offsets = ring_points[candidates] - (mx, my)
+            angles = np.abs(np.arctan2(offsets[:, 1], offsets[:, 0]))
+            p = int(candidates[np.lexsort((np.hypot(*offsets.T), angles))[0]])
+    # earlier bridges repeat points, join the one facing the hole
+    for q in np.flatnonzero((ring_points == ring_points[p]).all(axis=1)):
+        corner = ring_points[[q - 1, q, (q + 1) % len(ring)]]
+        if locally_inside(corner, points[hole[m]]):
+            p = int(q)
+            break
+    return ring[: p + 1] + hole[m:] + hole[: m + 1] + ring[p:]
+
+
+def locally_inside(corner: np.ndarray, point: np.ndarray) -> bool:
+    """Get whether a point is inside the angle at a corner of a ring."""
+    previous, vertex, following = corner
+    left_of_incoming = cross_2d(vertex - previous, point - previous) >= 0
+    left_of_outgoing = cross_2d(following - vertex, point - vertex) >= 0
+    if cross_2d(vertex - previous, following - vertex) >= 0:
+        return bool(left_of_incoming and left_of_outgoing)
+    return bool(left_of_incoming or left_of_outgoing)
+
+
+def points_in_triangle(points: np.ndarray, triangle: np.ndarray) -> np.ndarray:
+    """Get which points are inside or on the edges of a triangle, in any orientation."""
+    a, b, c = triangle
+    sign = np.sign(cross_2d(b - a, c - a)) or 1
+    d1 = cross_2d(b - a, points - a) * sign
+    d2 = cross_2d(c - b, points - b) * sign
+    d3 = cross_2d(a - c, points - c) * sign
+    return (d1 >= 0) & (d2 >= 0) & (d3 >= 0)
+
+
+def ear_clip(points: np.ndarray, ring: list[int]) -> np.ndarray:
+    """Triangulate a counter-clockwise ring, possibly touching itself, by ear clipping.
+
+    Only concave corners can lie inside an ear, so only those are tested;
+    a ring without any, e.g. a rectangle, is split into a fan.
+    """
+    xy = points[ring].tolist()
+    n = len(ring)
+    previous = [(i - 1) % n for i in range(n)]
+    following = [(i + 1) % n for i in range(n)]
+
+    def corner(i: int) -> float:
+        (ax, ay), (bx, by), (cx, cy) = xy[previous[i]], xy[i], xy[following[i]]
+        return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+    concave = {i for i in range(n) if corner(i) <= 0}
+    if not concave:
+        return np.array(
+            [(ring[0], ring[i], ring[i + 1]) for i in range(1, n - 1)], dtype=np.int64
+        ).reshape(-1, 3)
+
+    def is_ear(i: int) -> bool:
+        corners = (xy[previous[i]], xy[i], xy[following[i]])
+        (ax, ay), (bx, by), (cx, cy) = corners
+        for j in concave:
+            # points repeated by bridges do not block the ear
+            if xy[j] in corners:
+                continue
+            px, py = xy[j]
+            if (
+                (bx - ax) * (py - ay) >= (by - ay) * (px - ax)
+                and (cx - bx) * (py - by) >= (cy - by) * (px - bx)
+                and (ax - cx) * (py - cy) >= (ay - cy) * (px - cx)
+            ):
+                return False
+        return True
+
+    triangles = []
+    i = 0
+    # corners tried since the last clip, to detect rings without ears
+    attempts = 0
+    while n > 3:
+        a, c = previous[i], following[i]
+        area = corner(i)
+        if area != 0 and attempts <= n and not (area > 0 and is_ear(i)):
+            i = c
+            attempts += 1
+            continue
+        # clip an ear, a corner without area, or any corner once a full
+        # turn found no ear on a degenerate ring
+        if area > 0:
+            triangles.append((ring[a], ring[i], ring[c]))
+        following[a], previous[c] = c, a
+        concave.discard(i)
+        for j in (a, c):
+            if corner(j) <= 0:
+                concave.add(j)
+            else:
+                concave.discard(j)
+        n -= 1
+        i = c
+        attempts = 0
+    a, c = previous[i], following[i]
+    if corner(i) > 0:
+        triangles.append((ring[a], ring[i], ring[c]))
+    return np.array(triangles, dtype=np.int64).reshape(-1, 3)
@@ -0,0 +1,161 @@
+"""Stage timings, counters and profiles of a function run."""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pyinstrument import Profiler
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROFILE_MODES = ("none", "cprofile", "pyinstrument")
+
+
+class RunMetrics:
+    """Thread-safe timers and counters for one run of the function."""
+
+    def __init__(self) -> None:
+        """Start with empty timers and counters."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Clear all timers and counters, restarting the run clock."""
+        with self._lock:
+            self.started = time.perf_counter()
+            self.stages: dict[str, dict] = defaultdict(
+                lambda: {"calls": 0, "seconds": 0.0}
+            )
+            self.counters: dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block of work; repeated and concurrent calls add up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name]["calls"] += 1
+                self.stages[name]["seconds"] += elapsed
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Add value to the counter called name."""
+        with self._lock:
+            self.counters[name] += int(value)
+
+    def count_meshes(self, name: str, meshes) -> None:
+        """Count meshes with their vertices and faces, e.g. for terrain or road."""
+        vertices = faces = 0
+        for mesh in meshes:
+            vertices += len(mesh.vertices) // 3
+            flat_faces = mesh.faces
+            i = 0
+            while i < len(flat_faces):
+                # each face starts with its number of vertices, 0 and 1
+                # being the legacy codes for triangles and quads
+                size = flat_faces[i]
+                i += {0: 3, 1: 4}.get(size, size) + 1
+                faces += 1
+        self.count(f"{name}.meshes", len(meshes))
+        self.count(f"{name}.vertices", vertices)
+        self.count(f"{name}.faces", faces)
+
+    def report(self) -> dict:
+        """Get stage timings, counters, cache statistics and peak memory."""
+        with self._lock:
+            report = {
+                "total_seconds": round(time.perf_counter() - self.started, 3),
+                "stages": {
+                    name: {"calls": s["calls"], "seconds": round(s["seconds"], 3)}
+                    for name, s in sorted(self.stages.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+        report["caches"] = get_cache_stats()
+        report["peak_memory_bytes"] = get_peak_memory()
+        return report
+
+    def write_report(self, path: str) -> str:
+        """Write the report as JSON to path, and return the path."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+def get_cache_stats() -> dict:
+    """Get hit and miss counters of the caches used in this process."""
+    import utils.utils_cache as utils_cache
+    import utils.utils_tiles as utils_tiles
+
+    stats = {
+        "decoded_tiles": {
+            "hits": utils_tiles.decoded_tiles.hits,
+            "misses": utils_tiles.decoded_tiles.misses,
+        }
+    }
+    # only report the stores that were opened
+    for name in ("elevation", "tessellation"):
+        if name in utils_cache._shared_caches:
+            stats[name] = utils_cache._shared_caches[name].stats()
+    if utils_tiles._tile_store is not None:
+        stats["tiles"] = {
+            "hits": utils_tiles._tile_store.hits,
+            "downloads": utils_tiles._tile_store.downloads,
+            "bytes": utils_tiles._tile_store.size(),
+        }
+    return stats
+
+
+def get_peak_memory() -> int | None:
+    """Get the peak resident memory of this process in bytes, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def profile_to(path: str, mode: str = "cprofile"):
+    """Profile the block, writing a cProfile stats file or a pyinstrument HTML page.
+
+    Both profile the calling thread only, so stages should run one by one.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"profile mode should be one of {PROFILE_MODES}")
+    if mode == "none":
+        yield None
+        return
+    folder = os.path.dirname(path)
+    if mode == "pyinstrument":
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield path
+        finally:
+            profiler.stop()
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield path
+    finally:
+        profiler.disable()
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        profiler.dump_stats(path)
+
+metrics = RunMetrics()
@@ -1,116 +1,114 @@
 import array
+import hashlib
 import math
-import shutil
-from statistics import mean
-import tempfile
-from datetime import datetime
-
-import png
-import requests
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
 from specklepy.objects import Base
 from specklepy.objects.geometry import Line, Mesh
 
-from utils.utils_pyproj import createCRS, reprojectToCrs
+from utils.utils_cache import get_tessellation_cache
+from utils.utils_http import request_with_backoff
+from utils.utils_mesh import MAX_MESH_VERTICES, triangulate_polygon
+from utils.utils_metrics import metrics
+from utils.utils_pyproj import createCRS, reprojectArrayToCrs, reprojectToCrs
+from utils.utils_tiles import (
+    TILE_ZOOM,
+    TileStore,
+    decoded_tiles,
+    get_tile_indices,
+    get_tile_store,
+)
 
 COLOR_BLD = (255 << 24) + (240 << 16) + (240 << 8) + 240  # argb
 
+OVERPASS_URL = os.environ.get(
+    "STRAVA_AUTOMATE_OVERPASS_URL", "http://overpass-api.de/api/interpreter"
+)
+# Overpass gives each client a couple of query slots
+OVERPASS_CONCURRENCY = 2
+OVERPASS_TILE_SIZE = 1000  # meters
+
+
+def get_colors_of_points_from_tiles(
+    all_locations, tile_store: TileStore | None = None
+) -> np.ndarray:
+    """Get ARGB colors of (N, 2) [lon, lat] locations from zoom 18 map tiles.
+
+    Each color is the average of 7 pixels along the diagonal around the
+    point, with reduced levels for more contrast. All needed tiles are
+    fetched into the tile store first, then each is decoded once.
+    """
+    if tile_store is None:
+        tile_store = get_tile_store()
+    locations = np.asarray(all_locations, dtype=float).reshape(-1, 2)
+    all_colors = np.zeros(len(locations), dtype=np.int64)
+    zoom = TILE_ZOOM
+
+    tile_x, tile_y, remainder_x, remainder_y = get_tile_indices(
+        locations[:, 0], locations[:, 1], zoom
+    )
+    tiles, tile_indices = np.unique(
+        np.column_stack([tile_x, tile_y]), axis=0, return_inverse=True
+    )
+    tile_store.prefetch([(zoom, x, y) for x, y in tiles.tolist()])
 
-def get_colors_of_points_from_tiles(all_locations: list[list]) -> list[int]:
-    all_colors = []
-    zoom = 18
-    lat_extent_degrees = 85.0511
-    degrees_in_tile_x = 360 / math.pow(2, zoom)
-    degrees_in_tile_y = 2 * lat_extent_degrees / math.pow(2, zoom)
-    temp_folder = "strava_automate" + str(datetime.now().timestamp())[:6]
-    temp_folder_path = os.path.join(tempfile.gettempdir(), temp_folder)
-    folderExist = os.path.exists(temp_folder_path)
-    if not folderExist:
-        os.makedirs(temp_folder_path)
-
-    for location in all_locations:
-        lon = location[0]
-        lat = location[1]
-        x = int((lon + 180) / degrees_in_tile_x)
-        y_remapped_value = lat_extent_degrees - lat / 180 * lat_extent_degrees
-        y = int(y_remapped_value / degrees_in_tile_y)
-        file_name = f"{zoom}_{x}_{y}"
-        file_path = os.path.join(temp_folder_path, f"{file_name}.png")
-        fileExists = os.path.isfile(file_path)
-        if not fileExists:
-            url = f"https://tile.openstreetmap.org/{zoom}/{int(x)}/{int(y)}.png"  #'https://tile.openstreetmap.org/3/4/2.png'
-
-            headers = {"User-Agent": "Some app in testing process"}
-            r = requests.get(url, headers=headers, stream=True)
-            if r.status_code == 200:
-                with open(file_path, "wb") as f:
-                    r.raw.decode_content = True
-                    shutil.copyfileobj(r.raw, f)
-
-        # find pixel index in the image
-        remainder_x_degrees = (lon + 180) % degrees_in_tile_x
-        remainder_y_degrees = y_remapped_value % degrees_in_tile_y
-
-        # get pixel color
-        reader = png.Reader(filename=file_path)
-        w, h, pixels, metadata = reader.read_flat()  # w = h = 256pixels each side
-        palette = metadata["palette"]
+    # points of each tile, grouped once
+    tile_indices = tile_indices.ravel()
+    order = np.argsort(tile_indices, kind="stable")
+    tile_points = np.split(
+        order, np.cumsum(np.bincount(tile_indices, minlength=len(tiles)))[:-1]
+    )
+
+    # offsets of the 7 averaged pixels
+    offset = 3
+    coeffs = np.arange(-offset, offset + 1)
+
+    for (x, y), points in zip(tiles.tolist(), tile_points):
+        # RGB pixels, w = h = 256pixels each side
+        pixels = decoded_tiles.get(tile_store.path(zoom, x, y))
+        w = pixels.shape[1]
+
+        # shift the pixel index along the diagonal, unless it leaves the tile
+        pixel_x = (remainder_x[points] * w).astype(np.int64)[:, None] + coeffs
+        pixel_x = np.where((pixel_x >= 0) & (pixel_x < w), pixel_x, pixel_x - coeffs)
+        pixel_y = (remainder_y[points] * w).astype(np.int64)[:, None] + coeffs
+        pixel_y = np.where((pixel_y >= 0) & (pixel_y < w), pixel_y, pixel_y - coeffs)
 
         # get average of surrounding pixels
-        local_colors_list = []
-        offset = 3
-        for r in range(offset * 2 + 1):
-            coeff = r - offset
-            pixel_x_index = int(remainder_x_degrees / degrees_in_tile_x * w)
-            if 0 <= pixel_x_index + coeff < w:
-                pixel_x_index += coeff
-            pixel_y_index = int(remainder_y_degrees / degrees_in_tile_y * w)
-            if 0 <= pixel_y_index + coeff < w:
-                pixel_y_index += coeff
-            pixel_index = pixel_y_index * w + pixel_x_index
-            # try:
-            color_tuple = palette[pixels[pixel_index]]
-            # except IndexError as ie:
-            #    print(pixel_y_index)
-            #    raise ie
-            # print(f"{pixel_index}_{color_tuple}")
-            local_colors_list.append(color_tuple)
-
-        average_color_tuple = (
-            int(mean([c[0] for c in local_colors_list])),
-            int(mean([c[1] for c in local_colors_list])),
-            int(mean([c[2] for c in local_colors_list])),
+        average_color = pixels[pixel_y, pixel_x].astype(np.int64).sum(axis=1) // len(
+            coeffs
         )
         # increase contrast
         factor = 5
-        average_color_tuple = (
-            int(average_color_tuple[0] / factor / 2.5) * factor,
-            int(average_color_tuple[1] / factor / 2.5) * factor,
-            int(average_color_tuple[2] / factor / 2.5) * factor,
-        )
-        color = (
+        average_color = np.trunc(average_color / factor / 2.5).astype(np.int64) * factor
+        all_colors[points] = (
             (255 << 24)
-            + (average_color_tuple[0] << 16)
-            + (average_color_tuple[1] << 8)
-            + average_color_tuple[2]
+            + (average_color[:, 0] << 16)
+            + (average_color[:, 1] << 8)
+            + average_color[:, 2]
         )
-        all_colors.append(color)
 
-    # shutil.rmtree(temp_folder_path)
     return all_colors
 
 
 def getBuildings(
     lat: float, lon: float, r: float, projectedCrs=None, existing_ids=None
 ):
-    # https://towardsdatascience.com/loading-data-from-openstreetmap-with-python-and-the-overpass-api-513882a27fd0
-    from utils.utils_elevation import get_elevation_from_points
+    footprints, all_ids = getBuildingFootprints(lat, lon, r, projectedCrs, existing_ids)
+    return extrudeBuildingFootprints(footprints), all_ids
 
-    all_ids = []
+
+def getBuildingFootprints(
+    lat: float, lon: float, r: float, projectedCrs=None, existing_ids=None
+) -> tuple[list[dict], list]:
+    """Query buildings around the location and get their footprints."""
+    # https://towardsdatascience.com/loading-data-from-openstreetmap-with-python-and-the-overpass-api-513882a27fd0
     if projectedCrs is None:
         projectedCrs = createCRS(lat, lon)
-    if existing_ids is None:
-        existing_ids = []
     lon_origin_metric, lat_origin_metric = reprojectToCrs(
         lat, lon, "EPSG:4326", projectedCrs
     )
@@ -121,325 +119,462 @@ def getBuildings(
     scaleY = latPlus1 - lat
     # r = RADIUS #meters
 
-    overpass_url = "http://overpass-api.de/api/interpreter"
-    overpass_query = f"""[out:json];
-    (node["building"]({lat-r*scaleY},{lon-r*scaleX},{lat+r*scaleY},{lon+r*scaleX});
-    way["building"]({lat-r*scaleY},{lon-r*scaleX},{lat+r*scaleY},{lon+r*scaleX});
-    relation["building"]({lat-r*scaleY},{lon-r*scaleX},{lat+r*scaleY},{lon+r*scaleX});
-    );out body;>;out skel qt;"""
-
-    # print(overpass_query)
-    for _ in range(3):
-        try:
-            response = requests.get(overpass_url, params={"data": overpass_query})
-            data = response.json()
-            break
-        except:
-            pass
-    features = data["elements"]
+    overpass_query = get_overpass_query(
+        [f"{lat-r*scaleY},{lon-r*scaleX},{lat+r*scaleY},{lon+r*scaleX}"]
+    )
+    features = fetch_overpass_elements([overpass_query])
+    return parseBuildingFootprints(features, projectedCrs, existing_ids)
 
-    ways = []
-    tags = []
 
-    rel_outer_ways = []
-    rel_outer_ways_tags = []
+def get_overpass_query(area_filters: list[str]) -> str:
+    """Get an Overpass query for buildings in each bbox or poly: area filter."""
+    statements = "".join(
+        f'{element_type}["building"]({area_filter});'
+        for area_filter in area_filters
+        for element_type in ("node", "way", "relation")
+    )
+    return f"[out:json];({statements});out body;>;out skel qt;"
+
+
+def plan_overpass_queries(
+    corridor: Polygon,
+    projectedCrs,
+    tile_size: float = OVERPASS_TILE_SIZE,
+    tolerance: float = 5,
+) -> list[str]:
+    """Split the metric route corridor into non-overlapping tiles.
+
+    Each tile becomes one poly: query.
+    """
+    minx, miny, maxx, maxy = corridor.bounds
+    tile_x, tile_y = np.meshgrid(
+        np.arange(math.floor(minx / tile_size), math.ceil(maxx / tile_size)),
+        np.arange(math.floor(miny / tile_size), math.ceil(maxy / tile_size)),
+    )
+    tiles = shapely.box(
+        tile_x.ravel() * tile_size,
+        tile_y.ravel() * tile_size,
+        (tile_x.ravel() + 1) * tile_size,
+        (tile_y.ravel() + 1) * tile_size,
+    )
+    queries = []
+    for piece in shapely.intersection(tiles, corridor):
+        # grow slightly before simplifying, so the query still covers the corridor
+        piece = piece.buffer(tolerance).simplify(tolerance)
+        area_filters = []
+        for polygon in shapely.get_parts(piece):
+            if polygon.geom_type != "Polygon" or polygon.is_empty:
+                continue
+            x, y = np.asarray(polygon.exterior.coords)[:-1, :2].T
+            lons, lats = reprojectArrayToCrs(y, x, projectedCrs, "EPSG:4326")
+            coords = " ".join(f"{lat:.7f} {lon:.7f}" for lat, lon in zip(lats, lons))
+            area_filters.append(f'poly:"{coords}"')
+        if len(area_filters) > 0:
+            queries.append(get_overpass_query(area_filters))
+    return queries
+
+
+def fetch_overpass_elements(
+    overpass_queries: list[str], max_workers: int = OVERPASS_CONCURRENCY
+) -> list[dict]:
+    """Run Overpass queries concurrently, merging elements as they arrive.
+
+    Elements returned by several queries are kept once. Tagged and
+    untagged (skeleton) copies of an element are kept apart, as they are
+    in a single Overpass response.
+    """
+    elements: dict[tuple[str, int, bool], dict] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(fetch_overpass_query, query) for query in overpass_queries
+        ]
+        for future in as_completed(futures):
+            for element in future.result():
+                key = (element["type"], element["id"], "tags" in element)
+                elements.setdefault(key, element)
+    return list(elements.values())
+
+
+def fetch_overpass_query(overpass_query: str) -> list[dict]:
+    """Get the elements returned by one Overpass query."""
+    response = request_with_backoff("POST", OVERPASS_URL, data={"data": overpass_query})
+    response.raise_for_status()
+    return response.json()["elements"]
+
+
+def parseBuildingFootprints(
+    features: list[dict], projectedCrs, existing_ids=None
+) -> tuple[list[dict], list]:
+    """Get building footprints from Overpass elements.
+
+    Each footprint has metric "coords", metric "holes" from the inner
+    rings of relations, a [lat, lon] "center", a "height", and an "id"
+    and geometry "hash" to cache its tessellation. Ways with ids in
+    existing_ids are skipped.
+    """
+    all_ids = []
+    existing_ids = set() if existing_ids is None else set(existing_ids)
 
-    ways_part = []
-    nodes = []
+    buildings = []  # (id, node ids, tags, inner rings) of each building outline
+    ways_part: dict[int, list] = {}  # way id -> node ids, for relation members
+    way_nodes: dict[int, list] = {}  # way id -> node ids, for inner members
+    relations = []  # (relation id, outer way ids, inner way ids, tags)
+    node_ids = []
+    node_lats = []
+    node_lons = []
 
     for feature in features:
         # ways
         if feature["type"] == "way":
+            if feature["id"] in existing_ids:
+                continue
+            all_ids.append(feature["id"])
+            way_nodes[feature["id"]] = feature["nodes"]
             try:
-                if feature["id"] in existing_ids:
-                    continue
-                all_ids.append(feature["id"])
-                feature["nodes"]
-
-                try:
-                    tags.append(
-                        {
-                            "building": feature["tags"]["building"],
-                            "height": feature["tags"]["height"],
-                        }
+                buildings.append(
+                    (
+                        f"way/{feature['id']}",
+                        feature["nodes"],
+                        getBuildingTags(feature["tags"]),
+                        [],
                     )
-                except:
-                    try:
-                        tags.append(
-                            {
-                                "building": feature["tags"]["building"],
-                                "levels": feature["tags"]["building:levels"],
-                            }
-                        )
-                    except:
-                        try:
-                            tags.append(
-                                {
-                                    "building": feature["tags"]["building"],
-                                    "layer": feature["tags"]["layer"],
-                                }
-                            )
-                        except:
-                            tags.append({"building": feature["tags"]["building"]})
-                ways.append({"id": feature["id"], "nodes": feature["nodes"]})
-            except:
-                ways_part.append({"id": feature["id"], "nodes": feature["nodes"]})
+                )
+            except KeyError:
+                ways_part[feature["id"]] = feature["nodes"]
 
         # relations
         elif feature["type"] == "relation":
-            outer_ways = []
             try:
-                outer_ways_tags = {
-                    "building": feature["tags"]["building"],
-                    "height": feature["tags"]["height"],
-                }
-            except:
-                try:
-                    outer_ways_tags = {
-                        "building": feature["tags"]["building"],
-                        "levels": feature["tags"]["building:levels"],
-                    }
-                except:
-                    try:
-                        outer_ways_tags = {
-                            "building": feature["tags"]["building"],
-                            "layer": feature["tags"]["layer"],
-                        }
-                    except:
-                        outer_ways_tags = {"building": feature["tags"]["building"]}
-
-            for n, x in enumerate(feature["members"]):
-                # if several Outer ways, combine them
-                if (
-                    feature["members"][n]["type"] == "way"
-                    and feature["members"][n]["role"] == "outer"
-                ):
-                    outer_ways.append({"ref": feature["members"][n]["ref"]})
-            rel_outer_ways.append(outer_ways)
-            rel_outer_ways_tags.append(outer_ways_tags)
+                outer_ways_tags = getBuildingTags(feature["tags"])
+            except KeyError:
+                continue
+            # if several Outer ways, combine them
+            outer_ways = [
+                member["ref"]
+                for member in feature["members"]
+                if member["type"] == "way" and member["role"] == "outer"
+            ]
+            # Inner ways are courtyards, they can be buildings of their own
+            inner_ways = [
+                member["ref"]
+                for member in feature["members"]
+                if member["type"] == "way" and member["role"] == "inner"
+            ]
+            relations.append(
+                (feature["id"], outer_ways, inner_ways, outer_ways_tags)
+            )
 
         # get nodes (that don't have tags)
-        elif feature["type"] == "node":
-            try:
-                feature["tags"]
-            except:
-                nodes.append(
-                    {"id": feature["id"], "lat": feature["lat"], "lon": feature["lon"]}
-                )
+        elif feature["type"] == "node" and "tags" not in feature:
+            node_ids.append(feature["id"])
+            node_lats.append(feature["lat"])
+            node_lons.append(feature["lon"])
 
-    # turn relations_OUTER into ways
-    for n, x in enumerate(rel_outer_ways):
-        # there will be a list of "ways" in each of rel_outer_ways
+    # turn relations_OUTER into ways, each member way is used once
+    for relation_id, outer_ways, inner_ways, outer_ways_tags in relations:
         full_node_list = []
-        for m, y in enumerate(rel_outer_ways[n]):
-            # find ways_parts with corresponding ID
-            for k, z in enumerate(ways_part):
-                if k == len(ways_part):
+        for ref in outer_ways:
+            full_node_list += ways_part.pop(ref, [])
+        inner_rings = join_ways(
+            [way_nodes[ref] for ref in inner_ways if ref in way_nodes]
+        )
+        buildings.append(
+            (f"relation/{relation_id}", full_node_list, outer_ways_tags, inner_rings)
+        )
+
+    # index and reproject all nodes to metric CRS in one call
+    node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+    node_lats = np.asarray(node_lats, dtype=float)
+    node_lons = np.asarray(node_lons, dtype=float)
+    nodes_x, nodes_y = reprojectArrayToCrs(
+        node_lats, node_lons, "EPSG:4326", projectedCrs
+    )
+
+    def metric_coords(indices: list[int]) -> list[dict]:
+        return [
+            {"x": x, "y": y}
+            for x, y in zip(nodes_x[indices].tolist(), nodes_y[indices].tolist())
+        ]
+
+    footprints = []
+    for building_id, ids, tags, inner_rings in buildings:
+        # replace node IDs with actual coords for each Way, ignoring the last one
+        indices = [node_index[i] for i in ids[:-1] if i in node_index]
+        if len(indices) < 3:
+            continue
+        holes = [
+            [node_index[i] for i in ring[:-1] if i in node_index]
+            for ring in inner_rings
+        ]
+        holes = [hole for hole in holes if len(hole) >= 3]
+        center = [
+            float(np.mean(node_lats[indices])),
+            float(np.mean(node_lons[indices])),
+        ]
+        footprints.append(
+            {
+                "coords": metric_coords(indices),
+                "holes": [metric_coords(hole) for hole in holes],
+                "center": center,
+                "height": getBuildingHeight(tags),
+                "id": building_id,
+                "hash": getFootprintHash(node_lats, node_lons, [indices, *holes]),
+            }
+        )
+    return footprints, all_ids
+
+
+def join_ways(ways: list[list[int]]) -> list[list[int]]:
+    """Join ways sharing end nodes into closed rings of node ids."""
+    ways = [list(way) for way in ways if len(way) > 1]
+    rings = []
+    while ways:
+        ring = ways.pop(0)
+        while ring[0] != ring[-1]:
+            for i, way in enumerate(ways):
+                if way[0] == ring[-1]:
+                    ring += way[1:]
                     break
-                if rel_outer_ways[n][m]["ref"] == ways_part[k]["id"]:
-                    full_node_list += ways_part[k]["nodes"]
-                    ways_part.pop(k)  # remove used ways_parts
-                    k -= 1  # reset index
+                if way[-1] == ring[-1]:
+                    ring += way[-2::-1]
                     break
-        ways.append({"nodes": full_node_list})
-        try:
-            tags.append(
-                {
-                    "building": rel_outer_ways_tags[n]["building"],
-                    "height": rel_outer_ways_tags[n]["height"],
-                }
-            )
-        except:
-            try:
-                tags.append(
-                    {
-                        "building": rel_outer_ways_tags[n]["building"],
-                        "levels": rel_outer_ways_tags[n]["levels"],
-                    }
-                )
-            except:
-                try:
-                    tags.append(
-                        {
-                            "building": rel_outer_ways_tags[n]["building"],
-                            "layer": rel_outer_ways_tags[n]["layer"],
-                        }
-                    )
-                except:
-                    tags.append({"building": rel_outer_ways_tags[n]["building"]})
-
-        buildingsCount = len(ways)
-        # print(buildingsCount)
-
-    all_centers = []
-    objectGroup = []
-    # get coords of Ways
-    for i, x in enumerate(ways):  # go through each Way: 2384
-        ids = ways[i]["nodes"]
-        coords = []  # replace node IDs with actual coords for each Way
-        coords_degree = []
-        height = 9
+            else:
+                # left open in the data, close it
+                ring.append(ring[0])
+                break
+            del ways[i]
+        rings.append(ring)
+    return rings
+
+
+def getFootprintHash(node_lats, node_lons, rings: list[list[int]]) -> str:
+    """Get a hash of the lat/lon rings of a footprint, independent of the CRS."""
+    indices = np.concatenate(rings)
+    digest = hashlib.sha1(np.asarray([len(ring) for ring in rings]).tobytes())
+    digest.update(np.round(node_lats[indices], 7).tobytes())
+    digest.update(np.round(node_lons[indices], 7).tobytes())
+    return digest.hexdigest()
+
+
+def getBuildingTags(feature_tags: dict) -> dict:
+    """Get the building tag and the first of height, levels or layer."""
+    tags = {"building": feature_tags["building"]}
+    for key, tag in (
+        ("height", "height"),
+        ("levels", "building:levels"),
+        ("layer", "layer"),
+    ):
+        if tag in feature_tags:
+            tags[key] = feature_tags[tag]
+            break
+    return tags
+
+
+def getBuildingHeight(tags: dict) -> float:
+    """Get building height in meters from its tags, at least 3m."""
+    height = 9
+    try:
+        height = float(cleanString(tags["levels"].split(",")[0].split(";")[0])) * 3
+    except:
         try:
-            height = (
-                float(cleanString(tags[i]["levels"].split(",")[0].split(";")[0])) * 3
-            )
+            height = float(cleanString(tags["height"].split(",")[0].split(";")[0]))
         except:
             try:
-                height = float(
-                    cleanString(tags[i]["height"].split(",")[0].split(";")[0])
-                )
+                if float(cleanString(tags["layer"].split(",")[0].split(";")[0])) < 0:
+                    height = -1 * height
             except:
-                try:
-                    if (
-                        float(cleanString(tags[i]["layer"].split(",")[0].split(";")[0]))
-                        < 0
-                    ):
-                        height = -1 * height
-                except:
-                    pass
-        if height < 3:
-            height = 3
-        for k, y in enumerate(ids):  # go through each node of the Way
-            if k == len(ids) - 1:
-                continue  # ignore last
-            for n, z in enumerate(nodes):  # go though all nodes
-                if ids[k] == nodes[n]["id"]:
-                    x, y = reprojectToCrs(
-                        nodes[n]["lat"], nodes[n]["lon"], "EPSG:4326", projectedCrs
-                    )
-                    coords.append({"x": x, "y": y})
-                    coords_degree.append({"x": nodes[n]["lon"], "y": nodes[n]["lat"]})
-                    break
+                pass
+    if height < 3:
+        height = 3
+    return height
 
-        if len(coords) < 3:
-            continue
-        elevated_center = get_elevation_from_points(
-            [
-                [
-                    mean(c["y"] for c in coords_degree),
-                    mean(c["x"] for c in coords_degree),
-                ]
-            ]
-        )[0]
-        # print(elevated_center)
-        for l, _ in enumerate(coords):
-            coords[l]["z"] = elevated_center["elevation"]
-
-        obj = extrudeBuildings(coords, height)
-        objectGroup.append(obj)
-        coords = None
-        height = None
-    return objectGroup, all_ids
 
+def extrudeBuildingFootprints(footprints: list[dict]) -> list[Mesh]:
+    """Extrude footprints from the terrain, with one elevation lookup for all."""
+    from utils.utils_elevation import get_elevation_from_points
 
-def extrudeBuildings(coords: list[dict], height: float) -> Mesh:
-    from specklepy.objects.geometry import Mesh
-
-    vertices = []
-    faces = []
-    colors = []
+    if len(footprints) == 0:
+        return []
+    elevated_centers = get_elevation_from_points([f["center"] for f in footprints])
+    rings = [[f["coords"], *f.get("holes", [])] for f in footprints]
+    sizes = [sum(len(ring) for ring in building) for building in rings]
+    rings = [ring for building in rings for ring in building]
+    coords = np.array([[c["x"], c["y"]] for ring in rings for c in ring], dtype=float)
+    return extrudeBuildingsBatch(
+        np.concatenate([[0], np.cumsum(sizes)]),
+        coords,
+        [p["elevation"] for p in elevated_centers],
+        [f["height"] for f in footprints],
+        ring_offsets=np.concatenate([[0], np.cumsum([len(ring) for ring in rings])]),
+        triangles=getFootprintTriangles(footprints),
+    )
 
-    color = COLOR_BLD  # (255<<24) + (100<<16) + (100<<8) + 100 # argb
 
-    # bottom
-    reversed_vert_indices = list(
-        range(int(len(vertices) / 3), int(len(vertices) / 3) + len(coords))
+def getFootprintTriangles(footprints: list[dict]) -> list[np.ndarray]:
+    """Triangulate each footprint with its holes, reusing cached tessellations.
+
+    Triangles index the points of the outer ring followed by the holes.
+    """
+    cache = get_tessellation_cache()
+    ids = [f["id"] for f in footprints]
+    hashes = [f["hash"] for f in footprints]
+    triangles = cache.get_many(ids, hashes)
+    missing = [i for i, t in enumerate(triangles) if t is None]
+    for i in missing:
+        footprint = footprints[i]
+        triangles[i] = triangulate_polygon(
+            [[c["x"], c["y"]] for c in footprint["coords"]],
+            [[[c["x"], c["y"]] for c in hole] for hole in footprint.get("holes", [])],
+        )
+    metrics.count("buildings.tessellated", len(missing))
+    cache.put_many(
+        [ids[i] for i in missing],
+        [hashes[i] for i in missing],
+        [triangles[i] for i in missing],
     )
-    for c in coords:
-        vertices.extend([c["x"], c["y"], c["z"]])
-        colors.append(color)
-
-    polyBorder = [
-        (vertices[ind * 3], vertices[ind * 3 + 1], vertices[ind * 3 + 2])
-        for ind in reversed_vert_indices
-    ]
-    reversed_vert_indices, inverse = fix_orientation(polyBorder, reversed_vert_indices)
-    faces.extend([len(coords)] + reversed_vert_indices)
-
-    # top
-    reversed_vert_indices = list(
-        range(int(len(vertices) / 3), int(len(vertices) / 3) + len(coords))
+    return triangles
+
+
+def extrudeBuildingsBatch(
+    offsets,
+    coords,
+    bases,
+    heights,
+    max_vertices: int = MAX_MESH_VERTICES,
+    ring_offsets=None,
+    triangles=None,
+) -> list[Mesh]:
+    """Extrude all footprints at once into a few merged meshes.
+
+    Each building gets triangulated bottom and top faces and a quad per
+    wall, including the walls of courtyards, with their own vertices so
+    walls stay flat shaded. Meshes hold whole buildings, using at most
+    max_vertices vertices each unless a single building needs more.
+
+    Args:
+        offsets: (B + 1,) start of each footprint in coords, then len(coords).
+        coords: (N, 2) metric x, y of all footprint rings, without the
+            closing point.
+        bases: (B,) ground elevation of each building.
+        heights: (B,) height of each building.
+        max_vertices: most vertices of each mesh.
+        ring_offsets: (R + 1,) start of each ring in coords, then len(coords);
+            the first ring of each footprint is its outline, the others
+            its holes. Defaults to offsets, i.e. no holes.
+        triangles: for each footprint, (T, 3) indices into its own points
+            covering its caps; triangulated here if not given.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    bases = np.asarray(bases, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    if ring_offsets is None:
+        ring_offsets = offsets
+    ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+    sizes = np.diff(offsets)
+    if len(sizes) == 0:
+        return []
+    ring_sizes = np.diff(ring_offsets)
+    ring = np.repeat(np.arange(len(ring_sizes)), ring_sizes)
+    position = np.arange(len(coords)) - ring_offsets[ring]
+    last = position == ring_sizes[ring] - 1
+    next_point = np.where(last, ring_offsets[ring], np.arange(len(coords)) + 1)
+    building = np.repeat(np.arange(len(sizes)), sizes)
+
+    # signed area of each ring; walls go around outlines counter-clockwise
+    # and around holes clockwise, so that they face out
+    cross = (
+        coords[:, 0] * coords[next_point, 1] - coords[next_point, 0] * coords[:, 1]
     )
-    for c in coords:
-        vertices.extend([c["x"], c["y"], c["z"] + height])
-        colors.append(color)
-
-    polyBorder = [
-        (vertices[ind * 3], vertices[ind * 3 + 1], vertices[ind * 3 + 2])
-        for ind in reversed_vert_indices
-    ]
-    reversed_vert_indices, inverse = fix_orientation(polyBorder, reversed_vert_indices)
-    reversed_vert_indices.reverse()
-    faces.extend([len(coords)] + reversed_vert_indices)
-
-    # sides
-    for i, c in enumerate(coords):
-        if i != len(coords) - 1:
-            nextC = coords[i + 1]  # i+1
-        else:
-            nextC = coords[0]  # 0
-
-        reversed_vert_indices = list(
-            range(int(len(vertices) / 3), int(len(vertices) / 3) + 4)
+    clockwise = np.bincount(ring, weights=cross, minlength=len(ring_sizes)) < 0
+    hole = ~np.isin(ring_offsets[:-1], offsets)
+    reverse_walls = (clockwise != hole)[ring]
+
+    if triangles is None:
+        triangles = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            starts = ring_offsets[(ring_offsets > start) & (ring_offsets < end)]
+            outline, *holes = np.split(coords[start:end], starts - start)
+            triangles.append(triangulate_polygon(outline, holes))
+    triangle_counts = np.array([len(t) for t in triangles], dtype=np.int64)
+    triangle_offsets = np.concatenate([[0], np.cumsum(triangle_counts)])
+    triangles = np.concatenate(
+        [np.asarray(t, dtype=np.int64).reshape(-1, 3) for t in triangles]
+    ) + np.repeat(offsets[:-1], triangle_counts)[:, None]
+    # cached triangles may come from another projection, make them counter-clockwise
+    a, b, c = coords[triangles[:, 0]], coords[triangles[:, 1]], coords[triangles[:, 2]]
+    clockwise = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) < (b[:, 1] - a[:, 1]) * (
+        c[:, 0] - a[:, 0]
+    )
+    triangles[clockwise] = triangles[clockwise][:, ::-1]
+
+    # 2 caps and 4 wall vertices for each footprint point
+    vertex_counts = 6 * sizes
+    vertex_ends = np.cumsum(vertex_counts)
+    meshes = []
+    first = 0
+    while first < len(sizes):
+        start = vertex_ends[first] - vertex_counts[first]
+        last = max(
+            first + 1,
+            int(np.searchsorted(vertex_ends, start + max_vertices, side="right")),
         )
-        faces.extend([4] + reversed_vert_indices)
-        if inverse is False:
-            vertices.extend(
-                [
-                    c["x"],
-                    c["y"],
-                    c["z"],
-                    c["x"],
-                    c["y"],
-                    c["z"] + height,
-                    nextC["x"],
-                    nextC["y"],
-                    c["z"] + height,
-                    nextC["x"],
-                    nextC["y"],
-                    c["z"],
-                ]
-            )
-        else:
-            vertices.extend(
-                [
-                    c["x"],
-                    c["y"],
-                    c["z"],
-                    nextC["x"],
-                    nextC["y"],
-                    c["z"],
-                    nextC["x"],
-                    nextC["y"],
-                    c["z"] + height,
-                    c["x"],
-                    c["y"],
-                    c["z"] + height,
-                ]
+        points = slice(offsets[first], offsets[last])
+        meshes.append(
+            extrudeBuildingsChunk(
+                coords[points],
+                next_point[points] - offsets[first],
+                reverse_walls[points],
+                bases[building[points]],
+                (bases + heights)[building[points]],
+                triangles[triangle_offsets[first] : triangle_offsets[last]]
+                - offsets[first],
             )
-        colors.extend([color, color, color, color])
-
-    obj = Mesh.create(faces=faces, vertices=vertices, colors=colors)
-    obj.units = "m"
-    return obj
-
-
-def fix_orientation(polyBorder, reversed_vert_indices, positive=True, coef=1):
-    sum_orientation = 0
-    for k, ptt in enumerate(polyBorder):  # pointTupleList:
-        index = k + 1
-        if k == len(polyBorder) - 1:
-            index = 0
-        pt = polyBorder[k * coef]
-        pt2 = polyBorder[index * coef]
-
-        sum_orientation += (pt2[0] - pt[0]) * (pt2[1] + pt[1])
-
-    inverse = False
-    if sum_orientation < 0:
-        reversed_vert_indices.reverse()
-        inverse = True
-    return reversed_vert_indices, inverse
+        )
+        first = last
+    return meshes
+
+
+def extrudeBuildingsChunk(
+    coords, next_point, reverse_walls, bottoms, tops, triangles
+) -> Mesh:
+    """Extrude footprint points into a single mesh.
+
+    Args:
+        coords: (N, 2) metric x, y of the points.
+        next_point: (N,) index of the next point of the same ring.
+        reverse_walls: (N,) whether the wall to the next point faces the
+            other way, e.g. on clockwise outlines.
+        bottoms: (N,) elevation of the bottom of each point.
+        tops: (N,) elevation of the top of each point.
+        triangles: (T, 3) counter-clockwise cap triangles.
+    """
+    count = len(coords)
+    bottom = np.column_stack([coords, bottoms])
+    top = np.column_stack([coords, tops])
+    # wall i: point i and the next one, at the bottom then at the top
+    walls = np.stack(
+        [bottom, bottom[next_point], top[next_point], top], axis=1
+    ).reshape(-1, 3)
+    vertices = np.concatenate([bottom, top, walls])
+
+    # caps as [3, indices...], the bottom ones reversed to face down
+    bottom_faces = np.column_stack([np.full(len(triangles), 3), triangles[:, ::-1]])
+    top_faces = np.column_stack([np.full(len(triangles), 3), count + triangles])
+    wall_indices = 2 * count + 4 * np.arange(count)[:, None] + np.arange(4)
+    wall_indices[reverse_walls] = wall_indices[reverse_walls][:, ::-1]
+    wall_faces = np.column_stack([np.full(count, 4), wall_indices])
+
+    faces = np.concatenate(
+        [bottom_faces.ravel(), top_faces.ravel(), wall_faces.ravel()]
+    )
+    mesh = Mesh.create(
+        vertices=vertices.ravel().tolist(),
+        faces=faces.tolist(),
+        colors=[COLOR_BLD] * len(vertices),
+    )
+    mesh.units = "m"
+    return mesh
 
 
 def cleanString(text: str) -> str:
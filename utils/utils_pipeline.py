@@ -0,0 +1,35 @@
+"""Run independent pipeline stages concurrently."""
+import os
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from utils.utils_metrics import metrics
+
+PIPELINE_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def run_stages(
+    stages: dict[str, Callable[[], Any]], max_workers: int = PIPELINE_WORKERS
+) -> dict[str, Any]:
+    """Run independent stages at the same time, each on its own thread.
+
+    Stages mostly wait for web services, or run numpy/shapely code that
+    releases the GIL. Results are returned in the order of `stages`,
+    whichever finishes first; the first failing stage (in that order)
+    raises once all stages are done.
+    """
+    def timed(name: str, stage: Callable[[], Any]):
+        with metrics.stage(name):
+            return stage()
+
+    if max_workers <= 1 or len(stages) <= 1:
+        return {name: timed(name, stage) for name, stage in stages.items()}
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(stages)), thread_name_prefix="stage"
+    ) as executor:
+        futures = {
+            name: executor.submit(timed, name, stage) for name, stage in stages.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
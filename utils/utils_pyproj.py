@@ -1,7 +1,10 @@
+from functools import lru_cache
 
-
+import numpy as np
 from pyproj import CRS, Transformer
 
+TRANSFORMER_CACHE_SIZE = 32
+
 
 def createCRS(lat: float, lon: float):
 
@@ -9,19 +12,35 @@ def createCRS(lat: float, lon: float):
     crs2 = CRS.from_string(newCrsString)
     return crs2
 
+@lru_cache(maxsize=TRANSFORMER_CACHE_SIZE)
+def getTransformer(crs_from, crs_to) -> Transformer:
+    """Return a (cached) transformer between two CRS, with x/y axis order."""
+    return Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
 def reprojectToCrs(lat: float, lon: float, crs_from, crs_to, direction = "FORWARD"):
 
-    transformer = Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    transformer = getTransformer(crs_from, crs_to)
     pt = transformer.transform(lon, lat, direction=direction)
 
-    return pt[0], pt[1] 
+    return pt[0], pt[1]
+
+def reprojectArrayToCrs(lat, lon, crs_from, crs_to, direction = "FORWARD"):
+    """Vectorized reprojectToCrs.
+
+    Take arrays of lat (y) and lon (x), return arrays of x and y.
+    """
+    transformer = getTransformer(crs_from, crs_to)
+    x, y = transformer.transform(
+        np.asarray(lon, dtype=float), np.asarray(lat, dtype=float), direction=direction
+    )
+    return np.asarray(x, dtype=float), np.asarray(y, dtype=float)
 
 def getBbox(lat, lon, r):
-    
+
     projectedCrs = createCRS(lat, lon)
     lonPlus1, latPlus1 = reprojectToCrs(1, 1, projectedCrs, "EPSG:4326")
     scaleX = lonPlus1 - lon
     scaleY = latPlus1 - lat
 
     bbox = (lat-r*scaleY, lon-r*scaleX, lat+r*scaleY, lon+r*scaleX)
-    return bbox 
+    return bbox
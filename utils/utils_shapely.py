@@ -1,15 +1,21 @@
-import json
-import math
-
+import numpy as np
+import shapely
 from shapely import (
     LineString,
-    buffer,
+    Polygon,
     offset_curve,
-    to_geojson,
 )
+from shapely import Point as ShapelyPoint
 from specklepy.objects import Base
 from specklepy.objects.geometry import Line, Mesh, Point, Polyline
 
+from utils.utils_mesh import MAX_MESH_VERTICES, meshes_from_buffers
+from utils.utils_pyproj import reprojectArrayToCrs
+
+ROAD_COLOR = (255 << 24) + (155 << 16) + (50 << 8) + 50  # argb
+# longest miter at sharp turns, as a multiple of the offset
+ROAD_MITER_LIMIT = 4
+
 
 def get_subset_from_list(original_list: list, i: int, koeff: int):
     count = i * koeff
@@ -22,55 +28,257 @@ def get_subset_from_list(original_list: list, i: int, koeff: int):
     return sub_list
 
 
-def road_buffer(poly: Polyline, value: float) -> Base:
-    """Create Speckle Mesh from Speckle Polyline and offset value."""
+def get_route_corridor(all_locations_2d: list, radius: float, crs_to_use) -> Polygon:
+    """Get the area within radius (meters) of the route, in the metric CRS."""
+    xs, ys = reprojectArrayToCrs(
+        [p[0] for p in all_locations_2d],
+        [p[1] for p in all_locations_2d],
+        "EPSG:4326",
+        crs_to_use,
+    )
+    if len(xs) == 1:
+        return ShapelyPoint(xs[0], ys[0]).buffer(radius)
+    return LineString(list(zip(xs, ys))).buffer(radius)
+
+
+def get_routes_corridor(all_routes_2d: list[list], radius: float, crs_to_use):
+    """Get the area within radius (meters) of any of the routes, in the metric CRS."""
+    return shapely.union_all(
+        [get_route_corridor(route, radius, crs_to_use) for route in all_routes_2d]
+    )
+
+
+def get_grid_points_in_corridor(
+    all_locations_2d: list,
+    radius: float,
+    step: int,
+    crs_to_use,
+    round_koef: int = 100000,
+    koeff: int = 20,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Get grid points within radius (meters) of the route.
+
+    The grid has a point every step/round_koef degrees. Returns (N, 2)
+    arrays of [lat, lon] and of metric [x, y] coordinates.
+    """
+    lats, lons = np.asarray(all_locations_2d, dtype=float).reshape(-1, 2).T
+    xs, ys = reprojectArrayToCrs(lats, lons, "EPSG:4326", crs_to_use)
+    if len(xs) > 1:
+        # points at most radius apart, so a simplified route with long
+        # segments does not get a few huge bboxes
+        route = shapely.segmentize(LineString(np.column_stack([xs, ys])), radius)
+        xs, ys = shapely.get_coordinates(route).T
+
+    # metric bbox around every koeff points of the route, in degrees;
+    # windows share their end points, so no segment falls between them
+    starts = np.arange(0, len(xs), koeff)
+    ends = np.minimum(starts + koeff, len(xs) - 1)
+    min_x = np.minimum(np.minimum.reduceat(xs, starts), xs[ends]) - radius
+    max_x = np.maximum(np.maximum.reduceat(xs, starts), xs[ends]) + radius
+    min_y = np.minimum(np.minimum.reduceat(ys, starts), ys[ends]) - radius
+    max_y = np.maximum(np.maximum.reduceat(ys, starts), ys[ends]) + radius
+    corners_x = np.column_stack([min_x, max_x, max_x, min_x])
+    corners_y = np.column_stack([min_y, min_y, max_y, max_y])
+    corners_lon, corners_lat = reprojectArrayToCrs(
+        corners_y.ravel(), corners_x.ravel(), crs_to_use, "EPSG:4326"
+    )
+    corners_lon = corners_lon.reshape(-1, 4)
+    corners_lat = corners_lat.reshape(-1, 4)
+
+    # integer lattice indices inside each bbox, deduplicated across bboxes
+    lat_start = np.ceil(corners_lat.min(axis=1) * round_koef / step).astype(np.int64)
+    lat_end = np.floor(corners_lat.max(axis=1) * round_koef / step).astype(np.int64)
+    lon_start = np.ceil(corners_lon.min(axis=1) * round_koef / step).astype(np.int64)
+    lon_end = np.floor(corners_lon.max(axis=1) * round_koef / step).astype(np.int64)
+    blocks = []
+    for lat_0, lat_1, lon_0, lon_1 in zip(lat_start, lat_end, lon_start, lon_end):
+        lat_index, lon_index = np.meshgrid(
+            np.arange(lat_0, lat_1 + 1), np.arange(lon_0, lon_1 + 1), indexing="ij"
+        )
+        blocks.append(np.column_stack([lat_index.ravel(), lon_index.ravel()]))
+    lattice = np.unique(np.concatenate(blocks), axis=0)
+
+    grid_points = lattice * step / round_koef
+    grid_x, grid_y = reprojectArrayToCrs(
+        grid_points[:, 0], grid_points[:, 1], "EPSG:4326", crs_to_use
+    )
+    corridor = get_route_corridor(all_locations_2d, radius, crs_to_use)
+    inside = shapely.contains_xy(corridor, grid_x, grid_y)
+    return grid_points[inside], np.column_stack([grid_x, grid_y])[inside]
+
+
+def simplify_route(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Get indices of the points kept by Douglas-Peucker simplification.
+
+    Args:
+        points: (N, 2) metric coordinates of the route.
+        tolerance: largest distance (meters) of a dropped point from the
+            simplified route.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) < 3:
+        return np.arange(len(points))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    # pending ranges, split at their farthest point until it is within tolerance
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        start, end = ranges.pop()
+        if end - start < 2:
+            continue
+        inner = points[start + 1 : end]
+        direction = points[end] - points[start]
+        length = np.hypot(*direction)
+        relative = inner - points[start]
+        if length == 0:
+            distances = np.hypot(relative[:, 0], relative[:, 1])
+        else:
+            distances = (
+                np.abs(direction[0] * relative[:, 1] - direction[1] * relative[:, 0])
+                / length
+            )
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            ranges.extend([(start, middle), (middle, end)])
+    return np.nonzero(keep)[0]
+
+
+def resample_route(points: np.ndarray, spacing: float) -> np.ndarray:
+    """Get indices of route points at least spacing (meters) apart along the route.
+
+    The first and the last point are always kept.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) < 3:
+        return np.arange(len(points))
+    distance = np.concatenate(
+        [[0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))]
+    )
+    # first point past each multiple of spacing
+    steps = np.floor(distance / spacing)
+    keep = np.append(True, steps[1:] != steps[:-1])
+    keep[-1] = True
+    return np.nonzero(keep)[0]
+
+
+def road_buffer(poly: Polyline, value: float, koeff: int = 10) -> Base:
+    """Create Speckle Mesh from Speckle Polyline and offset value.
+
+    The route is buffered in slices of koeff segments, each becoming one
+    polygon face. Vertices take z from the closest point of their slice.
+    """
     if value is None:
         return
+    # read the flat coordinate list directly instead of creating Points
+    points = np.asarray(poly.value or [], dtype=float).reshape(-1, 3)
+    if len(points) < 2:
+        return Base(units="m", displayValue=[])
+
+    # slices of koeff + 1 points, sharing their end points
+    starts = np.arange(0, len(points) - 1, koeff)
+    slice_indices = starts[:, None] + np.arange(koeff + 1)
+    in_route = slice_indices < len(points)
+    lines = shapely.linestrings(
+        points[slice_indices[in_route], :2],
+        indices=np.nonzero(in_route)[0],
+    )
+    areas = shapely.buffer(lines, value, cap_style="square")
+    coords, slice_of_vertex = shapely.get_coordinates(
+        shapely.get_exterior_ring(areas), return_index=True
+    )
+    # drop the closing vertex of each ring
+    is_last = np.append(slice_of_vertex[1:] != slice_of_vertex[:-1], True)
+    coords = coords[~is_last]
+    slice_of_vertex = slice_of_vertex[~is_last]
+
+    # z from the closest point of the same slice, so crossing parts of the
+    # route do not mix; out-of-route candidates repeat the last point
+    candidates = np.minimum(slice_indices[slice_of_vertex], len(points) - 1)
+    distances = np.hypot(
+        points[candidates, 0] - coords[:, :1], points[candidates, 1] - coords[:, 1:]
+    )
+    closest = candidates[np.arange(len(coords)), distances.argmin(axis=1)]
+    z = points[closest, 2] + 0.5
+    vertices = np.column_stack([coords, z])
+
+    color = ROAD_COLOR
     meshes = []
-    polyline_points = poly.as_points()
-    for i, _ in enumerate(polyline_points):
-        koeff = 10
-        set_of_points = get_subset_from_list(polyline_points, i, koeff)
-        if set_of_points is None:
-            break
-
-        line = LineString([(p.x, p.y, p.z) for p in set_of_points])
-        area = to_geojson(buffer(line, value, cap_style="square"))  # POLYGON to geojson
-        area = json.loads(area)
-        vertices = []
-        colors = []
-        # vetricesTuples = []
-
-        color = (255 << 24) + (155 << 16) + (50 << 8) + 50  # argb
-        # print(area["coordinates"][0])
-        for k, c in enumerate(area["coordinates"][0]):
-            # print(c)
-            if k != len(area["coordinates"][0]) - 1:
-                # get z-value from the closest polyline point
-                z_found = False
-                all_distances_points: dict = {}
-                for original_pt in set_of_points:
-                    distance = math.sqrt(
-                        math.pow(c[0] - original_pt.x, 2)
-                        + math.pow(c[1] - original_pt.y, 2)
-                    )
-                    all_distances_points.update({distance: original_pt})
-                    if distance <= 1.5 * value:
-                        vertices.extend(c + [original_pt.z + 0.5])
-                        z_found = True
-                        break
-                if z_found is False:
-                    min_distance = min(all_distances_points.keys())
-                    vertices.extend(c + [all_distances_points[min_distance].z + 0.5])
-
-                # vertices.extend(c + [0])
-                colors.append(color)
-
-        face_list = list(range(len(colors)))
+    slice_bounds = np.searchsorted(slice_of_vertex, np.arange(len(starts) + 1))
+    for start, end in zip(slice_bounds[:-1], slice_bounds[1:]):
+        count = int(end - start)
         mesh = Mesh.create(
-            vertices=vertices, colors=colors, faces=[len(colors)] + face_list
+            vertices=vertices[start:end].ravel().tolist(),
+            colors=[color] * count,
+            faces=[count] + list(range(count)),
         )
         mesh.units = "m"
         meshes.append(mesh)
 
     return Base(units="m", displayValue=meshes)
+
+
+def road_ribbon(
+    poly: Polyline, value: float, max_vertices: int = MAX_MESH_VERTICES
+) -> Base:
+    """Create a continuous road mesh offsetting the whole Speckle Polyline by value.
+
+    Every route point gets a left and a right vertex, joined with miters
+    and square caps at the ends, and every segment 2 triangles. The mesh
+    is split into chunks of at most max_vertices vertices.
+    """
+    if value is None:
+        return
+    points = np.asarray(poly.value or [], dtype=float).reshape(-1, 3)
+    # repeated points have no direction
+    if len(points) > 0:
+        keep = np.append(True, np.any(np.diff(points[:, :2], axis=0) != 0, axis=1))
+        points = points[keep]
+    if len(points) < 2:
+        return Base(units="m", displayValue=[])
+
+    directions = np.diff(points[:, :2], axis=0)
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    normals = np.column_stack([-directions[:, 1], directions[:, 0]])
+
+    # miter at each point: the average of the neighbouring segment normals,
+    # scaled to keep the offset from both segments
+    point_normals = np.concatenate(
+        [normals[:1], normals[:-1] + normals[1:], normals[-1:]]
+    )
+    lengths = np.linalg.norm(point_normals, axis=1)
+    # a U-turn has no miter, offset along the incoming segment's normal instead
+    u_turn = lengths < 1e-9
+    point_normals[u_turn] = np.concatenate([normals[:1], normals])[u_turn]
+    lengths[u_turn] = 1
+    point_normals /= lengths[:, None]
+    segment_normals = np.concatenate([normals[:1], normals])
+    cos_half_angle = np.einsum("ij,ij->i", point_normals, segment_normals)
+    scale = np.minimum(1 / np.maximum(cos_half_angle, 1e-9), ROAD_MITER_LIMIT)
+    offsets = point_normals * (value * scale)[:, None]
+
+    # square caps
+    centers = points[:, :2].copy()
+    centers[0] -= directions[0] * value
+    centers[-1] += directions[-1] * value
+
+    z = points[:, 2] + 0.5
+    vertices = np.empty((2 * len(points), 3))
+    vertices[0::2] = np.column_stack([centers + offsets, z])
+    vertices[1::2] = np.column_stack([centers - offsets, z])
+
+    # counter-clockwise from above: right, next right, next left, left
+    left = 2 * np.arange(len(points) - 1)
+    right = left + 1
+    faces = np.concatenate(
+        [
+            np.column_stack([right, right + 2, left + 2]),
+            np.column_stack([right, left + 2, left]),
+        ]
+    )
+    # keep the triangles of each segment next to each other for chunking
+    faces = faces.reshape(2, -1, 3).transpose(1, 0, 2).reshape(-1, 3)
+    colors = np.full(len(vertices), ROAD_COLOR)
+    meshes = meshes_from_buffers(vertices, faces, colors, max_vertices)
+    return Base(units="m", displayValue=meshes)
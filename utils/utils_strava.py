@@ -0,0 +1,256 @@
+"""Strava API client, streaming activity data with cached OAuth tokens."""
+import codecs
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from utils.utils_cache import TokenCache, get_token_cache
+from utils.utils_http import get_session, request_with_backoff
+
+# point at a stand-in service with e.g. STRAVA_AUTOMATE_STRAVA_URL=http://127.0.0.1:8080
+STRAVA_URL = os.environ.get("STRAVA_AUTOMATE_STRAVA_URL", "https://www.strava.com")
+STRAVA_AUTH_URL = STRAVA_URL + "/oauth/token"
+STRAVA_STREAMS_URL = STRAVA_URL + "/api/v3/activities/{activity_id}/streams"
+STRAVA_ACTIVITIES_URL = STRAVA_URL + "/api/v3/athlete/activities"
+STRAVA_PAGE_SIZE = 200
+STREAM_CHUNK_BYTES = 64 * 1024
+# refresh tokens expiring within this many seconds
+TOKEN_EXPIRY_MARGIN = 60
+# Strava allows 100 requests per 15 minutes, so keep batches modest
+STRAVA_CONCURRENCY = 4
+
+
+def iter_json_array(chunks):
+    """Yield the items of a JSON array as its text arrives in chunks of bytes.
+
+    Each item is decoded once it is complete, so the response never has
+    to be held as a whole.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    finished = False
+    started = False
+    # size the current item had at the last failed decode, to retry only
+    # after the buffer has doubled and keep parsing linear
+    attempted_size = 0
+
+    while True:
+        # skip separators between items
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if not started and pos < len(buffer):
+            if buffer[pos] != "[":
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if started and pos < len(buffer) and buffer[pos] == "]":
+            return
+
+        size = len(buffer) - pos
+        if started and size > 0 and (finished or size >= 2 * attempted_size):
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if finished:
+                    raise
+                attempted_size = size
+            else:
+                # a number could continue in the next chunk
+                if end < len(buffer) or finished:
+                    yield item
+                    buffer = buffer[end:]
+                    pos = 0
+                    attempted_size = 0
+                    continue
+                attempted_size = size
+
+        if finished:
+            raise ValueError("Unexpected end of JSON array")
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            buffer += text_decoder.decode(b"", final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
+
+
+def fetch_activity_streams(
+    access_token: str,
+    activity_id: int,
+    keys: tuple[str, ...] = ("latlng",),
+    session: requests.Session | None = None,
+) -> dict[str, list]:
+    """Get the requested streams of an activity, e.g. latlng, altitude and distance.
+
+    The response is parsed while it downloads, keeping only the
+    requested streams; streams the activity does not have are missing.
+    """
+    response = request_with_backoff(
+        "GET",
+        STRAVA_STREAMS_URL.format(activity_id=activity_id),
+        headers={"Authorization": "Bearer " + access_token},
+        params={"keys": ",".join(keys)},
+        stream=True,
+        session=session,
+    )
+    if response.status_code == 401:
+        raise PermissionError("invalid or expired token")
+    response.raise_for_status()
+
+    streams = {}
+    for item in iter_json_array(response.iter_content(STREAM_CHUNK_BYTES)):
+        if item.get("type") in keys:
+            streams[item["type"]] = item["data"]
+    return streams
+
+
+class StravaClient:
+    """Strava API client reusing pooled connections and cached OAuth tokens.
+
+    The authorization code is exchanged for a token only once; later runs
+    with the same code reuse the cached token, refreshing it when it
+    expires.
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        code: str,
+        token_cache: TokenCache | None = None,
+        session: requests.Session | None = None,
+        max_workers: int = STRAVA_CONCURRENCY,
+    ) -> None:
+        """Authorize with code, downloading max_workers activities at a time."""
+        self.client_id = str(client_id)
+        self.client_secret = client_secret
+        self.code = code
+        self.token_cache = token_cache if token_cache is not None else get_token_cache()
+        self.session = session if session is not None else get_session()
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        # the code itself is not stored
+        self._cache_key = hashlib.sha256(
+            f"{self.client_id}:{code}".encode()
+        ).hexdigest()
+
+    def access_token(self) -> str:
+        """Get a valid access token, exchanging the code only if nothing is cached."""
+        with self._lock:
+            token = self.token_cache.get(self._cache_key)
+            if token is None:
+                token = self._request_token(
+                    {"code": self.code, "grant_type": "authorization_code"}
+                )
+            elif token["expires_at"] <= time.time() + TOKEN_EXPIRY_MARGIN:
+                token = self._request_token(
+                    {
+                        "refresh_token": token["refresh_token"],
+                        "grant_type": "refresh_token",
+                    }
+                )
+            else:
+                return token["access_token"]
+            self.token_cache.put(self._cache_key, token)
+            return token["access_token"]
+
+    def _request_token(self, payload: dict) -> dict:
+        print("Requesting Token...\n")
+        res = request_with_backoff(
+            "POST",
+            STRAVA_AUTH_URL,
+            data={
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                **payload,
+            },
+            session=self.session,
+        )
+        try:
+            token = res.json()
+            return {
+                "access_token": token["access_token"],
+                "refresh_token": token["refresh_token"],
+                "expires_at": token["expires_at"],
+            }
+        except (KeyError, TypeError, ValueError) as ke:
+            raise PermissionError("invalid or expired token", ke)
+
+    def activity_streams(
+        self, activity_id: int, keys: tuple[str, ...] = ("latlng",)
+    ) -> dict[str, list]:
+        """Get the requested streams of an activity."""
+        streams = fetch_activity_streams(
+            self.access_token(), activity_id, keys, session=self.session
+        )
+        if "latlng" in keys and "latlng" not in streams:
+            raise Exception("No data found")
+        return streams
+
+    def activities_streams(
+        self, activity_ids: list[int], keys: tuple[str, ...] = ("latlng",)
+    ) -> dict[int, dict[str, list]]:
+        """Get the requested streams of several activities, fetched concurrently.
+
+        Activities without some of the streams (e.g. indoor ones without
+        latlng) get only the streams they have. Activities that cannot be
+        fetched, e.g. deleted or private ones, are left out.
+        """
+        access_token = self.access_token()
+        activity_ids = list(dict.fromkeys(activity_ids))
+        all_streams = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                activity_id: executor.submit(
+                    fetch_activity_streams,
+                    access_token,
+                    activity_id,
+                    keys,
+                    session=self.session,
+                )
+                for activity_id in activity_ids
+            }
+            for activity_id, future in futures.items():
+                try:
+                    all_streams[activity_id] = future.result()
+                except requests.RequestException as ex:
+                    print(f"Skipping activity {activity_id}: {ex}")
+        return all_streams
+
+    def activity_ids(
+        self, after: datetime | None = None, before: datetime | None = None
+    ) -> list[int]:
+        """Get the ids of the athlete's activities started between after and before."""
+        params = {"per_page": STRAVA_PAGE_SIZE}
+        if after is not None:
+            params["after"] = int(after.timestamp())
+        if before is not None:
+            params["before"] = int(before.timestamp())
+        access_token = self.access_token()
+        activity_ids = []
+        for page in itertools.count(1):
+            response = request_with_backoff(
+                "GET",
+                STRAVA_ACTIVITIES_URL,
+                headers={"Authorization": "Bearer " + access_token},
+                params=dict(params, page=page),
+                session=self.session,
+            )
+            if response.status_code == 401:
+                raise PermissionError("invalid or expired token")
+            response.raise_for_status()
+            activities = response.json()
+            activity_ids.extend(activity["id"] for activity in activities)
+            if len(activities) < STRAVA_PAGE_SIZE:
+                return activity_ids
@@ -0,0 +1,240 @@
+"""Map tiles: a bounded on-disk store, decoding, and colour sampling."""
+import math
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import png
+import requests
+import urllib3
+
+from utils.utils_cache import CACHE_DIR
+from utils.utils_http import request_with_backoff
+from utils.utils_metrics import metrics
+
+TILE_URL = os.environ.get(
+    "STRAVA_AUTOMATE_TILE_URL", "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+)
+TILE_ZOOM = 18
+LAT_EXTENT_DEGREES = 85.0511
+# the OSM tile usage policy allows 2 download connections
+TILE_CONCURRENCY = 2
+TILE_STORE_MAX_BYTES = 1024 * 1024 * 1024
+# 256x256 RGB tiles take 192 KB each when decoded
+DECODED_TILES_CACHE_SIZE = 256
+
+
+class TileFetchError(Exception):
+    """Raised when some of the map tiles could not be downloaded."""
+
+    def __init__(self, failed_tiles: list[tuple[int, int, int]]):
+        """Keep the (zoom, x, y) of every tile that failed."""
+        self.failed_tiles = failed_tiles
+        details = ", ".join(f"{z}/{x}/{y}" for z, x, y in failed_tiles[:10])
+        super().__init__(f"Failed to download {len(failed_tiles)} tile(s): {details}")
+
+
+def get_tile_indices(
+    lon: np.ndarray, lat: np.ndarray, zoom: int = TILE_ZOOM
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Get tile x, y and the position inside the tile (0 to 1) of each point."""
+    degrees_in_tile_x = 360 / math.pow(2, zoom)
+    degrees_in_tile_y = 2 * LAT_EXTENT_DEGREES / math.pow(2, zoom)
+    y_remapped_value = LAT_EXTENT_DEGREES - lat / 180 * LAT_EXTENT_DEGREES
+    tile_x = ((lon + 180) / degrees_in_tile_x).astype(np.int64)
+    tile_y = (y_remapped_value / degrees_in_tile_y).astype(np.int64)
+    remainder_x = np.remainder(lon + 180, degrees_in_tile_x) / degrees_in_tile_x
+    remainder_y = np.remainder(y_remapped_value, degrees_in_tile_y) / degrees_in_tile_y
+    return tile_x, tile_y, remainder_x, remainder_y
+
+
+class TileStore:
+    """Persistent store of map tiles saved as root/z/x/y.png.
+
+    Tiles are downloaded concurrently over the shared session. Once the
+    store holds more than max_bytes, the least recently used tiles are
+    removed.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = TILE_STORE_MAX_BYTES,
+        url: str = TILE_URL,
+        max_workers: int = TILE_CONCURRENCY,
+    ) -> None:
+        """Store tiles from url under root, downloading max_workers at a time."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.url = url
+        self.max_workers = max_workers
+        self.hits = 0
+        self.downloads = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._files())
+
+    def path(self, zoom: int, x: int, y: int) -> str:
+        """Get the path the tile is stored at."""
+        return os.path.join(self.root, str(zoom), str(x), f"{y}.png")
+
+    def get(self, zoom: int, x: int, y: int) -> str:
+        """Get the path of the tile, downloading it if it is not stored yet."""
+        self.prefetch([(zoom, x, y)])
+        return self.path(zoom, x, y)
+
+    def prefetch(self, tiles, max_workers: int | None = None) -> None:
+        """Download all missing tiles of (zoom, x, y).
+
+        Raises TileFetchError if some of them could not be downloaded.
+        """
+        tiles = list(dict.fromkeys(tiles))
+        missing = []
+        for zoom, x, y in tiles:
+            file_path = self.path(zoom, x, y)
+            if os.path.isfile(file_path):
+                # mark as recently used
+                os.utime(file_path)
+            else:
+                missing.append((zoom, x, y))
+        with self._lock:
+            self.hits += len(tiles) - len(missing)
+        if len(missing) == 0:
+            return
+
+        with metrics.stage("tiles.download"), ThreadPoolExecutor(
+            max_workers=max_workers or self.max_workers
+        ) as executor:
+            downloaded = list(executor.map(lambda tile: self._download(*tile), missing))
+        failed = [tile for tile, ok in zip(missing, downloaded) if not ok]
+        self._evict(keep=set(tiles))
+        if len(failed) > 0:
+            raise TileFetchError(failed)
+
+    def _download(self, zoom: int, x: int, y: int) -> bool:
+        file_path = self.path(zoom, x, y)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        try:
+            r = request_with_backoff(
+                "GET", self.url.format(z=zoom, x=x, y=y), stream=True
+            )
+        except requests.RequestException:
+            return False
+        with r:
+            if r.status_code != 200:
+                return False
+            # write to a temporary file first, so a tile is never read half-written
+            f = tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(file_path), suffix=".part", delete=False
+            )
+            try:
+                with f:
+                    r.raw.decode_content = True
+                    shutil.copyfileobj(r.raw, f)
+                os.replace(f.name, file_path)
+            except BaseException as ex:
+                if os.path.exists(f.name):
+                    os.remove(f.name)
+                # the connection broke off during the tile
+                if isinstance(ex, urllib3.exceptions.HTTPError):
+                    return False
+                raise
+        with self._lock:
+            self.downloads += 1
+            self._size += os.path.getsize(file_path)
+        return True
+
+    def _files(self):
+        for folder, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.endswith(".png"):
+                    stat = os.stat(os.path.join(folder, file_name))
+                    yield os.path.join(folder, file_name), stat.st_size, stat.st_mtime
+
+    def _evict(self, keep: set = frozenset()) -> None:
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+            keep_paths = {self.path(*tile) for tile in keep}
+            for file_path, size, _ in sorted(self._files(), key=lambda f: f[2]):
+                if self._size <= self.max_bytes:
+                    break
+                if file_path in keep_paths:
+                    continue
+                os.remove(file_path)
+                self._size -= size
+
+    def size(self) -> int:
+        """Get the total size of stored tiles in bytes."""
+        return self._size
+
+
+_tile_store: TileStore | None = None
+_tile_store_lock = threading.Lock()
+
+
+def get_tile_store() -> TileStore:
+    """Get the shared tile store, kept in CACHE_DIR."""
+    global _tile_store
+    with _tile_store_lock:
+        if _tile_store is None:
+            _tile_store = TileStore(os.path.join(CACHE_DIR, "tiles"))
+    return _tile_store
+
+
+def decode_tile(file_path: str) -> np.ndarray:
+    """Read a PNG tile into an (height, width, 3) array of RGB values."""
+    reader = png.Reader(filename=file_path)
+    w, h, pixels, metadata = reader.read_flat()
+    pixels = np.asarray(pixels)
+    if "palette" in metadata:
+        palette = np.array([c[:3] for c in metadata["palette"]], dtype=np.uint8)
+        return palette[pixels].reshape(h, w, 3)
+
+    pixels = pixels.reshape(h, w, metadata["planes"])
+    if metadata["bitdepth"] > 8:
+        pixels = pixels >> (metadata["bitdepth"] - 8)
+    elif metadata["bitdepth"] < 8:
+        pixels = pixels * 255 // (2 ** metadata["bitdepth"] - 1)
+    if metadata["greyscale"]:
+        pixels = np.repeat(pixels[:, :, :1], 3, axis=2)
+    return pixels[:, :, :3].astype(np.uint8)
+
+
+class DecodedTileCache:
+    """Bounded LRU of decoded tiles, keyed by file path."""
+
+    def __init__(self, max_tiles: int = DECODED_TILES_CACHE_SIZE) -> None:
+        """Keep at most max_tiles decoded tiles."""
+        self.max_tiles = max_tiles
+        self.hits = 0
+        self.misses = 0
+        self._tiles: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str) -> np.ndarray:
+        """Get the decoded tile, decoding the file if it is not cached yet."""
+        with self._lock:
+            if file_path in self._tiles:
+                self.hits += 1
+                self._tiles.move_to_end(file_path)
+                return self._tiles[file_path]
+        tile = decode_tile(file_path)
+        with self._lock:
+            self.misses += 1
+            self._tiles[file_path] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def clear(self) -> None:
+        """Drop all decoded tiles."""
+        with self._lock:
+            self._tiles.clear()
+
+
+decoded_tiles = DecodedTileCache()